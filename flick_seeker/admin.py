@@ -1,12 +1,117 @@
-from django.contrib import admin  # Djangoの管理サイト機能をインポート
-from .models import User, Movie, Review, Hashtag, ReviewHashtag, FavoriteMovie, ReviewReaction  # 同じアプリケーション内のUserモデルをインポート
+from django.contrib import admin, messages  # Djangoの管理サイト機能をインポート
+from django.contrib.admin import helpers
+from django.conf import settings
+from django.template.response import TemplateResponse
+from .models import User, Movie, Review, Hashtag, ReviewHashtag, FavoriteMovie, ReviewReaction, SlowQuery, BackgroundJob, ArchivedReview  # 同じアプリケーション内のUserモデルをインポート
 from django.contrib.auth.admin import UserAdmin as DefaultUserAdmin  # DjangoのデフォルトUserAdminをインポート
+from .search_index import search_filter  # 日本語に対応した n-gram の索引による検索
+from .paginators import EstimatedCountPaginator  # 行数を数えないページネーター
+from .jobs import start_job  # 時間のかかる処理をバックグラウンドで実行する
+from . import moderation  # 一括操作
+from .archive import restore_review  # 削除したレビューを元に戻す
+
+
+class IndexedSearchMixin:
+    """
+    管理画面の検索を、search_fields の icontains の代わりに n-gram の索引で行う。
+    search_fields は検索ボックスを表示するためと、索引を引くフィールドの指定に使う。
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        condition = search_filter(self.model, search_term, self.search_fields)
+        if condition is None:
+            return queryset, False
+        return queryset.filter(condition), False
+
+
+class RawIdFieldListFilter(admin.FieldListFilter):
+    """
+    外部キーの絞り込みを、すべての選択肢の一覧ではなくIDの入力欄で行うフィルター。
+    ユーザーや映画のように件数が多いテーブルでも、選択肢を読み込まずに表示できる。
+    """
+    template = 'admin/raw_id_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        self.lookup_val = params.get(self.lookup_kwarg)
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.title = field.verbose_name
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        # 入力欄のフォームで送信するときに、他の絞り込みや検索の条件を引き継ぐ
+        self.hidden_params = [(key, value) for key, value in changelist.params.items() if key != self.lookup_kwarg]
+        yield {
+            'selected': self.lookup_val is None,
+            'query_string': changelist.get_query_string(remove=[self.lookup_kwarg]),
+            'display': 'すべて',
+        }
+        if self.lookup_val is not None:
+            selected = self.field.related_model._default_manager.filter(pk=self.lookup_val).first()
+            yield {
+                'selected': True,
+                'query_string': changelist.get_query_string({self.lookup_kwarg: self.lookup_val}),
+                'display': selected if selected is not None else self.lookup_val,
+            }
+
+
+def confirm_action(modeladmin, request, queryset, message):
+    """
+    取り消せない一括操作の確認画面を返す。確認済み（post=yes）の場合は None を返す。
+    選択した行をすべて一覧にすると大量の行で遅くなるため、件数だけを表示する。
+    """
+    if request.POST.get('post'):
+        return None
+    context = {
+        **modeladmin.admin_site.each_context(request),
+        'title': '確認',
+        'opts': modeladmin.model._meta,
+        'message': message,
+        'action': request.POST['action'],
+        'select_across': request.POST.get('select_across', '0'),
+        'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+        'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+    }
+    return TemplateResponse(request, 'admin/bulk_action_confirmation.html', context)
+
+
+def run_bulk_action(modeladmin, request, name, func, *args, count):
+    """
+    一括操作をジョブとして実行する。BULK_ACTION_SYNC_LIMIT 件を超える場合は、
+    リクエストがタイムアウトしないようバックグラウンドで実行し、ジョブの一覧で進み具合を確認できるようにする。
+    """
+    background = count > settings.BULK_ACTION_SYNC_LIMIT
+    job = start_job(name, func, *args, user=request.user, background=background)
+    if background:
+        modeladmin.message_user(request, f'ジョブ #{job.pk}「{name}」を開始しました。進み具合はバックグラウンドジョブの一覧で確認できます。')
+    elif job.status == 'failed':
+        modeladmin.message_user(request, f'{name}に失敗しました: {job.message}', messages.ERROR)
+    else:
+        modeladmin.message_user(request, job.message)
+
+
+def selection_count(queryset):
+    # バックグラウンドで実行するかを決めるための件数（BULK_ACTION_SYNC_LIMIT を超えた分は数えない）
+    return queryset.order_by()[:settings.BULK_ACTION_SYNC_LIMIT + 1].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    行数の多いテーブルの一覧の設定。
+    COUNT(*) を実行しないページネーターを使い、絞り込み前の全件数も数えない。
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 class UserAdmin(DefaultUserAdmin):
     # デフォルトのUserAdmin設定をカスタマイズするクラス
     model = User  # このUserAdminが扱うモデルを指定
     list_display = ['email', 'is_staff', 'is_active']  # 管理画面のリスト表示に使用するフィールド
-    list_filter = ['email', 'is_staff', 'is_active']  # リスト画面でフィルター可能なフィールド
+    list_filter = ['is_staff', 'is_active']  # リスト画面でフィルター可能なフィールド（メールアドレスは全ユーザーが並ぶため検索を使う）
+    paginator = EstimatedCountPaginator  # ユーザー数が多くても COUNT(*) を実行しない
+    show_full_result_count = False
     search_fields = ['email']  # リスト画面で検索可能なフィールド
     ordering = ['email']  # リスト画面でのデフォルトの並び順
     
@@ -14,39 +119,163 @@ admin.site.register(User, UserAdmin)  # Djangoの管理サイトにUserモデル
 
 # 映画モデルを管理画面に登録
 @admin.register(Movie)
-class MovieAdmin(admin.ModelAdmin):
+class MovieAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ('title', 'director', 'release_year', 'created_at', 'updated_at')
     search_fields = ('title', 'director', 'cast')
     list_filter = ('director', 'release_year')  # フィルタに使用するフィールド
+    actions = ['merge_movies']
+
+    @admin.action(description='選択した映画を最も古いものに統合する', permissions=['delete'])
+    def merge_movies(self, request, queryset):
+        movies = list(queryset.order_by('pk'))
+        if len(movies) < 2:
+            self.message_user(request, '統合する映画を2件以上選択してください。', messages.WARNING)
+            return None
+        target, duplicates = movies[0], movies[1:]
+        response = confirm_action(self, request, queryset, f'{len(duplicates)}件の映画を「{target.title}」（ID {target.pk}）に統合し、レビューとお気に入りを移します。統合した映画は削除されます。')
+        if response:
+            return response
+        count = Review.objects.filter(movie__in=duplicates).count()
+        run_bulk_action(self, request, f'映画の統合（{target.title}）', moderation.merge_movies, target, duplicates, count=count)
 
 # レビューモデルを管理画面に登録
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
+class ReviewAdmin(IndexedSearchMixin, LargeTableAdmin):
     list_display = ('user', 'movie', 'rating', 'title', 'created_at', 'updated_at')
+    list_select_related = ('user', 'movie')
     search_fields = ('title', 'comment')
-    list_filter = ('rating',)
+    list_filter = ('rating', ('user', RawIdFieldListFilter), ('movie', RawIdFieldListFilter))
+    autocomplete_fields = ('user', 'movie')
+    actions = ['mark_spoiler', 'delete_reviews']
+
+    def get_actions(self, request):
+        # 標準の削除は確認画面にすべての行を並べ、1件ずつ削除するため、一括削除に置き換える
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    @admin.action(description='選択したレビューをネタバレありにする', permissions=['change'])
+    def mark_spoiler(self, request, queryset):
+        run_bulk_action(self, request, 'レビューのネタバレの設定', moderation.mark_spoiler, queryset, count=selection_count(queryset))
+
+    @admin.action(description='選択したレビューを削除する', permissions=['delete'])
+    def delete_reviews(self, request, queryset):
+        count = selection_count(queryset)
+        shown = f'{count}件' if count <= settings.BULK_ACTION_SYNC_LIMIT else f'{settings.BULK_ACTION_SYNC_LIMIT}件以上'
+        response = confirm_action(self, request, queryset, f'{shown}のレビューと、そのハッシュタグ、Good/Bad のリアクションを削除します。')
+        if response:
+            return response
+        run_bulk_action(self, request, 'レビューの削除', moderation.delete_reviews, queryset, count=count)
 
 # ハッシュタグモデルを管理画面に登録
 @admin.register(Hashtag)
 class HashtagAdmin(admin.ModelAdmin):
-    list_display = ('label', 'created_at')
+    list_display = ('label', 'category', 'created_at')
     search_fields = ('label',)
+    actions = ['merge_hashtags']
+
+    @admin.action(description='選択したハッシュタグを最も古いものに統合する', permissions=['delete'])
+    def merge_hashtags(self, request, queryset):
+        hashtags = list(queryset.order_by('pk'))
+        if len(hashtags) < 2:
+            self.message_user(request, '統合するハッシュタグを2件以上選択してください。', messages.WARNING)
+            return None
+        target, duplicates = hashtags[0], hashtags[1:]
+        response = confirm_action(self, request, queryset, f'{len(duplicates)}件のハッシュタグを「{target.label}」に統合します。統合したハッシュタグは削除されます。')
+        if response:
+            return response
+        count = ReviewHashtag.objects.filter(hashtag__in=duplicates).count()
+        run_bulk_action(self, request, f'ハッシュタグの統合（{target.label}）', moderation.merge_hashtags, target, duplicates, count=count)
 
 # レビューとハッシュタグの関連モデルを管理画面に登録
 @admin.register(ReviewHashtag)
-class ReviewHashtagAdmin(admin.ModelAdmin):
+class ReviewHashtagAdmin(LargeTableAdmin):
     list_display = ('review', 'hashtag', 'created_at')
-    list_filter = ('hashtag',)
+    list_select_related = ('review__user', 'review__movie', 'hashtag')  # Review.__str__ はユーザー名と映画のタイトルを使う
+    list_filter = ('hashtag', ('review', RawIdFieldListFilter))
+    raw_id_fields = ('review',)
+    autocomplete_fields = ('hashtag',)
 
 # お気に入り映画モデルを管理画面に登録
 @admin.register(FavoriteMovie)
-class FavoriteMovieAdmin(admin.ModelAdmin):
+class FavoriteMovieAdmin(LargeTableAdmin):
     list_display = ('user', 'movie', 'created_at')
-    list_filter = ('user', 'movie')
+    list_select_related = ('user', 'movie')
+    list_filter = (('user', RawIdFieldListFilter), ('movie', RawIdFieldListFilter))
+    autocomplete_fields = ('user', 'movie')
 
 # レビューリアクションモデルを管理画面に登録
 @admin.register(ReviewReaction)
-class ReviewReactionAdmin(admin.ModelAdmin):
+class ReviewReactionAdmin(LargeTableAdmin):
     list_display = ('user', 'review', 'rating_type', 'created_at')
-    list_filter = ('rating_type',)
+    list_select_related = ('user', 'review__user', 'review__movie')  # Review.__str__ はユーザー名と映画のタイトルを使う
+    list_filter = ('rating_type', ('user', RawIdFieldListFilter), ('review', RawIdFieldListFilter))
+    raw_id_fields = ('review',)
+    autocomplete_fields = ('user',)
+
+# スロークエリの記録を管理画面に登録（閲覧と削除のみ）
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'view_name', 'duration_ms', 'fingerprint', 'normalized_sql')
+    list_filter = ('view_name',)
+    search_fields = ('fingerprint', 'normalized_sql')
+    readonly_fields = ('fingerprint', 'normalized_sql', 'sql', 'params', 'view_name', 'duration_ms', 'explain', 'created_at')
+
+    def has_add_permission(self, request):
+        # スロークエリはミドルウェアからのみ記録する
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+# 削除されたレビューのアーカイブを管理画面に登録（閲覧と元に戻す操作のみ）
+@admin.register(ArchivedReview)
+class ArchivedReviewAdmin(LargeTableAdmin):
+    list_display = ('title', 'user', 'movie', 'rating', 'deleted_at')
+    list_select_related = ('user', 'movie')
+    list_filter = (('user', RawIdFieldListFilter), ('movie', RawIdFieldListFilter))
+    readonly_fields = ('review_id', 'user', 'movie', 'rating', 'title', 'comment', 'spoiler', 'good_count', 'bad_count', 'hashtag_ids', 'created_at', 'updated_at', 'deleted_at')
+    exclude = ('reactions',)
+    actions = ['restore_reviews']
+
+    @admin.action(description='選択したレビューを元に戻す', permissions=['delete'])
+    def restore_reviews(self, request, queryset):
+        restored = skipped = 0
+        for archived in queryset:
+            if restore_review(archived) is None:
+                skipped += 1
+            else:
+                restored += 1
+        self.message_user(request, f'{restored}件のレビューを元に戻しました。')
+        if skipped:
+            self.message_user(request, f'{skipped}件は、同じユーザーが同じ映画に別のレビューを書いているため戻せませんでした。', messages.WARNING)
+
+    def has_add_permission(self, request):
+        # アーカイブはレビューの削除時にのみ作成する
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+# バックグラウンドジョブを管理画面に登録（進み具合と結果の確認のみ）
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'progress_display', 'message', 'created_by', 'created_at', 'finished_at')
+    list_select_related = ('created_by',)
+    list_filter = ('status',)
+    readonly_fields = ('name', 'status', 'total', 'done', 'message', 'created_by', 'created_at', 'started_at', 'finished_at')
+
+    @admin.display(description='進み具合')
+    def progress_display(self, obj):
+        if obj.progress is None:
+            return f'{obj.done}件'
+        return f'{obj.progress}%（{obj.done}/{obj.total}件）'
+
+    def has_add_permission(self, request):
+        # ジョブは一括操作からのみ作成する
+        return False
 
+    def has_change_permission(self, request, obj=None):
+        return False
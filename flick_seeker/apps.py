@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class FlickSeekerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'flick_seeker'
+
+    def ready(self):
+        # ユーザーのキャッシュを削除するシグナルを登録する
+        from . import signals  # noqa: F401
@@ -0,0 +1,117 @@
+"""
+古いリアクションと削除されたレビューのアーカイブ。
+
+リアクションは投票の取り消しと変更のためだけに使われ、件数は Review.good_count / bad_count に集計済みのため、
+古いものは誰がどちらに投票したかだけを ArchivedReaction に移し、ReviewReaction を小さく保つ。
+アーカイブ済みの投票を取り消す、または変更する場合は、get_or_restore_reaction が ReviewReaction に戻してから処理する。
+削除されたレビューは ArchivedReview に移し、管理画面から元に戻せるようにする。
+"""
+from django.db import transaction
+
+from .models import ArchivedReaction, ArchivedReview, Hashtag, Review, ReviewHashtag, ReviewReaction, User
+from .moderation import recount_reactions
+from .stats import reconcile_users
+
+
+def archive_reactions(before, batch_size=1000):
+    """
+    before より前に作成されたリアクションをアーカイブに移し、移した件数を順に返す。
+    バッチごとにコミットするため、途中で止めても移した分はそのまま残る。
+    """
+    reactions = ReviewReaction.objects.filter(created_at__lt=before).order_by('pk')
+    while True:
+        batch = list(reactions.values_list('pk', 'review_id', 'user_id', 'rating_type')[:batch_size])
+        if not batch:
+            return
+        with transaction.atomic():
+            # 同じユーザーの重複したリアクションがある場合は、新しいものを残す
+            ArchivedReaction.objects.bulk_create(
+                [ArchivedReaction(review_id=review_id, user_id=user_id, is_good=rating_type == 'good')
+                 for _, review_id, user_id, rating_type in batch],
+                update_conflicts=True,
+                unique_fields=['review', 'user'],
+                update_fields=['is_good'],
+            )
+            ReviewReaction.objects.filter(pk__in=[pk for pk, *_ in batch]).delete()
+        yield len(batch)
+
+
+def get_or_restore_reaction(review, user, vote_type):
+    """
+    ReviewReaction.objects.get_or_create と同じく (リアクション, 作成したかどうか) を返す。
+    ReviewReaction になく、アーカイブにある場合は、アーカイブから戻したものを既存のリアクションとして返す。
+    """
+    try:
+        return ReviewReaction.objects.get(review=review, user=user), False
+    except ReviewReaction.DoesNotExist:
+        pass
+    with transaction.atomic():
+        archived = ArchivedReaction.objects.filter(review=review, user=user).first()
+        if archived is None:
+            return ReviewReaction.objects.create(review=review, user=user, rating_type=vote_type), True
+        archived.delete()
+        reaction = ReviewReaction.objects.create(review=review, user=user, rating_type='good' if archived.is_good else 'bad')
+    return reaction, False
+
+
+def archive_review(review):
+    """
+    レビューを、ハッシュタグとリアクションとともにアーカイブに移してから削除する。
+    検索の索引と入力補完の人気度は、削除時のシグナルで更新される。
+    """
+    reactions = [
+        [user_id, rating_type == 'good']
+        for user_id, rating_type in review.reviewreaction_set.values_list('user_id', 'rating_type')
+    ]
+    reactions += [list(row) for row in review.archivedreaction_set.values_list('user_id', 'is_good')]
+    with transaction.atomic():
+        ArchivedReview.objects.create(
+            review_id=review.pk,
+            user_id=review.user_id,
+            movie_id=review.movie_id,
+            rating=review.rating,
+            title=review.title,
+            comment=review.comment,
+            spoiler=review.spoiler,
+            good_count=review.good_count,
+            bad_count=review.bad_count,
+            hashtag_ids=list(review.reviewhashtag_set.values_list('hashtag_id', flat=True)),
+            reactions=reactions,
+            created_at=review.created_at,
+            updated_at=review.updated_at,
+        )
+        review.delete()
+
+
+def restore_review(archived):
+    """
+    アーカイブしたレビューを同じIDで作り直す。同じユーザーが同じ映画に別のレビューを書いている場合は戻さずに None を返す。
+    """
+    if Review.objects.filter(user_id=archived.user_id, movie_id=archived.movie_id).exists():
+        return None
+    with transaction.atomic():
+        review = Review.objects.create(
+            pk=archived.review_id,
+            user_id=archived.user_id,
+            movie_id=archived.movie_id,
+            rating=archived.rating,
+            title=archived.title,
+            comment=archived.comment,
+            spoiler=archived.spoiler,
+        )
+        # 作成日時と更新日時は自動で設定されるため、元の日時に戻す
+        Review.objects.filter(pk=review.pk).update(created_at=archived.created_at, updated_at=archived.updated_at)
+        hashtags = Hashtag.objects.filter(pk__in=archived.hashtag_ids)
+        ReviewHashtag.objects.bulk_create([ReviewHashtag(review=review, hashtag=hashtag) for hashtag in hashtags])
+        # リアクションはアーカイブに戻し、退会したユーザーの分を除いて Good/Bad 数を数え直す
+        user_ids = set(User.objects.filter(pk__in=[user_id for user_id, _ in archived.reactions]).values_list('pk', flat=True))
+        ArchivedReaction.objects.bulk_create([
+            ArchivedReaction(review=review, user_id=user_id, is_good=is_good)
+            for user_id, is_good in archived.reactions
+            if user_id in user_ids
+        ])
+        recount_reactions([review.pk])
+        # 作成時のシグナルでは Good/Bad 数とハッシュタグが反映されないため、投稿したユーザーの統計を数え直す
+        reconcile_users([review.user_id])
+        archived.delete()
+    return review
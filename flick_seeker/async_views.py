@@ -0,0 +1,239 @@
+"""
+読み取りが中心のビューの非同期版。
+
+ASGI で動かす場合に settings.ASYNC_READ_VIEWS を True にすると、urls.py から同期版の代わりに使われる。
+互いに依存しないクエリは asyncio.gather でまとめて発行し、テンプレートの描画はスレッドで行う。
+Good/Bad 数とお気に入り数を配信する Server-Sent Events のビューもここに置く。
+"""
+import asyncio
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.core.paginator import Paginator
+from django.db.models import Count, Prefetch
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import render
+
+from .broker import count_broker
+from .favorites import favorite_movie_ids
+from .models import FavoriteMovie, Hashtag, Movie, Review, ReviewHashtag
+from .search import search_movies, with_average_rating
+from .views import (
+    MOVIE_SORT_ORDERS, REVIEW_SORT_ORDERS, SEARCH_RESULTS_PER_PAGE, page_querystring, sort_options, with_comment_previews,
+)
+
+RECEIVE_SCOPE_KEY = 'flick_seeker.receive'  # expose_receive が scope に入れる ASGI の receive
+
+
+def async_login_required(view_func):
+    """
+    非同期ビュー用の login_required。
+    request.user の読み込みはデータベースにアクセスするため、スレッドで実行してから判定する。
+    """
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+async def aget_object_or_404(queryset, **kwargs):
+    # get_object_or_404 の非同期版
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+
+
+def expose_receive(application):
+    """
+    ASGI の receive を scope に入れて、ビューから request.scope 経由で使えるようにするラッパー。
+    Django 4.2 の ASGIHandler はストリーミングの応答の途中でクライアントが切断しても配信を止めないため、
+    movie_events は receive で http.disconnect を待って自分で配信を終える。
+    """
+    async def wrapper(scope, receive, send):
+        if scope['type'] == 'http':
+            scope = {**scope, RECEIVE_SCOPE_KEY: receive}
+        return await application(scope, receive, send)
+    return wrapper
+
+
+async def wait_for_disconnect(receive):
+    # リクエストの本文は読み終えているので、次に届くのはクライアントの切断だけ
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def alist(queryset):
+    # クエリセットを非同期に評価してリストにする
+    return [obj async for obj in queryset]
+
+
+async def arender(request, template_name, context):
+    # テンプレートの描画はメッセージやセッションへのアクセスを含むため、スレッドで実行する
+    return await sync_to_async(render)(request, template_name, context)
+
+
+def reviews_with_hashtags(movie_id):
+    # レビュー一覧の表示に必要なユーザーとハッシュタグをまとめて取得するクエリセット
+    return Review.objects.filter(movie_id=movie_id).select_related('user').prefetch_related(
+        Prefetch(
+            'reviewhashtag_set',
+            queryset=ReviewHashtag.objects.select_related('hashtag'),
+            to_attr='hashtags'
+        )
+    ).order_by('-created_at')
+
+
+@async_login_required
+async def dashboard(request):
+    # 前のリクエストから残っているメッセージをクリアする（同期版と同じ動作）
+    def clear_messages():
+        storage = messages.get_messages(request)
+        for _ in storage:
+            pass
+        storage.used = True
+
+    # ジャンル、シチュエーション、お気に入り数の多い映画、評価の高い映画を同時に取得する
+    _, genres, situations, movies, top_rated_movies = await asyncio.gather(
+        sync_to_async(clear_messages)(),
+        alist(Hashtag.objects.filter(category='genre')),
+        alist(Hashtag.objects.filter(category='situation')),
+        alist(Movie.objects.annotate(favorites_count=Count('favoritemovie')).order_by('-favorites_count')[:3]),
+        alist(with_average_rating(Movie.objects.order_by('-bayesian_rating'))[:3]),
+    )
+
+    context = {
+        'movies': movies,
+        'top_rated_movies': top_rated_movies,
+        'movie_sort_options': [(key, label) for key, (label, _) in MOVIE_SORT_ORDERS.items()],
+        'genres': genres,
+        'situations': situations,
+    }
+    return await arender(request, 'dashboard.html', context)
+
+
+@async_login_required
+async def search_results(request):
+    # 検索条件を取得
+    query = request.GET.get('query')
+    selected_genres = request.GET.getlist('genre')
+    selected_situations = request.GET.getlist('situation')
+    rating_from = request.GET.get('rating_from')
+
+    # 同期版と同じクエリセットを組み立てる。件数を数えるクエリはスレッドで実行し、ページの分はテンプレートの描画時に読み込む
+    ordering, sort_context = sort_options(request, MOVIE_SORT_ORDERS)
+    movies_qs = search_movies(query, selected_genres, selected_situations, rating_from, ordering)
+    movies = await sync_to_async(Paginator(movies_qs, SEARCH_RESULTS_PER_PAGE).get_page)(request.GET.get('page'))
+
+    context = {
+        'movies': movies,
+        'query': query,
+        'selected_genres': selected_genres,
+        'selected_situations': selected_situations,
+        'rating_from': rating_from,
+        'querystring': page_querystring(request),
+        **sort_context,
+    }
+    return await arender(request, 'search_results.html', context)
+
+
+@async_login_required
+async def movie_detail(request, movie_id):
+    movie = await aget_object_or_404(with_average_rating(Movie.objects.all()), pk=movie_id)
+
+    # レビュー、お気に入り状態、お気に入り数は互いに依存しないので同時に取得する
+    # （レビュー数と平均評価は映画に保存した集計を使う）
+    reviews, favorite_ids, favorites_count = await asyncio.gather(
+        sync_to_async(with_comment_previews)(reviews_with_hashtags(movie.id)[:3]),
+        sync_to_async(favorite_movie_ids)(request.user),
+        FavoriteMovie.objects.filter(movie=movie).acount(),
+    )
+    is_favorited = movie.id in favorite_ids
+
+    all_reviews_count = movie.review_count
+    average_rating = movie.average_rating
+    if average_rating is None:
+        average_rating = "評価なし"
+
+    context = {
+        'movie': movie,
+        'reviews': reviews,
+        'average_rating': average_rating,
+        'all_reviews_count': all_reviews_count,
+        'is_favorited': is_favorited,
+        'favorites_count': favorites_count,
+        'live_updates': settings.LIVE_UPDATES,
+    }
+    return await arender(request, 'movie_detail.html', context)
+
+
+@async_login_required
+async def all_movie_reviews(request, movie_id):
+    movie = await aget_object_or_404(Movie.objects.all(), pk=movie_id)
+    ordering, sort_context = sort_options(request, REVIEW_SORT_ORDERS)
+    reviews = await sync_to_async(with_comment_previews)(reviews_with_hashtags(movie.id).order_by(*ordering))
+    context = {
+        'movie': movie,
+        'reviews': reviews,
+        'live_updates': settings.LIVE_UPDATES,
+        **sort_context,
+    }
+    return await arender(request, 'all_movie_reviews.html', context)
+
+
+@async_login_required
+async def movie_events(request, movie_id):
+    """
+    映画ページの Good/Bad 数とお気に入り数の更新を Server-Sent Events で配信するビュー。
+    接続を保持し続けるため、ASGI で動かす場合（LIVE_UPDATES が True の場合）にのみ使う。
+    クライアントの切断（expose_receive で受け取る http.disconnect）か LIVE_UPDATE_STREAM_SECONDS 秒で配信を終える。
+    """
+    if not settings.LIVE_UPDATES:
+        # WSGI ではストリーミングの応答を最後まで読み込んでから送るため、終わらない配信はワーカーを占有し続ける
+        raise Http404
+    await aget_object_or_404(Movie.objects.all(), pk=movie_id)
+    receive = request.scope.get(RECEIVE_SCOPE_KEY)
+
+    async def event_stream():
+        # クライアントが切断するか、LIVE_UPDATE_STREAM_SECONDS 秒が過ぎたら配信を終えて購読を解除する
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.LIVE_UPDATE_STREAM_SECONDS
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive)) if receive else None
+        messages = count_broker.subscribe(movie_id)
+        next_message = None
+        try:
+            while True:
+                next_message = asyncio.ensure_future(messages.__anext__())
+                done, _ = await asyncio.wait(
+                    {next_message, disconnected} - {None},
+                    timeout=max(deadline - loop.time(), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if next_message not in done:
+                    break
+                message = next_message.result()
+                if not message:
+                    # 接続を維持するためのコメント行
+                    yield ': keepalive\n\n'
+                    continue
+                yield f'event: counts\ndata: {json.dumps(message)}\n\n'
+        finally:
+            if disconnected:
+                disconnected.cancel()
+            if next_message and not next_message.done():
+                # 待機中の購読を取り消して、購読の解除（subscribe の finally）が終わるまで待つ
+                next_message.cancel()
+                await asyncio.gather(next_message, return_exceptions=True)
+            await messages.aclose()
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx のバッファリングを無効にする
+    return response
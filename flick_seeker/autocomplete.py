@@ -0,0 +1,238 @@
+"""
+検索ボックスの入力補完に使う、映画のタイトル、監督、出演者のメモリ上の索引。
+
+正規化した文字列をソート済みのリストに保持し、bisect で前方一致する範囲を探す。
+候補はお気に入り数とレビュー数の合計（人気度）が大きい順に返す。
+映画の保存、削除と、お気に入り、レビューの追加、削除はシグナルから差分で反映する。
+索引はプロセスごとに持つため、他のプロセスでの変更は AUTOCOMPLETE_REBUILD_SECONDS ごとの再構築で反映される。
+AUTOCOMPLETE_SHORT_PREFIX_LENGTH 文字以下の入力は索引のほぼ全体に前方一致するため、候補ごとの人気度の合計を
+入力ごとに差分で更新しておき、順位は変更があった入力だけ次の検索で計算し直す。
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Count
+
+from .text import normalize_text
+
+# 出演者の区切り文字（全角スペースや読点で区切って登録されている）
+_CAST_SEPARATOR_RE = re.compile(r'[,、，/／　\n]+')
+
+KIND_TITLE = 'title'
+KIND_DIRECTOR = 'director'
+KIND_CAST = 'cast'
+
+
+def normalize_term(value):
+    # 全角と半角、大文字と小文字、ひらがなとカタカナの違いを吸収する（検索と同じ正規化）
+    return normalize_text(value)
+
+
+def movie_terms(movie):
+    """
+    映画から (種類, 表示する文字列) の組を返す。
+    出演者は区切り文字で分割し、一人ずつ候補にする。
+    """
+    terms = [(KIND_TITLE, movie.title.strip())]
+    if movie.director.strip():
+        terms.append((KIND_DIRECTOR, movie.director.strip()))
+    for name in _CAST_SEPARATOR_RE.split(movie.cast):
+        if name.strip():
+            terms.append((KIND_CAST, name.strip()))
+    return terms
+
+
+def candidate_group(kind, display, movie_id):
+    # 同じタイトルの別の映画は別の候補にする。タイトルの候補は詳細ページに移動できるよう映画IDを持つ
+    # （監督や出演者は複数の映画に登場するため、映画をまたいで1つの候補にまとめる）
+    return (kind, display, movie_id if kind == KIND_TITLE else None)
+
+
+def rank_candidates(scores, limit):
+    # 人気度の高い順に並べる。人気度が同じ場合は短い候補を優先する
+    return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -len(item[0][1])))
+
+
+def add_short_scores(short_scores, groups, popularity, movies):
+    # 短い入力ごとの候補の人気度の合計と映画の数を加減する。映画の数が 0 になった候補は削除する
+    for prefix, group in groups:
+        scores = short_scores.setdefault(prefix, {})
+        score = scores.setdefault(group, [0, 0])
+        score[0] += popularity
+        score[1] += movies
+        if not score[1]:
+            del scores[group]
+            if not scores:
+                del short_scores[prefix]
+
+
+def index_keys(display):
+    # 先頭からの一致に加えて、"Top Gun" を "gun" でも見つけられるよう単語の先頭からも索引する
+    normalized = normalize_term(display)
+    words = normalized.split(' ')
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []  # (正規化したキー, 種類, 表示する文字列, 映画ID) のソート済みリスト
+        self._by_movie = {}  # 映画ID -> その映画のエントリ
+        self._popularity = defaultdict(int)  # 映画ID -> お気に入り数 + レビュー数
+        self._short_groups = {}  # 映画ID -> その映画が数えられる (短い入力, 候補) の集合
+        self._short_scores = {}  # 短い入力 -> {候補: [人気度の合計, 映画の数]}
+        self._short_top = {}  # 短い入力 -> 人気度の高い順の候補（変更があった入力は削除する）
+        self._built_at = None
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def build(self):
+        from .models import FavoriteMovie, Movie, Review
+
+        popularity = defaultdict(int)
+        for model in (FavoriteMovie, Review):
+            for row in model.objects.values('movie_id').annotate(n=Count('id')).order_by():
+                popularity[row['movie_id']] += row['n']
+        by_movie = {
+            movie.id: self._entries_for(movie)
+            for movie in Movie.objects.only('id', 'title', 'director', 'cast')
+        }
+        entries = sorted(entry for movie_entries in by_movie.values() for entry in movie_entries)
+        short_groups = {movie_id: self._short_groups_for(movie_entries) for movie_id, movie_entries in by_movie.items()}
+        short_scores = {}
+        for movie_id, groups in short_groups.items():
+            add_short_scores(short_scores, groups, popularity.get(movie_id, 0), 1)
+        with self._lock:
+            self._entries = entries
+            self._by_movie = by_movie
+            self._popularity = popularity
+            self._short_groups = short_groups
+            self._short_scores = short_scores
+            self._short_top = {}
+            self._built_at = time.monotonic()
+
+    def _entries_for(self, movie):
+        return [
+            (key, kind, display, movie.id)
+            for kind, display in movie_terms(movie)
+            for key in index_keys(display)
+        ]
+
+    def _short_groups_for(self, entries):
+        # 映画のエントリが、どの短い入力のどの候補に数えられるか（単語ごとのキーで重複して数えないよう集合にする）
+        length = settings.AUTOCOMPLETE_SHORT_PREFIX_LENGTH
+        return {
+            (key[:n], candidate_group(kind, display, movie_id))
+            for key, kind, display, movie_id in entries
+            for n in range(1, min(length, len(key)) + 1)
+        }
+
+    def _update_short_scores(self, groups, popularity, movies):
+        # ロックを取得した状態で呼ぶ。変わった入力の順位は次の検索で計算し直す
+        add_short_scores(self._short_scores, groups, popularity, movies)
+        for prefix, _ in groups:
+            self._short_top.pop(prefix, None)
+
+    def _replace_short_groups(self, movie_id, groups):
+        # ロックを取得した状態で呼ぶ
+        popularity = self._popularity.get(movie_id, 0)
+        self._update_short_scores(self._short_groups.pop(movie_id, ()), -popularity, -1)
+        if groups:
+            self._update_short_scores(groups, popularity, 1)
+            self._short_groups[movie_id] = groups
+
+    def ensure_fresh(self):
+        rebuild_seconds = getattr(settings, 'AUTOCOMPLETE_REBUILD_SECONDS', 300)
+        if self._built_at is None or time.monotonic() - self._built_at > rebuild_seconds:
+            self.build()
+
+    def update_movie(self, movie):
+        # 索引を作る前の変更は、作るときにまとめて読み込まれるため何もしない
+        if not self.is_built:
+            return
+        new_entries = self._entries_for(movie)
+        new_groups = self._short_groups_for(new_entries)
+        with self._lock:
+            self._remove_entries(movie.id)
+            for entry in new_entries:
+                bisect.insort(self._entries, entry)
+            self._by_movie[movie.id] = new_entries
+            self._replace_short_groups(movie.id, new_groups)
+
+    def remove_movie(self, movie_id):
+        if not self.is_built:
+            return
+        with self._lock:
+            self._remove_entries(movie_id)
+            self._replace_short_groups(movie_id, None)
+            self._popularity.pop(movie_id, None)
+
+    def _remove_entries(self, movie_id):
+        for entry in self._by_movie.pop(movie_id, ()):
+            i = bisect.bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+
+    def add_popularity(self, movie_id, delta):
+        if self.is_built:
+            with self._lock:
+                self._popularity[movie_id] += delta
+                self._update_short_scores(self._short_groups.get(movie_id, ()), delta, 0)
+
+    def suggest(self, query, limit=10):
+        """
+        入力された文字列に前方一致する候補を、人気度の高い順に最大 limit 件返す。
+        監督や出演者は複数の映画に登場するため、映画ごとの人気度を合計して順位を付ける。
+        """
+        prefix = normalize_term(query)
+        if not prefix:
+            return []
+        if len(prefix) <= settings.AUTOCOMPLETE_SHORT_PREFIX_LENGTH:
+            top = self._short_prefix_top(prefix, limit)
+        else:
+            top = self._scan_prefix(prefix, limit)
+        return [
+            {'label': display, 'kind': kind, 'movie_id': movie_id, 'score': score}
+            for (kind, display, movie_id), score in top
+        ]
+
+    def _short_prefix_top(self, prefix, limit):
+        # 短い入力は、差分で更新している候補ごとの人気度の合計から順位を付け、次の検索のために保持する
+        with self._lock:
+            top = self._short_top.get(prefix)
+            if top is None or limit > settings.AUTOCOMPLETE_MAX_LIMIT:
+                if prefix not in self._short_scores:
+                    return []
+                scores = {group: score for group, (score, _) in self._short_scores[prefix].items()}
+                top = rank_candidates(scores, max(limit, settings.AUTOCOMPLETE_MAX_LIMIT))
+                if limit <= settings.AUTOCOMPLETE_MAX_LIMIT:
+                    self._short_top[prefix] = top
+        return top[:limit]
+
+    def _scan_prefix(self, prefix, limit):
+        # 前方一致する範囲のエントリを読み、候補ごとの人気度を合計する
+        scores = defaultdict(int)
+        seen = set()
+        with self._lock:
+            entries = self._entries
+            popularity = self._popularity
+            i = bisect.bisect_left(entries, (prefix,))
+            while i < len(entries) and entries[i][0].startswith(prefix):
+                _, kind, display, movie_id = entries[i]
+                i += 1
+                # 同じ映画の同じ候補が単語ごとのキーで重複して数えられないようにする
+                if (kind, display, movie_id) in seen:
+                    continue
+                seen.add((kind, display, movie_id))
+                scores[candidate_group(kind, display, movie_id)] += popularity.get(movie_id, 0)
+        return rank_candidates(scores, limit)
+
+
+autocomplete_index = AutocompleteIndex()
@@ -0,0 +1,26 @@
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.conf import settings
+
+
+def user_cache_key(user_id):
+    return f'flick_seeker:user:{user_id}'
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ログイン中のユーザーをキャッシュから読み込む認証バックエンド。
+    ログインが必要なページではリクエストごとにユーザーを取得するため、その SELECT を省く。
+    ユーザーの保存、削除時のキャッシュの削除は signals.py で行う。
+    """
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, getattr(settings, 'USER_CACHE_TIMEOUT', 300))
+        # 無効化されたユーザーは通常の ModelBackend と同様にログインさせない
+        return user if self.user_can_authenticate(user) else None
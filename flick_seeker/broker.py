@@ -0,0 +1,97 @@
+"""
+映画ページごとの Good/Bad 数とお気に入り数の更新を配信する、プロセス内の簡易 pub/sub。
+
+同期ビューから publish されたカウントは映画ごとに最新値だけを保持し、購読側は一定間隔でまとめて受け取る。
+同じレビューへの投票が短時間に集中しても、購読者1人あたり1回の間隔で1件のメッセージにまとまる。
+プロセス内のメモリで配信するため、同じ ASGI プロセスに接続している閲覧者にのみ届く。
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+
+class CountBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = 0
+        # 映画ID -> {キー: (値, 更新番号)}。購読者がいる映画だけ保持する
+        self._latest = defaultdict(dict)
+        # 映画ID -> {(イベントループ, asyncio.Event)}
+        self._waiters = defaultdict(set)
+
+    def has_subscribers(self, movie_id):
+        return bool(self._waiters.get(movie_id))
+
+    def publish_review_counts(self, movie_id, review_id, good_count, bad_count):
+        self._publish(movie_id, ('review', review_id), {'id': review_id, 'good_count': good_count, 'bad_count': bad_count})
+
+    def publish_favorites_count(self, movie_id, favorites_count):
+        self._publish(movie_id, ('favorites',), favorites_count)
+
+    def _publish(self, movie_id, key, value):
+        # 同期ビュー（別スレッド）から呼ばれるため、購読側の通知は call_soon_threadsafe で行う
+        with self._lock:
+            waiters = list(self._waiters.get(movie_id, ()))
+            if not waiters:
+                return
+            self._seq += 1
+            self._latest[movie_id][key] = (value, self._seq)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # イベントループが既に閉じている購読者は無視する
+                pass
+
+    def _changes_since(self, movie_id, seq):
+        # seq より後に更新された値を1つのメッセージにまとめて返す
+        with self._lock:
+            latest = self._latest.get(movie_id, {})
+            changed = [(key, value) for key, (value, updated) in latest.items() if updated > seq]
+            current = self._seq
+        message = {}
+        for key, value in changed:
+            if key[0] == 'review':
+                message.setdefault('reviews', []).append(value)
+            else:
+                message['favorites_count'] = value
+        return message, current
+
+    async def subscribe(self, movie_id):
+        """
+        映画ごとの更新をまとめて受け取る非同期ジェネレーター。
+        更新があれば LIVE_UPDATE_BATCH_SECONDS 秒待ってから、その間の更新をまとめた辞書を返す。
+        LIVE_UPDATE_KEEPALIVE_SECONDS 秒更新がなければ、接続維持のために空の辞書を返す。
+        """
+        batch_seconds = getattr(settings, 'LIVE_UPDATE_BATCH_SECONDS', 0.5)
+        keepalive_seconds = getattr(settings, 'LIVE_UPDATE_KEEPALIVE_SECONDS', 15)
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters[movie_id].add(waiter)
+            last_seq = self._seq
+        event = waiter[1]
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield {}
+                    continue
+                # 短時間に集中した更新を1件にまとめるため、少し待ってから取り出す
+                await asyncio.sleep(batch_seconds)
+                event.clear()
+                message, last_seq = self._changes_since(movie_id, last_seq)
+                if message:
+                    yield message
+        finally:
+            with self._lock:
+                self._waiters[movie_id].discard(waiter)
+                if not self._waiters[movie_id]:
+                    # 購読者がいなくなった映画の値は破棄する
+                    del self._waiters[movie_id]
+                    self._latest.pop(movie_id, None)
+
+
+count_broker = CountBroker()
@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .favorites import favorite_movie_ids
+
+
+def favorites(request):
+    # テンプレートで {% if movie.id in favorite_movie_ids %} と書けるようにする（使われたときだけ読み込む）
+    return {'favorite_movie_ids': SimpleLazyObject(lambda: favorite_movie_ids(request.user))}
@@ -0,0 +1,182 @@
+"""
+静的ファイルやメディアファイルをアプリケーションから配信するための共通処理。
+"""
+import mimetypes
+import os
+
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+# 事前に圧縮したファイルの拡張子。優先する順に並べる
+ENCODING_SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+
+
+def file_etag(stat):
+    # 更新日時とサイズから ETag を作る（内容を読まずに済むため）
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def guess_content_type(path):
+    content_type, _ = mimetypes.guess_type(path)
+    content_type = content_type or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type in ('application/javascript', 'image/svg+xml'):
+        content_type += '; charset=utf-8'
+    return content_type
+
+
+def accepted_encodings(request):
+    # Accept-Encoding に含まれるエンコーディング（q=0 で拒否されたものを除く）
+    encodings = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = item.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(request, size, etag):
+    """
+    Range ヘッダーから返すバイト範囲を (開始, 終了) で返す（終了の位置も含む）。
+    範囲の指定がない、複数の範囲が指定された、If-Range が ETag と一致しない場合は None を返し、ファイル全体を返す。
+    ファイルの範囲外が指定された場合は RangeNotSatisfiable を送出する。
+    """
+    header = request.META.get('HTTP_RANGE', '')
+    if not header.startswith('bytes=') or ',' in header:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag:
+        return None
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if not start:
+            # bytes=-n は末尾の n バイト
+            length = int(end)
+            if length <= 0:
+                raise RangeNotSatisfiable
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+class RangeFile:
+    """
+    ファイルの一部だけを読み出すファイルオブジェクト。
+    fileno を持たないため、WSGI サーバーの file_wrapper もファイル全体を送らずに read() で読み出す。
+    """
+
+    def __init__(self, f, start, length):
+        self.file = f
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class ServedFile:
+    """
+    配信するファイル1つ分の情報。起動時に stat した結果を保持し、リクエストごとのファイルシステムへのアクセスを減らす。
+    encodings には事前に圧縮したファイルを (エンコーディング, パス, サイズ) の形で優先順に持つ。
+    """
+    __slots__ = ('path', 'size', 'last_modified', 'etag', 'content_type', 'encodings', 'cache_control')
+
+    def __init__(self, path, cache_control, stat=None, precompressed=True):
+        stat = stat or os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.last_modified = int(stat.st_mtime)
+        self.etag = file_etag(stat)
+        self.content_type = guess_content_type(path)
+        self.cache_control = cache_control
+        self.encodings = []
+        # 画像などの圧縮版を作らないファイルでは、圧縮版を探す stat を省く
+        for encoding, suffix in ENCODING_SUFFIXES if precompressed else ():
+            try:
+                encoded_stat = os.stat(path + suffix)
+            except FileNotFoundError:
+                continue
+            self.encodings.append((encoding, path + suffix, encoded_stat.st_size))
+
+    def response(self, request, offload=None):
+        """
+        If-None-Match / If-Modified-Since に一致すれば 304 を、そうでなければファイルを返す。
+        クライアントが対応していれば圧縮済みのファイルを、Range が指定されていればその範囲を返す。
+        offload に (ヘッダー名, 値) を渡した場合は本文を返さず、X-Sendfile などでプロキシに送信を任せる。
+        """
+        response = get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+        if response is None:
+            if offload:
+                response = self._offload_response(*offload)
+            else:
+                response = self._file_response(request)
+            response['Last-Modified'] = http_date(self.last_modified)
+        response['ETag'] = self.etag
+        response['Cache-Control'] = self.cache_control
+        if self.encodings:
+            response['Vary'] = 'Accept-Encoding'
+        return response
+
+    def _file_response(self, request):
+        path, size, content_encoding = self.path, self.size, None
+        if self.encodings:
+            accepted = accepted_encodings(request)
+            for encoding, encoded_path, encoded_size in self.encodings:
+                if encoding in accepted:
+                    path, size, content_encoding = encoded_path, encoded_size, encoding
+                    break
+
+        byte_range = None
+        if content_encoding is None:
+            # 圧縮版のバイト位置は元のファイルと対応しないため、範囲指定は圧縮しない場合のみ扱う
+            try:
+                byte_range = parse_range(request, size, self.etag)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+        f = open(path, 'rb')
+        if byte_range:
+            start, end = byte_range
+            # WSGI サーバーの file_wrapper（sendfile）はファイル全体を前提とするため、範囲指定時は読み出して返す
+            response = FileResponse(RangeFile(f, start, end - start + 1), status=206, content_type=self.content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = end - start + 1
+        else:
+            # ファイル全体を返す場合は、WSGI サーバーが対応していれば sendfile で送信される
+            response = FileResponse(f, content_type=self.content_type)
+            response['Content-Length'] = size
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+        else:
+            response['Accept-Ranges'] = 'bytes'
+        return response
+
+    def _offload_response(self, header, value):
+        # 本文は空にし、プロキシ（Apache の mod_xsendfile や nginx）にファイルの送信と Range の処理を任せる
+        response = HttpResponse(content_type=self.content_type)
+        response[header] = value
+        return response
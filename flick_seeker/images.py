@@ -0,0 +1,137 @@
+"""
+画像ファイルの情報を、描画やAPIのたびにファイルを開かずに取得するための処理。
+
+Movie.thumbnail と User.profile_image の幅、高さ、ファイルサイズ、内容のハッシュ、代表色はモデルのフィールドに保存する。
+保存は pre_save のシグナルと backfill_image_metadata コマンドで行う。
+低画質のプレースホルダー（data URI）は初めて表示するときに一度だけ作り、キャッシュに保存する。
+"""
+import base64
+import hashlib
+import io
+
+from django.core.cache import cache
+
+IMAGE_METADATA_FIELDS = ('width', 'height', 'size', 'hash', 'color')
+PLACEHOLDER_SIZE = 16  # プレースホルダーの長辺のピクセル数
+PALETTE_SIZE = 8  # 代表色を選ぶときに減色する色数
+PLACEHOLDER_QUALITY = 40
+FAILURE_TIMEOUT = 300  # 読み込めなかった画像を再び読みにいくまでの秒数
+
+
+def image_cache_key(name):
+    # ファイル名に日本語が含まれるため、ハッシュにしてキーにする
+    return 'flick_seeker:image:' + hashlib.md5(name.encode('utf-8')).hexdigest()
+
+
+def get_image_info(image):
+    """
+    ImageField の値から {'width', 'height', 'placeholder'} の辞書を返す。
+    ファイルがない、または画像として読み込めない場合は空の辞書を返す。
+    """
+    if not image:
+        return {}
+    key = image_cache_key(image.name)
+    info = cache.get(key)
+    if info is None:
+        info = read_image_info(image.storage, image.name)
+        # 寸法は同じファイル名のファイルでは変わらないため、期限なしで保存する
+        cache.set(key, info, None if info else FAILURE_TIMEOUT)
+    return info
+
+
+def read_image_info(storage, name):
+    # Pillow は読み込みに時間がかかるため、実際に画像を読むときだけ読み込む
+    from PIL import Image
+
+    try:
+        with storage.open(name, 'rb') as f:
+            img = Image.open(f)
+            width, height = img.size
+            # JPEG は縮小して読み込めるため、プレースホルダー用に小さいサイズで展開する
+            img.draft('RGB', (PLACEHOLDER_SIZE * 4, PLACEHOLDER_SIZE * 4))
+            img = img.convert('RGB')
+            img.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    except (OSError, ValueError):
+        return {}
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=PLACEHOLDER_QUALITY)
+    placeholder = 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    return {'width': width, 'height': height, 'placeholder': placeholder}
+
+
+def forget_image_info(name):
+    # 同じファイル名で画像が差し替えられた場合に備えて、保存されている寸法を削除する
+    if name:
+        cache.delete(image_cache_key(name))
+
+
+def describe_image(f):
+    """
+    画像のファイルオブジェクトから {'width', 'height', 'size', 'hash', 'color'} の辞書を返す。
+    hash は内容の SHA-256、color は減色したときに最も多い色（#rrggbb）。
+    """
+    from PIL import Image
+
+    f.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: f.read(64 * 1024), b''):
+        digest.update(chunk)
+        size += len(chunk)
+    f.seek(0)
+    img = Image.open(f)
+    width, height = img.size
+    img.draft('RGB', (64, 64))
+    img = img.convert('RGB')
+    img.thumbnail((64, 64))
+    palette_img = img.quantize(colors=PALETTE_SIZE)
+    palette = palette_img.getpalette()
+    _, index = max(palette_img.getcolors())
+    f.seek(0)
+    return {
+        'width': width,
+        'height': height,
+        'size': size,
+        'hash': digest.hexdigest(),
+        'color': '#{:02x}{:02x}{:02x}'.format(*palette[index * 3:index * 3 + 3]),
+    }
+
+
+def set_image_metadata(instance, field_name, metadata):
+    # metadata が空の場合は保存されている情報を消す
+    for key in IMAGE_METADATA_FIELDS:
+        default = '' if key in ('hash', 'color') else None
+        setattr(instance, f'{field_name}_{key}', metadata.get(key, default))
+
+
+def stored_image_metadata(image):
+    # モデルに保存されている画像の情報を返す。まだ保存されていなければ空の辞書を返す
+    instance = image.instance
+    prefix = image.field.name
+    if getattr(instance, f'{prefix}_width', None) is None:
+        return {}
+    return {key: getattr(instance, f'{prefix}_{key}') for key in IMAGE_METADATA_FIELDS}
+
+
+def refresh_image_metadata(instance, field_name, force=False):
+    """
+    画像が新しくアップロードされた、または情報がまだ保存されていない場合に、画像を読み込んで情報を設定する。
+    インスタンスの属性を変更するだけで、保存は呼び出し側で行う。情報を更新した場合は True を返す。
+    """
+    image = getattr(instance, field_name)
+    if not image:
+        set_image_metadata(instance, field_name, {})
+        return True
+    if image._committed and not force and getattr(instance, f'{field_name}_size') is not None:
+        return False
+    try:
+        if image._committed:
+            with image.storage.open(image.name, 'rb') as f:
+                metadata = describe_image(f)
+        else:
+            # アップロードされたファイルはまだストレージに保存されていないため、そのまま読む
+            metadata = describe_image(image.file)
+    except (OSError, ValueError):
+        metadata = {}
+    set_image_metadata(instance, field_name, metadata)
+    return True
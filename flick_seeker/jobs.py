@@ -0,0 +1,92 @@
+"""
+管理画面の一括操作などの時間のかかる処理を、リクエストとは別のスレッドで実行する。
+
+進み具合と結果は BackgroundJob に記録し、管理画面のジョブの一覧で確認できる。
+ジョブはプロセス内のスレッドで実行するため、プロセスが終了すると実行中のジョブは中断され、状態は「実行中」のまま残る。
+一括操作はバッチごとにコミットするため、中断した場合も処理済みの分はそのまま反映されている。
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BACKGROUND_JOB_WORKERS,
+                thread_name_prefix='flick-seeker-job',
+            )
+        return _executor
+
+
+class JobProgress:
+    """
+    ジョブの処理から進み具合を記録するためのオブジェクト。ジョブの関数の最初の引数として渡す。
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.done = 0
+
+    def set_total(self, total):
+        from .models import BackgroundJob
+
+        BackgroundJob.objects.filter(pk=self.job_id).update(total=total)
+
+    def advance(self, count):
+        from .models import BackgroundJob
+
+        self.done += count
+        BackgroundJob.objects.filter(pk=self.job_id).update(done=self.done)
+
+
+def run_job(job_id, func, args):
+    from .models import BackgroundJob
+
+    BackgroundJob.objects.filter(pk=job_id).update(status='running', started_at=timezone.now())
+    try:
+        message = func(JobProgress(job_id), *args)
+    except Exception as e:
+        logger.exception('バックグラウンドジョブ #%s が失敗しました', job_id)
+        BackgroundJob.objects.filter(pk=job_id).update(status='failed', message=repr(e), finished_at=timezone.now())
+        return None
+    BackgroundJob.objects.filter(pk=job_id).update(status='done', message=message or '', finished_at=timezone.now())
+    return message
+
+
+def _run_in_thread(job_id, func, args):
+    # スレッドごとにデータベース接続が作られるため、終わったら閉じる
+    try:
+        close_old_connections()
+        run_job(job_id, func, args)
+    finally:
+        connection.close()
+
+
+def start_job(name, func, *args, user=None, background=True):
+    """
+    func(progress, *args) を実行するジョブを作成して BackgroundJob を返す。
+    func は結果のメッセージを返す。background が False の場合や、BACKGROUND_JOB_WORKERS が 0 の場合は、
+    その場で実行してから返す。
+    """
+    from .models import BackgroundJob
+
+    job = BackgroundJob.objects.create(name=name, created_by=user)
+    if not background or not settings.BACKGROUND_JOB_WORKERS:
+        run_job(job.pk, func, args)
+    else:
+        # ジョブの行がコミットされてから実行する
+        transaction.on_commit(lambda: get_executor().submit(_run_in_thread, job.pk, func, args))
+    job.refresh_from_db()
+    return job
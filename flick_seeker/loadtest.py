@@ -0,0 +1,283 @@
+"""
+負荷試験用の非同期HTTPクライアントと仮想ユーザーのシナリオ。
+
+開発サーバーなどへ実際にHTTPで接続する HttpTransport と、
+screen_speak/asgi.py の ASGI アプリケーションをプロセス内で直接呼び出す AsgiTransport を提供する。
+"""
+import asyncio
+import random
+import re
+import time
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+from .perf import percentile
+
+_CSRF_INPUT_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+class Response:
+    # レスポンスのステータス、ヘッダー（小文字の名前と値のリスト）、本文
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def header_values(self, name):
+        return [value for key, value in self.headers if key == name]
+
+
+class HttpTransport:
+    """
+    asyncio のストリームでHTTP/1.1のリクエストを送る最小限のクライアント。
+    リクエストごとに接続し、Connection: close で本文を最後まで読み込む。
+    """
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.host_header = parts.netloc
+
+    async def request(self, method, path, headers, body=b''):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host_header}', 'Connection: close',
+                     f'Content-Length: {len(body)}']
+            lines += [f'{name}: {value}' for name, value in headers]
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+            raw = await reader.read()
+        finally:
+            writer.close()
+        head, _, body = raw.partition(b'\r\n\r\n')
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        response_headers = []
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            response_headers.append((name.strip().lower(), value.strip()))
+        response = Response(int(status_line.split()[1]), response_headers, body)
+        if 'chunked' in response.header_values('transfer-encoding'):
+            response.body = self._decode_chunked(body)
+        return response
+
+    def _decode_chunked(self, body):
+        decoded = b''
+        while body:
+            size_line, _, body = body.partition(b'\r\n')
+            size = int(size_line.split(b';')[0], 16)
+            if size == 0:
+                break
+            decoded += body[:size]
+            body = body[size + 2:]
+        return decoded
+
+
+class AsgiTransport:
+    """
+    ASGI アプリケーションをプロセス内で直接呼び出すトランスポート。
+    ネットワークを介さずにアプリケーション自体の並行処理性能を測るために使う。
+    """
+
+    def __init__(self, application, host='127.0.0.1'):
+        self.application = application
+        self.host = host
+
+    async def request(self, method, path, headers, body=b''):
+        path, _, query_string = path.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode('utf-8'),
+            'query_string': query_string.encode('latin-1'),
+            'headers': [(b'host', self.host.encode('latin-1'))] + [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ],
+            'client': ('127.0.0.1', 50000),
+            'server': (self.host, 80),
+        }
+        request_sent = False
+        response_done = asyncio.Event()
+        status = 500
+        response_headers = []
+        chunks = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            # レスポンスを返し終えたら切断を通知する
+            await response_done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal status, response_headers
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                response_headers = [
+                    (name.decode('latin-1').lower(), value.decode('latin-1')) for name, value in message['headers']
+                ]
+            elif message['type'] == 'http.response.body':
+                chunks.append(message.get('body', b''))
+                if not message.get('more_body', False):
+                    response_done.set()
+
+        await self.application(scope, receive, send)
+        response_done.set()
+        return Response(status, response_headers, b''.join(chunks))
+
+
+class LoadTestResult:
+    # ステップ名ごとのレイテンシとエラー数を集計する
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.exceptions = defaultdict(int)
+
+    def record(self, step, duration_ms, status, ok):
+        self.durations[step].append(duration_ms)
+        self.statuses[step][status] += 1
+        if not ok:
+            self.errors[step] += 1
+
+    def record_exception(self, step, exc):
+        self.errors[step] += 1
+        self.exceptions[f'{step}: {type(exc).__name__}'] += 1
+
+    def summary(self, elapsed):
+        steps = {}
+        all_durations = []
+        for step, durations in self.durations.items():
+            durations = sorted(durations)
+            all_durations += durations
+            requests = len(durations) + sum(
+                count for name, count in self.exceptions.items() if name.startswith(f'{step}:')
+            )
+            steps[step] = {
+                'requests': requests,
+                'errors': self.errors[step],
+                'error_rate': self.errors[step] / requests if requests else 0,
+                'p50_ms': percentile(durations, 50),
+                'p95_ms': percentile(durations, 95),
+                'p99_ms': percentile(durations, 99),
+                'status_codes': dict(self.statuses[step]),
+            }
+        all_durations.sort()
+        total_requests = sum(step['requests'] for step in steps.values())
+        total_errors = sum(self.errors.values())
+        return {
+            'elapsed_s': elapsed,
+            'requests': total_requests,
+            'throughput_rps': total_requests / elapsed if elapsed else 0,
+            'errors': total_errors,
+            'error_rate': total_errors / total_requests if total_requests else 0,
+            'p50_ms': percentile(all_durations, 50),
+            'p95_ms': percentile(all_durations, 95),
+            'p99_ms': percentile(all_durations, 99),
+            'exceptions': dict(self.exceptions),
+            'steps': steps,
+        }
+
+
+class VirtualUser:
+    """
+    1人分のブラウザを模した仮想ユーザー。
+    Cookie と CSRF トークンを保持し、ログインから閲覧、投票、お気に入りまでの一連の操作を行う。
+    """
+
+    def __init__(self, transport, result, email, password, fixtures, rng, think_time=0.0):
+        self.transport = transport
+        self.result = result
+        self.email = email
+        self.password = password
+        self.fixtures = fixtures
+        self.rng = rng
+        self.think_time = think_time
+        self.cookies = {}
+
+    async def send(self, step, method, path, data=None, expected=(200,)):
+        headers = []
+        if self.cookies:
+            headers.append(('Cookie', '; '.join(f'{name}={value}' for name, value in self.cookies.items())))
+        body = b''
+        if method == 'POST':
+            headers.append(('X-CSRFToken', self.cookies.get('csrftoken', '')))
+            headers.append(('Content-Type', 'application/x-www-form-urlencoded'))
+            body = urlencode(data or {}).encode('utf-8')
+
+        started = time.perf_counter()
+        try:
+            response = await self.transport.request(method, path, headers, body)
+        except Exception as exc:
+            self.result.record_exception(step, exc)
+            return None
+        self.result.record(step, (time.perf_counter() - started) * 1000, response.status, response.status in expected)
+
+        for value in response.header_values('set-cookie'):
+            cookie = SimpleCookie()
+            cookie.load(value)
+            for name, morsel in cookie.items():
+                self.cookies[name] = morsel.value
+        if self.think_time:
+            await asyncio.sleep(self.rng.uniform(0, self.think_time))
+        return response
+
+    async def login(self):
+        response = await self.send('login_page', 'GET', '/screen_speak/login/')
+        if response is None:
+            return False
+        match = _CSRF_INPUT_RE.search(response.body.decode('utf-8', 'replace'))
+        token = match.group(1) if match else ''
+        response = await self.send('login', 'POST', '/screen_speak/login/', {
+            'csrfmiddlewaretoken': token,
+            'username': self.email,
+            'password': self.password,
+        }, expected=(302,))
+        return response is not None and response.status == 302
+
+    async def run_session(self):
+        # ダッシュボード → タグ付き検索 → 詳細 → 投票 → お気に入り の順に操作する
+        fixtures = self.fixtures
+        await self.send('dashboard', 'GET', '/screen_speak/dashboard/')
+
+        params = {'query': self.rng.choice(fixtures['queries'])}
+        if fixtures['genres']:
+            params['genre'] = self.rng.choice(fixtures['genres'])
+        if fixtures['situations'] and self.rng.random() < 0.5:
+            params['situation'] = self.rng.choice(fixtures['situations'])
+        await self.send('search_results', 'GET', '/screen_speak/search_results/?' + urlencode(params))
+
+        movie_id, review_ids = self.rng.choice(fixtures['movies'])
+        await self.send('movie_detail', 'GET', f'/screen_speak/movie_detail/{movie_id}/')
+        if review_ids:
+            vote_type = 'good' if self.rng.random() < 0.7 else 'bad'
+            await self.send('review_vote', 'POST', f'/screen_speak/review/{self.rng.choice(review_ids)}/vote/{vote_type}/')
+        await self.send('toggle_favorite', 'POST', f'/screen_speak/movie/{movie_id}/toggle_favorite/')
+
+
+async def run_load_test(transport, accounts, fixtures, sessions, think_time=0.0, seed=0):
+    """
+    accounts の数だけ仮想ユーザーを同時に動かし、それぞれが sessions 回のシナリオを実行する。
+    集計結果の辞書を返す。
+    """
+    result = LoadTestResult()
+
+    async def run_user(index, email, password):
+        user = VirtualUser(transport, result, email, password, fixtures, random.Random(seed + index), think_time)
+        if not await user.login():
+            return
+        for _ in range(sessions):
+            await user.run_session()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(i, email, password) for i, (email, password) in enumerate(accounts)))
+    return result.summary(time.perf_counter() - started)
@@ -0,0 +1,25 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from flick_seeker.archive import archive_reactions
+
+
+class Command(BaseCommand):
+    help = '古いリアクションをアーカイブに移し、ReviewReaction を小さく保ちます。cron などで定期的に実行してください。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.REACTION_ARCHIVE_DAYS, help='この日数より前のリアクションを移す')
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回のトランザクションで移すリアクション数')
+        parser.add_argument('--sleep', type=float, default=0.0, help='バッチの間に待つ秒数（書き込みのロックを譲るため）')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timezone.timedelta(days=options['days'])
+        archived = 0
+        for count in archive_reactions(before, options['batch_size']):
+            archived += count
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(f'{options["days"]}日より前のリアクションを {archived} 件アーカイブに移しました。')
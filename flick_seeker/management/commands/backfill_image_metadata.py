@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+
+from flick_seeker.images import IMAGE_METADATA_FIELDS, describe_image, set_image_metadata
+from flick_seeker.models import Movie, User
+
+# 情報を記録する (モデル, 画像のフィールド名)
+TARGETS = [(Movie, 'thumbnail'), (User, 'profile_image')]
+
+
+class Command(BaseCommand):
+    help = '映画のサムネイルとプロフィール画像の寸法、サイズ、ハッシュ、代表色を、まだ記録されていないものについて記録します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='記録済みのものも画像を読み込み直して更新する')
+        parser.add_argument('--batch-size', type=int, default=500, help='bulk_update の1回あたりの件数')
+
+    def handle(self, *args, **options):
+        for model, field_name in TARGETS:
+            self.backfill(model, field_name, options['force'], options['batch_size'])
+
+    def backfill(self, model, field_name, force, batch_size):
+        queryset = model.objects.exclude(**{f'{field_name}__isnull': True}).exclude(**{field_name: ''})
+        if not force:
+            queryset = queryset.filter(**{f'{field_name}_size__isnull': True})
+        update_fields = [f'{field_name}_{key}' for key in IMAGE_METADATA_FIELDS]
+
+        # 多くのユーザーが同じデフォルト画像を使うため、同じファイルは一度だけ読み込む
+        described = {}
+        updated = missing = 0
+        last_pk = 0
+        while True:
+            # 主キーの順に少しずつ読み込み、全件をメモリに載せないようにする
+            batch = list(
+                queryset.filter(pk__gt=last_pk).order_by('pk').only('pk', field_name)[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            for instance in batch:
+                image = getattr(instance, field_name)
+                if image.name not in described:
+                    try:
+                        with image.storage.open(image.name, 'rb') as f:
+                            described[image.name] = describe_image(f)
+                    except (OSError, ValueError):
+                        described[image.name] = {}
+                        self.stderr.write(f'{model.__name__} {instance.pk}: {image.name} を読み込めませんでした。')
+                metadata = described[image.name]
+                if metadata:
+                    updated += 1
+                else:
+                    # 読み込めなかった画像は未記録のまま残し、次回の実行で再び読み込む
+                    missing += 1
+                set_image_metadata(instance, field_name, metadata)
+            model.objects.bulk_update(batch, update_fields)
+
+        self.stdout.write(
+            f'{model.__name__}.{field_name}: {updated} 件を記録しました'
+            f'（読み込めなかった画像 {missing} 件、{len(described)} ファイル）。'
+        )
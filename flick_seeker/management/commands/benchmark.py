@@ -0,0 +1,193 @@
+import contextlib
+import json
+import logging
+import platform
+import re
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from flick_seeker.models import FavoriteMovie, Hashtag, Movie, Review, ReviewReaction, User
+from flick_seeker.perf import percentile
+
+# 計測対象のビュー（書き込みを伴うビューはロールバックして元の状態に戻す）
+VIEW_NAMES = ['dashboard', 'search_results', 'movie_detail', 'all_movie_reviews', 'review_vote', 'toggle_favorite']
+WRITE_VIEWS = {'review_vote', 'toggle_favorite'}
+
+# PerformanceMiddleware が付与する Server-Timing ヘッダーからクエリ数を読み取る
+_SERVER_TIMING_QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+class Command(BaseCommand):
+    help = '主要なビューのレイテンシ、スループット、クエリ数を計測し、コミット間で比較できるJSONを出力します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='ビューごとの計測回数')
+        parser.add_argument('--warmup', type=int, default=5, help='計測前の空実行の回数')
+        parser.add_argument('--views', nargs='+', choices=VIEW_NAMES, default=VIEW_NAMES, help='計測するビュー')
+        parser.add_argument('--user', help='ログインに使うユーザーのメールアドレス（省略時は最初のユーザー）')
+        parser.add_argument('--host', default='127.0.0.1', help='リクエストの Host ヘッダー（ALLOWED_HOSTS に含まれる値）')
+        parser.add_argument('--output', help='結果のJSONを書き出すファイル（省略時は標準出力）')
+        parser.add_argument(
+            '--asgi', action='store_true',
+            help='AsyncClient で ASGI ハンドラー経由で計測する（読み取り系のビューのみ。WSGI との比較用）',
+        )
+
+    def handle(self, *args, **options):
+        # SQLのDEBUGログをコンソールに出すと計測結果が大きくぶれるため、計測中は抑制する
+        logging.getLogger('django.db.backends').setLevel(logging.WARNING)
+
+        user = self.get_user(options['user'])
+        # レビュー数が最も多い映画を詳細ページの計測に使う
+        movie = Movie.objects.annotate(review_total=Count('review')).order_by('-review_total').first()
+        if movie is None:
+            raise CommandError('映画がありません。先に generate_data を実行してください。')
+        review = Review.objects.filter(movie=movie).order_by('id').first()
+
+        if options['asgi']:
+            # ASGI では別スレッドの接続でクエリが実行されるため、書き込みをロールバックできない
+            client = AsyncClient(HTTP_HOST=options['host'])
+            client.force_login(user)
+            if not getattr(settings, 'ASYNC_READ_VIEWS', False):
+                self.stderr.write('ASYNC_READ_VIEWS が False のため、同期版のビューを ASGI で計測します。')
+        else:
+            client = Client(HTTP_HOST=options['host'])
+            client.force_login(user)
+
+        results = {}
+        # クエリ数を Server-Timing ヘッダーから読み取るため、ヘッダーを付けない設定（本番）でも計測中は付ける
+        with override_settings(PERF_SERVER_TIMING=True):
+            for name in options['views']:
+                if options['asgi'] and name in WRITE_VIEWS:
+                    self.stderr.write(f'{name}: --asgi では書き込みを伴うビューを計測しないためスキップしました。')
+                    continue
+                request = self.build_request(name, movie, review)
+                if request is None:
+                    self.stderr.write(f'{name}: 計測に必要なデータがないためスキップしました。')
+                    continue
+                results[name] = self.measure(client, name, request, options['iterations'], options['warmup'], options['asgi'])
+                self.stderr.write(
+                    f"{name}: p50={results[name]['p50_ms']:.2f}ms p95={results[name]['p95_ms']:.2f}ms "
+                    f"queries={results[name]['queries']}"
+                )
+
+        output = json.dumps({'meta': self.meta(options), 'results': results}, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def get_user(self, email):
+        users = User.objects.order_by('id')
+        user = users.filter(email=email).first() if email else users.first()
+        if user is None:
+            raise CommandError('ユーザーが見つかりません。先に generate_data を実行してください。')
+        return user
+
+    def build_request(self, name, movie, review):
+        # (HTTPメソッド, URL, GETパラメータ) を返す
+        if name == 'dashboard':
+            return 'get', reverse('flick_seeker:dashboard'), {}
+        if name == 'search_results':
+            genre = Hashtag.objects.filter(category='genre').order_by('id').values_list('label', flat=True).first()
+            params = {'query': movie.title[:2], 'rating_from': '3'}
+            if genre:
+                params['genre'] = genre
+            return 'get', reverse('flick_seeker:search_results'), params
+        if name == 'movie_detail':
+            return 'get', reverse('flick_seeker:movie_detail', args=[movie.id]), {}
+        if name == 'all_movie_reviews':
+            return 'get', reverse('flick_seeker:all_movie_reviews', args=[movie.id]), {}
+        if name == 'review_vote':
+            if review is None:
+                return None
+            return 'post', reverse('flick_seeker:review_vote', args=[review.id, 'good']), {}
+        if name == 'toggle_favorite':
+            return 'post', reverse('flick_seeker:toggle_favorite', args=[movie.id]), {}
+        return None
+
+    def measure(self, client, name, request, iterations, warmup, use_asgi=False):
+        method, url, params = request
+        send = getattr(client, method)
+        if use_asgi:
+            send = async_to_sync(send)
+        durations = []
+        query_counts = []
+        statuses = set()
+
+        # 書き込みを伴うビューはトランザクション内で計測し、最後にロールバックしてデータを元に戻す
+        is_write = name in WRITE_VIEWS
+        with transaction.atomic() if is_write else contextlib.nullcontext():
+            for _ in range(warmup):
+                send(url, params)
+            total_started = time.perf_counter()
+            for _ in range(iterations):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = send(url, params)
+                    durations.append((time.perf_counter() - started) * 1000)
+                query_counts.append(self.count_queries(response, queries))
+                statuses.add(response.status_code)
+            total_elapsed = time.perf_counter() - total_started
+            if is_write:
+                transaction.set_rollback(True)
+
+        durations.sort()
+        return {
+            'method': method.upper(),
+            'url': url,
+            'params': params,
+            'iterations': iterations,
+            'status_codes': sorted(statuses),
+            'mean_ms': statistics.mean(durations),
+            'p50_ms': percentile(durations, 50),
+            'p95_ms': percentile(durations, 95),
+            'p99_ms': percentile(durations, 99),
+            'min_ms': durations[0],
+            'max_ms': durations[-1],
+            'throughput_rps': iterations / total_elapsed,
+            'queries': max(query_counts),
+        }
+
+    def count_queries(self, response, queries):
+        # ASGI では別スレッドで実行されたクエリを捕捉できないため、Server-Timing ヘッダーの値を優先する
+        match = _SERVER_TIMING_QUERIES_RE.search(response.get('Server-Timing', ''))
+        return int(match.group(1)) if match else len(queries)
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'handler': 'asgi' if options['asgi'] else 'wsgi',
+            'async_read_views': getattr(settings, 'ASYNC_READ_VIEWS', False),
+            'iterations': options['iterations'],
+            'warmup': options['warmup'],
+            'data': {
+                'users': User.objects.count(),
+                'movies': Movie.objects.count(),
+                'reviews': Review.objects.count(),
+                'favorites': FavoriteMovie.objects.count(),
+                'reactions': ReviewReaction.objects.count(),
+            },
+        }
@@ -0,0 +1,28 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = '期限切れのセッションを少しずつ削除します。cron などで定期的に実行してください。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回の DELETE で削除するセッション数')
+        parser.add_argument('--sleep', type=float, default=0.0, help='DELETE の間に待つ秒数（書き込みのロックを譲るため）')
+
+    def handle(self, *args, **options):
+        # 一度に全件を削除すると SQLite の書き込みロックを長時間保持するため、主キーで区切って削除する
+        now = timezone.now()
+        deleted = 0
+        while True:
+            keys = list(
+                Session.objects.filter(expire_date__lt=now).values_list('session_key', flat=True)[:options['batch_size']]
+            )
+            if not keys:
+                break
+            deleted += Session.objects.filter(session_key__in=keys).delete()[0]
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(f'期限切れのセッションを {deleted} 件削除しました。')
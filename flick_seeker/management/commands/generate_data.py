@@ -0,0 +1,206 @@
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+from flick_seeker.models import FavoriteMovie, Hashtag, Movie, Review, ReviewHashtag, ReviewReaction, User
+from flick_seeker.ratings import refresh_helpfulness, refresh_movie_ratings
+from flick_seeker.search_index import INDEXED_FIELDS, analyze_tables, index_objects, kind_of
+
+# ハッシュタグが存在しない場合に作成するラベル
+GENRE_LABELS = [
+    '#アクション', '#アドベンチャー', '#コメディ', '#ドラマ', '#ファンタジー', '#ホラー', '#ミステリー',
+    '#ロマンス', '#SF', '#スリラー', '#ドキュメンタリー', '#アニメ', '#ミュージカル', '#ファミリー',
+]
+SITUATION_LABELS = [
+    '#泣きたいときに観る映画', '#夜に観たい映画', '#元気をもらえる映画', '#笑いたいときに観る映画',
+    '#恋をしたくなる映画', '#考えさせられる映画', '#家族で観るべき映画', '#友達と観たい映画',
+]
+
+# 映画タイトルやレビュー本文を組み立てるための語句
+TITLE_WORDS = ['星', '夜明け', '約束', '海', '記憶', '風', '旅', '夏', '影', '光', '雨', '桜', 'ミライ', 'キセキ', 'シグナル']
+NAME_WORDS = ['山田', '佐藤', '鈴木', '高橋', '田中', '伊藤', '渡辺', '中村', '小林', '加藤']
+GIVEN_WORDS = ['太郎', '花子', '健', '美咲', '翔', '結衣', '大輔', 'さくら', '蓮', '陽菜']
+SENTENCES = [
+    '映像がとても美しかったです。', '最後の展開に驚きました。', '音楽が印象に残りました。',
+    'もう一度観たいと思える作品です。', '少し長く感じました。', '俳優の演技が素晴らしかった。',
+    '家族と一緒に楽しめました。', '期待していたほどではなかった。',
+]
+
+
+class Command(BaseCommand):
+    help = 'ベンチマーク用にユーザー、映画、レビュー、ハッシュタグ、お気に入り、リアクションのダミーデータを一括作成します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='作成するユーザー数')
+        parser.add_argument('--movies', type=int, default=200, help='作成する映画数')
+        parser.add_argument('--reviews', type=int, default=1000, help='作成するレビュー数（1,000〜1,000,000程度を想定）')
+        parser.add_argument('--favorites-per-user', type=int, default=10, help='ユーザー1人あたりのお気に入り数')
+        parser.add_argument('--reactions', type=int, default=None, help='作成するリアクション数（省略時はレビュー数と同じ）')
+        parser.add_argument('--max-hashtags', type=int, default=3, help='レビュー1件あたりの最大ハッシュタグ数')
+        parser.add_argument('--password', default='benchmark-pass', help='作成するユーザーのパスワード')
+        parser.add_argument('--seed', type=int, default=0, help='乱数のシード（同じ値なら同じデータを生成）')
+        parser.add_argument('--batch-size', type=int, default=2000, help='bulk_create の1回あたりの件数')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        user_count = options['users']
+        movie_count = options['movies']
+        review_count = options['reviews']
+        reaction_count = options['reactions'] if options['reactions'] is not None else review_count
+
+        # 同じユーザーが同じ映画にレビューできるのは1件までなので、組み合わせ数を超えないようにする
+        if review_count > user_count * movie_count:
+            raise CommandError('レビュー数がユーザー数×映画数を超えています。--users か --movies を増やしてください。')
+        if reaction_count > user_count * review_count:
+            raise CommandError('リアクション数がユーザー数×レビュー数を超えています。')
+
+        started = time.perf_counter()
+        hashtag_ids = self.create_hashtags()
+        user_ids = self.create_users(user_count, options['password'])
+        movie_ids = self.create_movies(movie_count)
+        reactions = self.plan_reactions(len(user_ids), review_count, reaction_count)
+        review_ids = self.create_reviews(user_ids, movie_ids, review_count, reactions)
+        self.create_review_hashtags(review_ids, hashtag_ids, options['max_hashtags'])
+        self.create_reactions(user_ids, review_ids, reactions)
+        self.create_favorites(user_ids, movie_ids, options['favorites_per_user'])
+        # bulk_create ではシグナルが送られないため、作成した映画とレビューの検索用の索引をまとめて作る
+        self.index_for_search(Movie, movie_ids)
+        self.index_for_search(Review, review_ids)
+        # 映画の評価とレビューの参考になった度も、シグナルの代わりにまとめて計算する
+        self.compute_ratings(movie_ids, review_ids)
+        analyze_tables(connection)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'ユーザー{len(user_ids)}件、映画{len(movie_ids)}件、レビュー{len(review_ids)}件、'
+            f'リアクション{len(reactions)}件を作成しました（{time.perf_counter() - started:.1f}秒）。'
+        ))
+
+    def bulk_create(self, model, objects):
+        # バッチごとにトランザクションを分け、SQLiteの書き込みロックを長時間保持しないようにする
+        for start in range(0, len(objects), self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(objects[start:start + self.batch_size])
+
+    def created_ids(self, model, last_id):
+        # bulk_create で作成した行のIDを作成順に取得する
+        return list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+
+    def index_for_search(self, model, ids):
+        kind = kind_of(model)
+        if ids:
+            queryset = model.objects.filter(id__gte=ids[0]).only('id', *INDEXED_FIELDS[kind]).order_by('id')
+            index_objects(kind, queryset.iterator(chunk_size=self.batch_size))
+
+    def compute_ratings(self, movie_ids, review_ids):
+        for start in range(0, len(movie_ids), self.batch_size):
+            refresh_movie_ratings(movie_ids[start:start + self.batch_size])
+        for start in range(0, len(review_ids), self.batch_size):
+            refresh_helpfulness(review_ids[start:start + self.batch_size])
+
+    def last_id(self, model):
+        return model.objects.aggregate(Max('id'))['id__max'] or 0
+
+    def create_hashtags(self):
+        existing = set(Hashtag.objects.values_list('label', flat=True))
+        new_hashtags = [Hashtag(label=label, category='genre') for label in GENRE_LABELS if label not in existing]
+        new_hashtags += [Hashtag(label=label, category='situation') for label in SITUATION_LABELS if label not in existing]
+        Hashtag.objects.bulk_create(new_hashtags)
+        return list(Hashtag.objects.values_list('id', flat=True))
+
+    def create_users(self, count, password):
+        last_id = self.last_id(User)
+        # パスワードのハッシュ化は重いため、1回だけ計算して全ユーザーで使い回す
+        password_hash = make_password(password)
+        users = [
+            User(
+                username=f'bench_user_{last_id + i}',
+                email=f'bench_user_{last_id + i}@example.com',
+                password=password_hash,
+            )
+            for i in range(1, count + 1)
+        ]
+        self.bulk_create(User, users)
+        return self.created_ids(User, last_id)
+
+    def create_movies(self, count):
+        last_id = self.last_id(Movie)
+        movies = []
+        for i in range(1, count + 1):
+            words = self.rng.sample(TITLE_WORDS, 2)
+            movies.append(Movie(
+                title=f'{words[0]}と{words[1]}の物語 {last_id + i}',
+                plot=''.join(self.rng.choices(SENTENCES, k=3)),
+                director=self.person_name(),
+                cast='、'.join(self.person_name() for _ in range(3)),
+                release_year=self.rng.randint(1950, 2024),
+            ))
+        self.bulk_create(Movie, movies)
+        return self.created_ids(Movie, last_id)
+
+    def person_name(self):
+        return self.rng.choice(NAME_WORDS) + self.rng.choice(GIVEN_WORDS)
+
+    def plan_reactions(self, user_count, review_count, reaction_count):
+        """
+        リアクションを (ユーザーの添字, レビューの添字, 種類) のリストとして先に決めておく。
+        レビュー作成時に good_count/bad_count を正しい値で埋めるために使う。
+        """
+        pairs = self.rng.sample(range(user_count * review_count), reaction_count)
+        return [
+            (pair // review_count, pair % review_count, 'good' if self.rng.random() < 0.7 else 'bad')
+            for pair in pairs
+        ]
+
+    def create_reviews(self, user_ids, movie_ids, count, reactions):
+        good_counts = [0] * count
+        bad_counts = [0] * count
+        for _, review_index, rating_type in reactions:
+            if rating_type == 'good':
+                good_counts[review_index] += 1
+            else:
+                bad_counts[review_index] += 1
+
+        last_id = self.last_id(Review)
+        # ユーザーと映画の組み合わせが重複しないように選ぶ
+        pairs = self.rng.sample(range(len(user_ids) * len(movie_ids)), count)
+        reviews = []
+        for index, pair in enumerate(pairs):
+            reviews.append(Review(
+                user_id=user_ids[pair // len(movie_ids)],
+                movie_id=movie_ids[pair % len(movie_ids)],
+                rating=Decimal(self.rng.randint(1, 10)) / 2,
+                title=self.rng.choice(SENTENCES)[:-1],
+                comment=''.join(self.rng.choices(SENTENCES, k=self.rng.randint(1, 6))),
+                spoiler=self.rng.random() < 0.1,
+                good_count=good_counts[index],
+                bad_count=bad_counts[index],
+            ))
+        self.bulk_create(Review, reviews)
+        return self.created_ids(Review, last_id)
+
+    def create_review_hashtags(self, review_ids, hashtag_ids, max_hashtags):
+        review_hashtags = []
+        for review_id in review_ids:
+            for hashtag_id in self.rng.sample(hashtag_ids, self.rng.randint(0, min(max_hashtags, len(hashtag_ids)))):
+                review_hashtags.append(ReviewHashtag(review_id=review_id, hashtag_id=hashtag_id))
+        self.bulk_create(ReviewHashtag, review_hashtags)
+
+    def create_reactions(self, user_ids, review_ids, reactions):
+        self.bulk_create(ReviewReaction, [
+            ReviewReaction(user_id=user_ids[user_index], review_id=review_ids[review_index], rating_type=rating_type)
+            for user_index, review_index, rating_type in reactions
+        ])
+
+    def create_favorites(self, user_ids, movie_ids, per_user):
+        per_user = min(per_user, len(movie_ids))
+        self.bulk_create(FavoriteMovie, [
+            FavoriteMovie(user_id=user_id, movie_id=movie_id)
+            for user_id in user_ids
+            for movie_id in self.rng.sample(movie_ids, per_user)
+        ])
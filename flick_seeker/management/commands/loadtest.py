@@ -0,0 +1,101 @@
+import asyncio
+import json
+import logging
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import got_request_exception
+from django.db import OperationalError
+
+from flick_seeker.loadtest import AsgiTransport, HttpTransport, run_load_test
+from flick_seeker.models import Hashtag, Movie, Review, User
+
+
+def format_ms(value):
+    # 成功したリクエストがない場合はパーセンタイルが None になる
+    return '-' if value is None else f'{value:.1f}ms'
+
+
+class Command(BaseCommand):
+    help = '複数の仮想ユーザーで同時にログイン、検索、閲覧、投票、お気に入りを行い、レイテンシとエラー率を計測します。'
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group()
+        target.add_argument('--url', help='負荷をかけるサーバーのURL（例: http://127.0.0.1:8000）')
+        target.add_argument('--asgi', action='store_true', help='screen_speak/asgi.py のアプリケーションをプロセス内で直接呼び出す')
+        parser.add_argument('--users', type=int, default=10, help='同時に動かす仮想ユーザー数')
+        parser.add_argument('--sessions', type=int, default=5, help='仮想ユーザー1人あたりのシナリオの実行回数')
+        parser.add_argument('--think-time', type=float, default=0.0, help='操作の間に待つ最大秒数')
+        parser.add_argument('--password', default='benchmark-pass', help='generate_data で作成したユーザーのパスワード')
+        parser.add_argument('--seed', type=int, default=0, help='乱数のシード')
+        parser.add_argument('--output', help='結果のJSONを書き出すファイル（省略時は標準出力）')
+
+    def handle(self, *args, **options):
+        logging.getLogger('django.db.backends').setLevel(logging.WARNING)
+
+        emails = list(
+            User.objects.filter(email__startswith='bench_user_').order_by('id').values_list('email', flat=True)[:options['users']]
+        )
+        if len(emails) < options['users']:
+            raise CommandError('仮想ユーザーの数だけ generate_data で作成したユーザーが必要です。')
+        accounts = [(email, options['password']) for email in emails]
+        fixtures = self.load_fixtures()
+
+        locked_errors = []
+        if options['asgi']:
+            from screen_speak.asgi import application
+            transport = AsgiTransport(application)
+
+            # プロセス内で実行する場合は、SQLite のロック待ちによる例外を直接数える
+            # （got_request_exception は例外を引数で渡さず、例外の処理中に送られるため sys.exc_info から取り出す）
+            def count_locked(sender, request=None, **kwargs):
+                exc = sys.exc_info()[1]
+                if isinstance(exc, OperationalError) and 'locked' in str(exc):
+                    locked_errors.append(exc)
+
+            got_request_exception.connect(count_locked, weak=False)
+        else:
+            transport = HttpTransport(options['url'] or 'http://127.0.0.1:8000')
+
+        summary = asyncio.run(run_load_test(
+            transport, accounts, fixtures, options['sessions'], options['think_time'], options['seed'],
+        ))
+        summary['virtual_users'] = options['users']
+        summary['target'] = 'asgi' if options['asgi'] else transport.host_header
+        # HTTP 経由ではロックによるエラーを区別できないため、サーバーエラー(5xx)の件数で代用する
+        summary['sqlite_locked_errors'] = len(locked_errors) if options['asgi'] else None
+        summary['server_errors'] = sum(
+            count for step in summary['steps'].values() for status, count in step['status_codes'].items() if status >= 500
+        )
+
+        for name, step in sorted(summary['steps'].items()):
+            self.stderr.write(
+                f"{name}: n={step['requests']} p50={format_ms(step['p50_ms'])} p95={format_ms(step['p95_ms'])} "
+                f"p99={format_ms(step['p99_ms'])} errors={step['error_rate']:.1%}"
+            )
+        self.stderr.write(
+            f"total: {summary['requests']} requests, {summary['throughput_rps']:.1f} req/s, "
+            f"errors={summary['error_rate']:.1%}, sqlite_locked={summary['sqlite_locked_errors']}"
+        )
+
+        output = json.dumps(summary, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def load_fixtures(self):
+        # 仮想ユーザーが操作に使う映画、レビュー、ハッシュタグ、検索語をあらかじめ読み込む
+        movies = list(Movie.objects.order_by('id').values_list('id', 'title')[:200])
+        if not movies:
+            raise CommandError('映画がありません。先に generate_data を実行してください。')
+        review_ids = {movie_id: [] for movie_id, _ in movies}
+        for review_id, movie_id in Review.objects.filter(movie_id__in=review_ids).values_list('id', 'movie_id')[:5000]:
+            review_ids[movie_id].append(review_id)
+        return {
+            'movies': [(movie_id, review_ids[movie_id][:20]) for movie_id, _ in movies],
+            'queries': [title[:2] for _, title in movies],
+            'genres': list(Hashtag.objects.filter(category='genre').values_list('label', flat=True)),
+            'situations': list(Hashtag.objects.filter(category='situation').values_list('label', flat=True)),
+        }
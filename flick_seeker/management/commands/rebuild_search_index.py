@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from flick_seeker.models import Movie, Review
+from flick_seeker.search_index import INDEXED_FIELDS, analyze_tables, index_objects, kind_of
+
+
+class Command(BaseCommand):
+    help = '映画とレビューの検索用の n-gram 索引を作り直します。generate_data などで一括作成したデータの索引を作るときに使います。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=sorted(INDEXED_FIELDS), help='指定した種類だけ作り直す（省略時はすべて）')
+
+    def handle(self, *args, **options):
+        for model in (Movie, Review):
+            kind = kind_of(model)
+            if options['kind'] and options['kind'] != kind:
+                continue
+            queryset = model.objects.only('id', *INDEXED_FIELDS[kind]).order_by('pk')
+            index_objects(kind, queryset.iterator(chunk_size=2000))
+            self.stdout.write(f'{model.__name__}: {queryset.count()} 件の索引を作成しました。')
+        analyze_tables(connection)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from flick_seeker.models import User
+from flick_seeker.stats import reconcile_users
+
+
+class Command(BaseCommand):
+    help = 'ユーザーごとの統計（UserStats）を、レビュー、お気に入り、ハッシュタグから数え直します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回の集計で数え直すユーザー数')
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help='数え直すユーザーID（複数指定可。省略した場合は全員）')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['user_ids']:
+            users = users.filter(pk__in=options['user_ids'])
+        batch_size = options['batch_size']
+        last_pk = 0
+        reconciled = 0
+        while True:
+            # 毎回 pk の続きから取得するため、OFFSET で遅くならない
+            user_ids = list(users.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if not user_ids:
+                break
+            reconcile_users(user_ids)
+            reconciled += len(user_ids)
+            last_pk = user_ids[-1]
+        self.stdout.write(f'{reconciled}人のユーザーの統計を数え直しました。')
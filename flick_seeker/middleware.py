@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError
+
+from .fileserving import ServedFile
+from .perf import (
+    ensure_query_timer, finish_request, install_query_timer, install_template_timer, metrics_store, save_slow_queries,
+    start_request,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PerformanceMiddleware:
+    """
+    リクエストごとの処理時間、SQLの件数と時間、テンプレート描画時間、レスポンスサイズを計測するミドルウェア。
+    計測結果は URL名ごとに集計し、PERF_SERVER_TIMING が True の場合とスタッフのリクエストでは
+    Server-Timing ヘッダーとしてレスポンスにも付与する（SQLの件数などの内部の情報を一般の利用者に見せないため）。
+    flick_seeker のビューで発生したスロークエリは SlowQuery テーブルに保存する。
+    WSGI（同期）と ASGI（非同期）の両方で動作する。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_query_timer()
+        install_template_timer()
+        # 非同期のビューを ASGI で動かすときは、このミドルウェアも非同期で動作させる
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        ensure_query_timer()
+        metrics, token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            finish_request(token)
+        name = self.process_metrics(request, response, metrics, self.show_server_timing(request))
+        if self.should_save_slow_queries(request):
+            self.save_slow_queries(metrics, name)
+        return response
+
+    async def __acall__(self, request):
+        # クエリはビューの同期処理を実行するスレッドの接続で発行されるため、そのスレッドで登録する
+        await sync_to_async(ensure_query_timer)()
+        metrics, token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            finish_request(token)
+        # request.user の読み込みはデータベースにアクセスするため、スレッドで判定する
+        show_server_timing = await sync_to_async(self.show_server_timing)(request)
+        name = self.process_metrics(request, response, metrics, show_server_timing)
+        if self.should_save_slow_queries(request):
+            await sync_to_async(self.save_slow_queries)(metrics, name)
+        return response
+
+    def show_server_timing(self, request):
+        if settings.PERF_SERVER_TIMING:
+            return True
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+    def process_metrics(self, request, response, metrics, show_server_timing):
+        # URL名ごとに集計し、show_server_timing が True の場合は Server-Timing ヘッダーを付与する。集計に使ったURL名を返す
+        total_ms = metrics.elapsed() * 1000
+        sql_ms = metrics.sql_time * 1000
+        template_ms = metrics.template_time * 1000
+        # ストリーミングレスポンスは本文のサイズが確定しないため 0 とする
+        size = 0 if response.streaming else len(response.content)
+
+        if show_server_timing:
+            response['Server-Timing'] = ', '.join([
+                f'total;dur={total_ms:.1f}',
+                f'sql;dur={sql_ms:.1f};desc="{metrics.sql_count} queries"',
+                f'tpl;dur={template_ms:.1f}',
+            ])
+
+        # URL名で集計する（解決できなかったリクエストはまとめて扱う）
+        match = getattr(request, 'resolver_match', None)
+        name = match.view_name if match else '<unresolved>'
+        metrics_store.record(name, total_ms, metrics.sql_count, sql_ms, template_ms, size)
+        return name
+
+    def should_save_slow_queries(self, request):
+        match = getattr(request, 'resolver_match', None)
+        return match is not None and match.func.__module__.startswith('flick_seeker.')
+
+    def save_slow_queries(self, metrics, name):
+        try:
+            save_slow_queries(metrics, name)
+        except DatabaseError:
+            # 記録に失敗してもレスポンスは返す
+            logger.exception('failed to save slow queries for %s', name)
+
+
+class StaticFilesMiddleware:
+    """
+    collectstatic で STATIC_ROOT に集めたファイルをアプリケーションから直接配信するミドルウェア。
+    Web サーバーで静的ファイルを配信できないホスティング環境向け。
+    起動時に STATIC_ROOT のファイルを一覧にしておき、リクエストごとのファイルシステムへのアクセスを減らす。
+    ハッシュ付きのファイル名は内容が変わらないため、長期間キャッシュさせる。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if settings.DEBUG or not settings.STATIC_ROOT or not os.path.isdir(settings.STATIC_ROOT):
+            # 開発環境では runserver が配信する。collectstatic 前は何もしない
+            raise MiddlewareNotUsed
+        self.prefix = '/' + settings.STATIC_URL.lstrip('/')
+        self.files = self.scan(settings.STATIC_ROOT)
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        # ファイルの一覧を辞書で引くだけなので、イベントループ上でそのまま処理する
+        return self.serve(request) or await self.get_response(request)
+
+    def serve(self, request):
+        if request.method not in ('GET', 'HEAD') or not request.path_info.startswith(self.prefix):
+            return None
+        served_file = self.files.get(request.path_info[len(self.prefix):])
+        if served_file is None:
+            return None
+        return served_file.response(request)
+
+    def scan(self, root):
+        hashed_names = self.hashed_names(root)
+        immutable = f'public, max-age={settings.STATIC_MAX_AGE_HASHED}, immutable'
+        revalidate = f'public, max-age={settings.STATIC_MAX_AGE}'
+        files = {}
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith(('.gz', '.br')):
+                    # 圧縮版は元のファイルの ServedFile から参照する
+                    continue
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, root).replace(os.sep, '/')
+                files[name] = ServedFile(path, immutable if name in hashed_names else revalidate)
+        return files
+
+    def hashed_names(self, root):
+        # ManifestStaticFilesStorage のマニフェストからハッシュ付きのファイル名を読み込む
+        try:
+            with open(os.path.join(root, 'staticfiles.json'), encoding='utf-8') as f:
+                return set(json.load(f).get('paths', {}).values())
+        except (OSError, ValueError):
+            return set()
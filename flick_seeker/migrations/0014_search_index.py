@@ -0,0 +1,97 @@
+# Generated by Django 4.2 on 2026-10-19 13:49
+
+from itertools import islice
+import re
+import unicodedata
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# マイグレーションの結果が後から変わらないように、flick_seeker.text と flick_seeker.search_index は参照せず
+# 作成時点の正規化と分割の処理をここに固定する
+INDEXED_FIELDS = {
+    'movie': ('title', 'director', 'cast', 'plot'),
+    'review': ('title', 'comment'),
+}
+BATCH_SIZE = 500
+RUN_RE = re.compile(r'\w+')
+KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+
+
+def normalize_text(value):
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKC', value).casefold().translate(KATAKANA_TO_HIRAGANA)
+    return ' '.join(value.split())
+
+
+def ngrams(text):
+    terms = []
+    for run in RUN_RE.findall(text):
+        terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        terms.append(run[-1])
+    return terms
+
+
+def build_search_index(apps, schema_editor):
+    # 既存の映画とレビューの索引を作る
+    SearchDocument = apps.get_model('flick_seeker', 'SearchDocument')
+    SearchTerm = apps.get_model('flick_seeker', 'SearchTerm')
+    for kind, model_name in (('movie', 'Movie'), ('review', 'Review')):
+        model = apps.get_model('flick_seeker', model_name)
+        objects = model.objects.only('id', *INDEXED_FIELDS[kind]).order_by('pk').iterator()
+        while True:
+            batch = list(islice(objects, BATCH_SIZE))
+            if not batch:
+                break
+            documents = SearchDocument.objects.bulk_create([
+                SearchDocument(kind=kind, object_id=obj.pk, field=field, text=normalize_text(getattr(obj, field)))
+                for obj in batch
+                for field in INDEXED_FIELDS[kind]
+            ])
+            SearchTerm.objects.bulk_create(
+                [SearchTerm(document=document, term=term) for document in documents for term in set(ngrams(document.text))],
+                batch_size=BATCH_SIZE,
+            )
+
+    # 統計がないと SQLite は語の索引よりも文書の種類の索引を優先してしまうため、作成後に更新する
+    connection = schema_editor.connection
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            for table in ('flick_seeker_searchdocument', 'flick_seeker_searchterm'):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(table)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flick_seeker', '0013_image_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('movie', '映画'), ('review', 'レビュー')], max_length=10)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('field', models.CharField(max_length=20)),
+                ('text', models.TextField()),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id', 'field')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=2)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='flick_seeker.searchdocument')),
+            ],
+            options={
+                'unique_together': {('term', 'document')},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2 on 2026-10-19 14:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flick_seeker', '0015_background_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedReview',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('review_id', models.PositiveBigIntegerField(unique=True)),
+                ('rating', models.DecimalField(decimal_places=1, max_digits=2)),
+                ('title', models.CharField(max_length=255)),
+                ('comment', models.TextField()),
+                ('spoiler', models.BooleanField(default=False)),
+                ('good_count', models.PositiveIntegerField(default=0)),
+                ('bad_count', models.PositiveIntegerField(default=0)),
+                ('hashtag_ids', models.JSONField(default=list)),
+                ('reactions', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='flick_seeker.movie')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-deleted_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedReaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_good', models.BooleanField()),
+                ('review', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='flick_seeker.review')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('review', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-19 14:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flick_seeker', '0016_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.DecimalField(decimal_places=1, default=0, max_digits=12)),
+                ('favorite_count', models.PositiveIntegerField(default=0)),
+                ('good_received', models.PositiveIntegerField(default=0)),
+                ('bad_received', models.PositiveIntegerField(default=0)),
+                ('top_hashtags', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
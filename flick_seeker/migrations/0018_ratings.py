@@ -0,0 +1,77 @@
+# Generated by Django 4.2 on 2026-10-19 15:20
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Sqrt
+from django.db.models.lookups import GreaterThan
+
+# マイグレーションの結果が後から変わらないように、flick_seeker.ratings と設定値は参照せずここに固定する
+WILSON_Z = 1.96
+RATING_PRIOR_MEAN = 3.0
+RATING_PRIOR_WEIGHT = 10
+
+
+def compute_ratings(apps, schema_editor):
+    # 既存の映画のレビューの集計とベイズ平均、レビューの参考になった度を計算する
+    Movie = apps.get_model('flick_seeker', 'Movie')
+    Review = apps.get_model('flick_seeker', 'Review')
+
+    reviews = Review.objects.filter(movie=OuterRef('pk')).order_by().values('movie')
+    Movie.objects.update(
+        review_count=Coalesce(Subquery(reviews.annotate(n=Count('id')).values('n')), Value(0)),
+        rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), Value(0)),
+    )
+    Movie.objects.update(bayesian_rating=Case(
+        When(review_count=0, then=Value(0.0)),
+        default=(
+            (Value(RATING_PRIOR_WEIGHT * RATING_PRIOR_MEAN) + Cast('rating_sum', FloatField()))
+            / (Value(float(RATING_PRIOR_WEIGHT)) + F('review_count'))
+        ),
+        output_field=FloatField(),
+    ))
+
+    # Good の割合の Wilson スコアの下限（投票がない場合は 0）
+    good = Cast('good_count', FloatField())
+    bad = Cast('bad_count', FloatField())
+    n = good + bad
+    z2 = WILSON_Z * WILSON_Z
+    score = (
+        (good / n + Value(z2) / (2 * n) - WILSON_Z * Sqrt((good * bad / n + Value(z2 / 4)) / (n * n)))
+        / (1 + Value(z2) / n)
+    )
+    Review.objects.update(helpfulness=Case(When(GreaterThan(n, 0), then=score), default=Value(0.0), output_field=FloatField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flick_seeker', '0017_user_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='bayesian_rating',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.DecimalField(decimal_places=1, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='review_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='helpfulness',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['movie', '-helpfulness'], name='review_movie_helpfulness_idx'),
+        ),
+        migrations.RunPython(compute_ratings, migrations.RunPython.noop),
+    ]
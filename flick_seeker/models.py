@@ -42,6 +42,12 @@ class User(AbstractUser):
     email = models.EmailField(_('email address'), unique=True)  # emailアドレスフィールド
     profile_image = models.ImageField(upload_to='profile_images/', null=True, blank=True, default='profile_images/default-thumbnail.png')  # プロフィール画像フィールド
     bio = models.TextField(_("Bio"), blank=True, null=True)  # 自己紹介文のフィールド
+    # プロフィール画像の情報（画像を開かずに表示できるよう、保存時に記録する）
+    profile_image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    profile_image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    profile_image_size = models.PositiveIntegerField(null=True, blank=True, editable=False)  # バイト数
+    profile_image_hash = models.CharField(max_length=64, blank=True, editable=False)  # 内容の SHA-256
+    profile_image_color = models.CharField(max_length=7, blank=True, editable=False)  # 代表色（#rrggbb）
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Created at'))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Updated at'))
     
@@ -62,6 +68,16 @@ class Movie(models.Model):
     cast = models.CharField(max_length=255)  # 出演者フィールド
     release_year = models.PositiveIntegerField()  # 公開年フィールド
     thumbnail = models.ImageField(upload_to='movie_thumbnails/', blank=True, null=True)
+    # サムネイルの情報（画像を開かずに表示できるよう、保存時に記録する）
+    thumbnail_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    thumbnail_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    thumbnail_size = models.PositiveIntegerField(null=True, blank=True, editable=False)  # バイト数
+    thumbnail_hash = models.CharField(max_length=64, blank=True, editable=False)  # 内容の SHA-256
+    thumbnail_color = models.CharField(max_length=7, blank=True, editable=False)  # 代表色（#rrggbb）
+    # レビューの集計（並べ替えと平均評価の表示に使う。レビューの書き込み時に ratings.refresh_movie_ratings で更新する）
+    review_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)  # レビュー数
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0, editable=False)  # 評価の合計
+    bayesian_rating = models.FloatField(default=0, db_index=True, editable=False)  # ベイズ平均の評価（レビューがない場合は 0）
     created_at = models.DateTimeField(auto_now_add=True)  # 作成日時（自動で現在の日時が設定される）
     updated_at = models.DateTimeField(auto_now=True)  # 更新日時（自動で現在の日時が設定され、更新時に更新される）
     
@@ -79,9 +95,16 @@ class Review(models.Model):
     spoiler = models.BooleanField(default=False)  # ネタバレありの場合はTrue、なしの場合はFalse
     good_count = models.PositiveIntegerField(default=0)  #Goodのためのフィールド
     bad_count = models.PositiveIntegerField(default=0)  #Badのためのフィールド
+    helpfulness = models.FloatField(default=0, editable=False)  # 参考になった度（Good/Bad 数から求めた Wilson スコア）
     created_at = models.DateTimeField(auto_now_add=True)  # 作成日時（自動で現在の日時が設定される）
     updated_at = models.DateTimeField(auto_now=True)  # 更新日時（自動で現在の日時が設定され、更新時に更新される）
 
+    class Meta:
+        indexes = [
+            # 映画ごとのレビューを参考になった順に並べる
+            models.Index(fields=['movie', '-helpfulness'], name='review_movie_helpfulness_idx'),
+        ]
+
     def __str__(self):
         # レビューの文字列表現
         return f'{self.user.username} - {self.movie.title}'
@@ -130,3 +153,145 @@ class ReviewReaction(models.Model):
     rating_type = models.CharField(max_length=255)  # リアクションの種類フィールド
     created_at = models.DateTimeField(auto_now_add=True)  # 作成日時（自動で現在の日時が設定される）
 
+
+# ユーザーごとの統計モデル（マイページで集計せずに表示できるよう、レビュー、お気に入り、投票の書き込み時に更新する）
+class UserStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)  # ユーザー
+    review_count = models.PositiveIntegerField(default=0)  # 投稿したレビュー数
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)  # 投稿したレビューの評価の合計
+    favorite_count = models.PositiveIntegerField(default=0)  # お気に入りの映画の数
+    good_received = models.PositiveIntegerField(default=0)  # レビューが受け取った Good の数
+    bad_received = models.PositiveIntegerField(default=0)  # レビューが受け取った Bad の数
+    top_hashtags = models.JSONField(default=list)  # よく使うハッシュタグ（[ラベル, 件数] のリスト）
+    updated_at = models.DateTimeField(auto_now=True)  # 更新日時
+
+    def __str__(self):
+        # ユーザーの統計の文字列表現
+        return f'{self.user_id} の統計'
+
+    @property
+    def average_rating(self):
+        # 投稿したレビューの平均評価（レビューがない場合は None）
+        if not self.review_count:
+            return None
+        return round(self.rating_sum / self.review_count, 1)
+
+
+# 古いリアクションのアーカイブモデル（投票の取り消しと変更に必要な、誰がどちらに投票したかだけを保持する）
+class ArchivedReaction(models.Model):
+    review = models.ForeignKey(Review, on_delete=models.CASCADE)  # レビュー外部キー
+    user = models.ForeignKey(User, on_delete=models.CASCADE)  # ユーザー外部キー
+    is_good = models.BooleanField()  # Good の場合はTrue、Bad の場合はFalse
+
+    class Meta:
+        unique_together = ('review', 'user')  # 投票時の検索に使う索引を兼ねる
+
+    def __str__(self):
+        # アーカイブしたリアクションの文字列表現
+        return f'{self.user_id} - {self.review_id} - {"good" if self.is_good else "bad"}'
+
+
+# 削除されたレビューのアーカイブモデル（削除したレビューを管理画面から元に戻せるよう保持する）
+class ArchivedReview(models.Model):
+    review_id = models.PositiveBigIntegerField(unique=True)  # 元のレビューのID（元に戻すときに同じIDで作り直す）
+    user = models.ForeignKey(User, on_delete=models.CASCADE)  # ユーザー外部キー
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE)  # 映画外部キー
+    rating = models.DecimalField(max_digits=2, decimal_places=1)
+    title = models.CharField(max_length=255)
+    comment = models.TextField()
+    spoiler = models.BooleanField(default=False)
+    good_count = models.PositiveIntegerField(default=0)
+    bad_count = models.PositiveIntegerField(default=0)
+    hashtag_ids = models.JSONField(default=list)  # 付いていたハッシュタグのID
+    reactions = models.JSONField(default=list)  # 付いていたリアクション（[ユーザーID, Good の場合はtrue] のリスト）
+    created_at = models.DateTimeField()  # 元のレビューの作成日時
+    updated_at = models.DateTimeField()  # 元のレビューの更新日時
+    deleted_at = models.DateTimeField(auto_now_add=True)  # 削除日時
+
+    class Meta:
+        ordering = ['-deleted_at']  # 新しく削除した順に表示
+
+    def __str__(self):
+        # アーカイブしたレビューの文字列表現
+        return f'{self.title}（{self.deleted_at:%Y-%m-%d} に削除）'
+
+
+# スロークエリの記録モデル（直近の一定件数のみを保持するリングバッファとして使用）
+class SlowQuery(models.Model):
+    fingerprint = models.CharField(max_length=32, db_index=True)  # 正規化したSQLのハッシュ値
+    normalized_sql = models.TextField()  # リテラルを「?」に置き換えたSQL
+    sql = models.TextField()  # 実行されたSQL
+    params = models.TextField(blank=True)  # SQLのパラメータ
+    view_name = models.CharField(max_length=255, db_index=True)  # クエリを発行したビューのURL名
+    duration_ms = models.FloatField()  # 実行時間（ミリ秒）
+    explain = models.TextField(blank=True)  # EXPLAIN QUERY PLAN の結果
+    created_at = models.DateTimeField(auto_now_add=True)  # 作成日時（自動で現在の日時が設定される）
+
+    class Meta:
+        ordering = ['-id']  # 新しい順に表示
+
+    def __str__(self):
+        # スロークエリの文字列表現
+        return f'{self.view_name} - {self.duration_ms:.1f}ms'
+
+# 検索用の文書モデル（映画とレビューの検索対象のフィールドごとに、正規化した文字列を保持する）
+class SearchDocument(models.Model):
+    KIND_CHOICES = (
+        ('movie', '映画'),
+        ('review', 'レビュー'),
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)  # 文書の種類
+    object_id = models.PositiveBigIntegerField()  # 映画またはレビューのID
+    field = models.CharField(max_length=20)  # 元のフィールド名（title, comment など）
+    text = models.TextField()  # text.normalize_text で正規化した文字列
+
+    class Meta:
+        unique_together = ('kind', 'object_id', 'field')  # 1つのフィールドにつき1件
+
+    def __str__(self):
+        # 検索用の文書の文字列表現
+        return f'{self.kind}:{self.object_id}:{self.field}'
+
+# n-gram の転置索引モデル（文書に含まれる2文字ずつの語と、文字の並びの最後の1文字）
+class SearchTerm(models.Model):
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE)  # 語を含む文書
+    term = models.CharField(max_length=2)  # 語
+
+    class Meta:
+        unique_together = ('term', 'document')  # 語から文書を引く索引を兼ねる
+
+    def __str__(self):
+        # 語の文字列表現
+        return self.term
+
+# バックグラウンドジョブモデル（管理画面の一括操作などの進み具合と結果を記録する）
+class BackgroundJob(models.Model):
+    STATUS_CHOICES = (
+        ('pending', '待機中'),
+        ('running', '実行中'),
+        ('done', '完了'),
+        ('failed', '失敗'),
+    )
+    name = models.CharField(max_length=255)  # ジョブの内容
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')  # 状態
+    total = models.PositiveIntegerField(null=True, blank=True)  # 処理する件数（不明な場合は空）
+    done = models.PositiveIntegerField(default=0)  # 処理済みの件数
+    message = models.TextField(blank=True)  # 結果またはエラーの内容
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)  # ジョブを開始したユーザー
+    created_at = models.DateTimeField(auto_now_add=True)  # 作成日時（自動で現在の日時が設定される）
+    started_at = models.DateTimeField(null=True, blank=True)  # 開始日時
+    finished_at = models.DateTimeField(null=True, blank=True)  # 終了日時
+
+    class Meta:
+        ordering = ['-id']  # 新しい順に表示
+
+    def __str__(self):
+        # バックグラウンドジョブの文字列表現
+        return f'#{self.pk} {self.name}'
+
+    @property
+    def progress(self):
+        # 進み具合（%）。件数が不明な場合は None
+        if not self.total:
+            return 100 if self.status == 'done' else None
+        return min(100, self.done * 100 // self.total)
@@ -0,0 +1,214 @@
+"""
+管理画面の一括操作（ネタバレの設定、レビューの削除、ハッシュタグと映画の統合）と、アカウントの削除。
+
+どの操作も1件ずつではなく、BULK_ACTION_BATCH_SIZE 件ごとに集合に対するクエリで処理する。
+関数は jobs.start_job から呼ばれ、最初の引数の progress に処理した件数を記録して、結果のメッセージを返す。
+"""
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .autocomplete import autocomplete_index
+from .favorites import forget_favorites
+from .models import ArchivedReaction, ArchivedReview, FavoriteMovie, ReviewHashtag, Review, ReviewReaction, User
+from .ratings import refresh_helpfulness, refresh_movie_ratings
+from .search_index import remove_objects
+from .signals import bulk_changes
+from .stats import reconcile_users
+
+
+def _reconcile(user_ids):
+    # ユーザーの統計を BULK_ACTION_BATCH_SIZE 人ずつ数え直す
+    user_ids = sorted(set(user_ids))
+    batch_size = settings.BULK_ACTION_BATCH_SIZE
+    for i in range(0, len(user_ids), batch_size):
+        reconcile_users(user_ids[i:i + batch_size])
+
+
+def _batches(queryset):
+    """
+    queryset に一致する行のIDを BULK_ACTION_BATCH_SIZE 件ずつ返す。
+    処理した行が条件に一致しなくなる操作（削除、更新）で使う。毎回先頭から取り直すため、OFFSET で遅くならない。
+    """
+    batch_size = settings.BULK_ACTION_BATCH_SIZE
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        yield ids
+
+
+@contextmanager
+def _batch(progress, count):
+    """
+    1バッチ分のトランザクション。最初に進み具合を書き込み、書き込みロックを取ってから処理する。
+    SQLite では、トランザクションの中で読み込んだあとに書き込もうとすると、
+    他の接続と競合した場合に待たずに「database is locked」で失敗するため。
+    """
+    with transaction.atomic():
+        progress.advance(count)
+        yield
+
+
+def mark_spoiler(progress, queryset):
+    # ネタバレありに変更する。すでにネタバレありのものは数えない
+    queryset = queryset.filter(spoiler=False)
+    progress.set_total(queryset.count())
+    updated = 0
+    for ids in _batches(queryset):
+        with _batch(progress, len(ids)):
+            updated += Review.objects.filter(pk__in=ids).update(spoiler=True)
+    return f'{updated}件のレビューをネタバレありにしました。'
+
+
+def _delete_reviews(progress, ids, count=None):
+    """
+    レビューを削除し、検索の索引、入力補完の人気度、投稿したユーザーの統計、映画の評価をまとめて更新する。
+    ハッシュタグとリアクションは、シグナルの受信側がないため1回の DELETE で削除される。
+    """
+    with _batch(progress, len(ids) if count is None else count), bulk_changes():
+        rows = list(Review.objects.filter(pk__in=ids).values_list('movie_id', 'user_id'))
+        popularity = Counter(movie_id for movie_id, _ in rows)
+        Review.objects.filter(pk__in=ids).delete()
+        remove_objects(Review, ids)
+        reconcile_users({user_id for _, user_id in rows})
+        refresh_movie_ratings(list(popularity))
+    for movie_id, n in popularity.items():
+        autocomplete_index.add_popularity(movie_id, -n)
+
+
+def delete_reviews(progress, queryset):
+    progress.set_total(queryset.count())
+    deleted = 0
+    for ids in _batches(queryset):
+        _delete_reviews(progress, ids)
+        deleted += len(ids)
+    return f'{deleted}件のレビューを削除しました。'
+
+
+def merge_hashtags(progress, target, duplicates):
+    """
+    duplicates のハッシュタグを target に統合する。
+    すでに target が付いているレビューからは重複する関連を削除し、それ以外は target に付け替える。
+    ハッシュタグを使っていたユーザーの統計（よく使うハッシュタグ）は、統合したあとに数え直す。
+    """
+    progress.set_total(len(duplicates))
+    moved = 0
+    user_ids = set()
+    for hashtag in duplicates:
+        with _batch(progress, 1):
+            user_ids.update(Review.objects.filter(reviewhashtag__hashtag=hashtag).values_list('user_id', flat=True))
+            tagged = ReviewHashtag.objects.filter(hashtag=target).values('review_id')
+            ReviewHashtag.objects.filter(hashtag=hashtag, review_id__in=tagged).delete()
+            moved += ReviewHashtag.objects.filter(hashtag=hashtag).update(hashtag=target)
+            hashtag.delete()
+    _reconcile(user_ids)
+    return f'{len(duplicates)}件のハッシュタグを「{target.label}」に統合しました（{moved}件のレビューを付け替えました）。'
+
+
+def merge_movies(progress, target, duplicates):
+    """
+    duplicates の映画を target に統合する。レビュー（Good/Bad のリアクションを含む）、アーカイブしたレビュー、お気に入りを
+    target に移し、target にすでにレビューまたはお気に入りがあるユーザーの分は削除してから、映画を削除する。
+    """
+    progress.set_total(len(duplicates))
+    moved_reviews = moved_favorites = 0
+    for movie in duplicates:
+        # 同じユーザーが両方の映画にレビューを書いている場合は、統合先のレビューを残す
+        conflicts = Review.objects.filter(movie=movie, user_id__in=Review.objects.filter(movie=target).values('user_id'))
+        for ids in _batches(conflicts):
+            _delete_reviews(progress, ids, count=0)
+        with _batch(progress, 1):
+            with bulk_changes():
+                duplicated = FavoriteMovie.objects.filter(movie=movie, user_id__in=FavoriteMovie.objects.filter(movie=target).values('user_id'))
+                # 両方の映画をお気に入りにしているユーザーは、お気に入りの数が減る
+                reconcile_after = list(duplicated.values_list('user_id', flat=True))
+                duplicated.delete()
+                # アーカイブしたレビューも、映画の削除で一緒に消えないよう target に移す
+                # （レビューと同じく、target にレビューまたはアーカイブしたレビューがあるユーザーの分は target のものを残す）
+                ArchivedReview.objects.filter(movie=movie).filter(
+                    Q(user_id__in=Review.objects.filter(movie=target).values('user_id'))
+                    | Q(user_id__in=ArchivedReview.objects.filter(movie=target).values('user_id'))
+                ).delete()
+                ArchivedReview.objects.filter(movie=movie).update(movie=target)
+                reviews = Review.objects.filter(movie=movie).update(movie=target)
+                # update ではシグナルが送られないため、お気に入りの映画IDの集合はここで削除する
+                forget_favorites(FavoriteMovie.objects.filter(movie=movie).values_list('user_id', flat=True))
+                favorites = FavoriteMovie.objects.filter(movie=movie).update(movie=target)
+                reconcile_users(reconcile_after)
+            # 映画の検索の索引と入力補完の候補は、削除時のシグナルで取り除く
+            movie.delete()
+            refresh_movie_ratings([target.pk])
+        # 削除した映画の人気度は索引から取り除かれるため、移した分を統合先に加える
+        autocomplete_index.add_popularity(target.pk, reviews + favorites)
+        moved_reviews += reviews
+        moved_favorites += favorites
+    return (
+        f'{len(duplicates)}件の映画を「{target.title}」に統合しました'
+        f'（レビュー{moved_reviews}件、お気に入り{moved_favorites}件を移しました）。'
+    )
+
+
+def _count(queryset):
+    # レビューごとの件数を数えるサブクエリ（該当する行がない場合は 0）
+    queryset = queryset.filter(review=OuterRef('pk')).order_by().values('review')
+    return Coalesce(Subquery(queryset.annotate(n=Count('id')).values('n')), Value(0))
+
+
+def _reaction_count(rating_type):
+    # アーカイブしたものを含めたリアクション数
+    return (
+        _count(ReviewReaction.objects.filter(rating_type=rating_type))
+        + _count(ArchivedReaction.objects.filter(is_good=rating_type == 'good'))
+    )
+
+
+def recount_reactions(review_ids):
+    # レビューの Good/Bad 数を、残っているリアクション（アーカイブしたものを含む）から1回の UPDATE で数え直し、参考になった度も計算し直す
+    Review.objects.filter(pk__in=review_ids).update(good_count=_reaction_count('good'), bad_count=_reaction_count('bad'))
+    refresh_helpfulness(review_ids)
+
+
+def delete_account(progress, user_id):
+    """
+    ユーザーと、そのレビュー、リアクション、お気に入りをバッチごとに削除する。
+    まとめて削除すると SQLite の書き込みロックを長い間保持するため、バッチごとにコミットする。
+    他のユーザーのレビューに付けたリアクションは、削除したあとに対象のレビューの Good/Bad 数と、その投稿者の統計を数え直す。
+    """
+    reactions = ReviewReaction.objects.filter(user_id=user_id)
+    archived_reactions = ArchivedReaction.objects.filter(user_id=user_id)
+    reviews = Review.objects.filter(user_id=user_id)
+    archived_reviews = ArchivedReview.objects.filter(user_id=user_id)
+    favorites = FavoriteMovie.objects.filter(user_id=user_id)
+    progress.set_total(sum(queryset.count() for queryset in (reactions, archived_reactions, reviews, archived_reviews, favorites)))
+
+    for queryset in (reactions, archived_reactions):
+        for ids in _batches(queryset):
+            with _batch(progress, len(ids)):
+                review_ids = set(queryset.model.objects.filter(pk__in=ids).values_list('review_id', flat=True))
+                queryset.model.objects.filter(pk__in=ids).delete()
+                recount_reactions(review_ids)
+                reconcile_users(Review.objects.filter(pk__in=review_ids).values_list('user_id', flat=True).distinct())
+
+    for ids in _batches(reviews):
+        _delete_reviews(progress, ids)
+
+    for ids in _batches(archived_reviews):
+        with _batch(progress, len(ids)):
+            ArchivedReview.objects.filter(pk__in=ids).delete()
+
+    for ids in _batches(favorites):
+        with _batch(progress, len(ids)), bulk_changes():
+            popularity = Counter(FavoriteMovie.objects.filter(pk__in=ids).values_list('movie_id', flat=True))
+            FavoriteMovie.objects.filter(pk__in=ids).delete()
+        for movie_id, count in popularity.items():
+            autocomplete_index.add_popularity(movie_id, -count)
+
+    # 関連する行を削除し終えているため、ユーザーの削除は短い時間で終わる
+    with _batch(progress, 0):
+        User.objects.filter(pk=user_id).delete()
+    return f'ユーザーID {user_id} のアカウントを削除しました。'
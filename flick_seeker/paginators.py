@@ -0,0 +1,67 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.utils.functional import cached_property
+
+
+def estimated_count(model, using='default'):
+    """
+    テーブルの行数の概算を返す。数えずに求められないデータベースでは None を返す。
+    PostgreSQL は統計情報の行数、SQLite は主キーの最大値（削除された行の分だけ多くなる）を使う。
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        # 一度も ANALYZE されていないテーブルは -1 になる
+        return row[0] if row and row[0] >= 0 else None
+    if connection.vendor == 'sqlite' and model._meta.pk.get_internal_type() in ('AutoField', 'BigAutoField'):
+        # 主キーの索引の末尾を読むだけで求められる
+        return model._default_manager.using(using).aggregate(n=Max('pk'))['n'] or 0
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    大きなテーブルで COUNT(*) を実行しないページネーター。
+    絞り込みのない一覧は行数の概算を使い、exact_count_limit 件以下の場合だけ正確に数える。
+    絞り込んだ一覧は max_count 件までしか数えず、それより先のページには移動できない。
+    概算は実際の行数より多くなることがあるため、行が足りないページに達したら正確な行数に揃え、
+    行のないページは実際の最後のページに読み替える。
+    """
+    exact_count_limit = 10000
+    max_count = 100000
+    count_is_estimate = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query'):
+            return super().count
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.exact_count_limit:
+                self.count_is_estimate = True
+                return estimate
+            return super().count
+        # LIMIT を付けたサブクエリで数え、条件に一致する行が多くても max_count 件で打ち切る
+        return queryset.order_by()[:self.max_count].count()
+
+    def page(self, number):
+        page = super().page(number)
+        if not self.count_is_estimate or len(page) >= self.per_page:
+            return page
+        if len(page):
+            # 途中で行が尽きたページは最後のページで、その前のページの行数から正確な行数がわかる
+            self._set_exact_count((page.number - 1) * self.per_page + len(page))
+            return page
+        # 概算の最後のほうのページには行がないため、数え直して実際の最後のページを返す
+        self._set_exact_count(self.object_list.count())
+        return super().page(min(page.number, self.num_pages))
+
+    def _set_exact_count(self, count):
+        self.count = count
+        self.count_is_estimate = False
+        # ページ数は行数から計算してキャッシュされるため、次に参照したときに計算し直す
+        self.__dict__.pop('num_pages', None)
@@ -0,0 +1,282 @@
+"""
+リクエスト単位のパフォーマンス計測を行うモジュール。
+
+PerformanceMiddleware から利用され、ビューごとの処理時間、SQLの件数と時間、
+テンプレートの描画時間、レスポンスサイズを集計する。
+しきい値を超えたクエリは EXPLAIN QUERY PLAN の結果とともに SlowQuery テーブルへ記録する。
+EXPLAIN はクエリの実行中には行わず、レスポンスを作り終えてから記録するときに、同じクエリにつき1回だけ実行する。
+"""
+import hashlib
+import logging
+import math
+import random
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.base import Template
+
+slow_query_logger = logging.getLogger('flick_seeker.slow_query')
+
+# 現在処理中のリクエストの計測値を保持する
+_current_metrics = ContextVar('flick_seeker_request_metrics', default=None)
+
+# テンプレート計測を差し込む前の元の Template._render
+_original_template_render = None
+
+# SQLの正規化に使う正規表現
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST_RE = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+class RequestMetrics:
+    # 1リクエスト分の計測値
+    __slots__ = ('started_at', 'sql_count', 'sql_time', 'template_time', 'slow_queries', '_template_depth')
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0  # 秒
+        self.template_time = 0.0  # 秒
+        self.slow_queries = []  # (sql, params, 実行時間(秒), 接続のエイリアス) のリスト
+        self._template_depth = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+
+def get_current_metrics():
+    # 現在のリクエストの計測値を返す（計測中でなければ None）
+    return _current_metrics.get()
+
+
+def start_request():
+    metrics = RequestMetrics()
+    token = _current_metrics.set(metrics)
+    return metrics, token
+
+
+def finish_request(token):
+    _current_metrics.reset(token)
+
+
+def percentile(values, pct):
+    """
+    ソート済みのリストから最近傍順位法でパーセンタイル値を返す。
+    空のリストの場合は None を返す。
+    """
+    if not values:
+        return None
+    rank = math.ceil(pct / 100 * len(values))
+    return values[max(0, min(len(values), rank) - 1)]
+
+
+def normalize_sql(sql):
+    """
+    リテラルと IN句のプレースホルダー列を「?」にまとめ、空白を詰めたSQLを返す。
+    値だけが異なるクエリを同じものとして集計するために使う。
+    """
+    normalized = _STRING_LITERAL_RE.sub('?', sql)
+    normalized = _NUMBER_RE.sub('?', normalized)
+    normalized = _PLACEHOLDER_LIST_RE.sub('(?)', normalized)
+    normalized = normalized.replace('%s', '?')
+    return _WHITESPACE_RE.sub(' ', normalized).strip()
+
+
+def fingerprint_sql(normalized_sql):
+    # 正規化したSQLのハッシュ値を返す
+    return hashlib.md5(normalized_sql.encode('utf-8')).hexdigest()
+
+
+def explain_query(connection, sql, params):
+    """
+    同じ接続で新しいカーソルを作り、クエリの実行計画を文字列で返す。
+    SELECT 以外のクエリや EXPLAIN に失敗した場合は空文字列を返す。
+    """
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return ''
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute(prefix + sql, params)
+        rows = cursor.fetchall()
+    except Exception:
+        slow_query_logger.exception('failed to explain slow query: %s', sql)
+        return ''
+    finally:
+        cursor.close()
+    # SQLite の結果は (id, parent, notused, detail) の形式なので detail のみを使う
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+class QueryTimer:
+    """
+    connection.execute_wrapper として全ての接続に登録するラッパー。
+    計測中のリクエストがあれば、SQLの件数と時間を計測し、しきい値を超えたクエリをサンプリングしてログに出力する。
+    しきい値を超えたクエリは、実行計画を取得せずに SQL とパラメータだけをリクエストの計測値に保持しておく。
+    計測値は ContextVar から取得するため、sync_to_async で別スレッドから実行されたクエリも計測できる。
+    """
+
+    def __call__(self, execute, sql, params, many, context):
+        metrics = _current_metrics.get()
+        if metrics is None:
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            metrics.sql_count += 1
+            metrics.sql_time += duration
+            if duration >= getattr(settings, 'PERF_SLOW_QUERY_MS', 100) / 1000:
+                if random.random() < getattr(settings, 'PERF_SLOW_QUERY_SAMPLE_RATE', 1.0):
+                    slow_query_logger.warning('slow query (%.1f ms): %s', duration * 1000, sql)
+                # executemany は実行計画を取得できないため記録しない
+                if not many:
+                    metrics.slow_queries.append((sql, params, duration, context['connection'].alias))
+
+
+query_timer = QueryTimer()
+
+
+def _add_query_timer(connection, **kwargs):
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+def ensure_query_timer():
+    # このスレッドで既に作られている接続に QueryTimer を登録する
+    for connection in connections.all(initialized_only=True):
+        _add_query_timer(connection)
+
+
+def install_query_timer():
+    """
+    これから作られる接続に QueryTimer を登録する。
+    接続はスレッドごとに作られるため、既存の接続にはリクエストを処理するスレッドで ensure_query_timer を呼ぶ。
+    """
+    connection_created.connect(_add_query_timer, dispatch_uid='flick_seeker_query_timer')
+    ensure_query_timer()
+
+
+def save_slow_queries(metrics, view_name):
+    """
+    リクエスト中に記録したスロークエリを SlowQuery テーブルへ保存する。
+    実行計画は同じクエリ（フィンガープリント）ごとに1回だけ取得し、保存済みの行にあればそれを使う。
+    PERF_SLOW_QUERY_KEEP 件を超えた古い行は削除し、リングバッファとして扱う。
+    """
+    if not metrics.slow_queries:
+        return
+    from .models import SlowQuery  # アプリの読み込み前にモデルをインポートしないよう遅延インポート
+
+    queries = []
+    for sql, params, duration, alias in metrics.slow_queries:
+        normalized = normalize_sql(sql)
+        queries.append((sql, params, duration, alias, normalized, fingerprint_sql(normalized)))
+    explains = dict(
+        SlowQuery.objects.filter(fingerprint__in={query[-1] for query in queries}).exclude(explain='')
+        .order_by('id').values_list('fingerprint', 'explain')
+    )
+
+    entries = []
+    for sql, params, duration, alias, normalized, fingerprint in queries:
+        if fingerprint not in explains:
+            explains[fingerprint] = explain_query(connections[alias], sql, params)
+        entries.append(SlowQuery(
+            fingerprint=fingerprint,
+            normalized_sql=normalized,
+            sql=sql,
+            params=repr(params) if params is not None else '',
+            view_name=view_name,
+            duration_ms=duration * 1000,
+            explain=explains[fingerprint],
+        ))
+    created = SlowQuery.objects.bulk_create(entries)
+
+    # 最新のIDから保持件数より古い行を削除する
+    keep = getattr(settings, 'PERF_SLOW_QUERY_KEEP', 500)
+    latest_id = created[-1].pk or SlowQuery.objects.order_by('-id').values_list('id', flat=True).first()
+    SlowQuery.objects.filter(id__lte=latest_id - keep).delete()
+
+
+def _instrumented_template_render(self, context):
+    # 入れ子になったテンプレート（include/extends）は二重に数えず、一番外側だけを計測する
+    metrics = _current_metrics.get()
+    if metrics is None:
+        return _original_template_render(self, context)
+    metrics._template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_template_render(self, context)
+    finally:
+        metrics._template_depth -= 1
+        if metrics._template_depth == 0:
+            metrics.template_time += time.perf_counter() - start
+
+
+def install_template_timer():
+    # Template._render を計測用の関数に差し替える（何度呼んでも一度だけ）
+    global _original_template_render
+    if _original_template_render is None:
+        _original_template_render = Template._render
+        Template._render = _instrumented_template_render
+
+
+class MetricsStore:
+    """
+    URL名ごとに直近のサンプルを保持し、パーセンタイルを集計するストア。
+    プロセス内のメモリに保持するため、ワーカーごとの値になる。
+    """
+
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self._totals = defaultdict(int)
+
+    def record(self, name, total_ms, sql_count, sql_ms, template_ms, size):
+        with self._lock:
+            self._samples[name].append((total_ms, sql_count, sql_ms, template_ms, size))
+            self._totals[name] += 1
+
+    def summary(self):
+        # URL名ごとの集計結果を、p95の遅い順に返す
+        with self._lock:
+            snapshot = {name: list(samples) for name, samples in self._samples.items()}
+            totals = dict(self._totals)
+
+        rows = []
+        for name, samples in snapshot.items():
+            count = len(samples)
+            durations = sorted(sample[0] for sample in samples)
+            rows.append({
+                'name': name,
+                'requests': totals[name],
+                'samples': count,
+                'p50_ms': percentile(durations, 50),
+                'p95_ms': percentile(durations, 95),
+                'p99_ms': percentile(durations, 99),
+                'max_ms': durations[-1],
+                'avg_sql_count': sum(sample[1] for sample in samples) / count,
+                'avg_sql_ms': sum(sample[2] for sample in samples) / count,
+                'avg_template_ms': sum(sample[3] for sample in samples) / count,
+                'avg_size': sum(sample[4] for sample in samples) / count,
+            })
+        rows.sort(key=lambda row: row['p95_ms'], reverse=True)
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+
+
+metrics_store = MetricsStore(getattr(settings, 'PERF_MAX_SAMPLES', 1000))
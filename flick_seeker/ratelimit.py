@@ -0,0 +1,103 @@
+"""
+書き込みを行うビューの、トークンバケットによるリクエスト数の制限と、連続した切り替えの抑制。
+
+制限の状態はプロセスごとのメモリに保持する（ネットワーク越しのキャッシュを使わずに、リクエストごとの確認を速く行うため）。
+複数のプロセスで動かす場合、1つのプロセスあたりの上限になる。
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse
+
+
+class TokenBucketLimiter:
+    """
+    キーごとのトークンバケット。rate は1秒あたりに補充されるトークン数、capacity はバケットの大きさ（連続で許可する回数）。
+    保持するキーの数は max_keys までとし、古いものから捨てる。
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # キー -> (トークン数, 最後に補充した時刻)
+        self._lock = threading.Lock()
+
+    def consume(self, key, rate, capacity):
+        """
+        トークンを1つ使う。使えた場合は 0、足りない場合は次のトークンまでの秒数を返す。
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class Debouncer:
+    """
+    同じキーの操作が window 秒以内に繰り返された場合に、それを知らせる。
+    お気に入りや Good/Bad の連打（同じ操作が続けて送られるもの）を、書き込まずに済ませるために使う。
+    キーには操作後の状態を含め、別の状態への変更（Good から Bad への付け替えなど）は抑制しない。
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._last = OrderedDict()  # キー -> 最後に操作した時刻
+        self._lock = threading.Lock()
+
+    def is_bouncing(self, key, window):
+        # 直前に記録した操作から window 秒以内の場合は True を返す
+        with self._lock:
+            last = self._last.get(key)
+        return last is not None and time.monotonic() - last < window
+
+    def record(self, key):
+        # 操作を記録する。書き込みが失敗した場合に再試行を抑制しないよう、書き込みに成功してから呼ぶ
+        with self._lock:
+            self._last.pop(key, None)
+            self._last[key] = time.monotonic()
+            while len(self._last) > self.max_keys:
+                self._last.popitem(last=False)
+
+
+limiter = TokenBucketLimiter()
+debouncer = Debouncer()
+
+
+def client_ip(request):
+    # リバースプロキシの後ろで動かす場合は、プロキシで REMOTE_ADDR を設定する
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def rate_limit(scope):
+    """
+    RATE_LIMITS[scope] の設定で、ユーザーごとと IP アドレスごとにリクエスト数を制限するデコレータ。
+    上限を超えた場合は 429 と Retry-After を返す。
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            limits = settings.RATE_LIMITS.get(scope, {})
+            keys = []
+            if request.user.is_authenticated and 'user' in limits:
+                keys.append(('user', f'{scope}:user:{request.user.pk}'))
+            if 'ip' in limits:
+                keys.append(('ip', f'{scope}:ip:{client_ip(request)}'))
+            wait = max((limiter.consume(key, *limits[kind]) for kind, key in keys), default=0)
+            if wait:
+                response = JsonResponse({'status': 'rate_limited', 'retry_after': round(wait, 1)}, status=429)
+                response['Retry-After'] = str(max(1, round(wait)))
+                return response
+            return view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
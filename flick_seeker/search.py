@@ -0,0 +1,62 @@
+"""
+映画の検索のクエリを組み立てる。
+
+キーワード、ハッシュタグ、評価の条件、並べ替えをすべて SQL の中で行い、評価されていないクエリセットを返す。
+呼び出し側でページに分けてスライスすれば、LIMIT を付けた1回のクエリで必要な件数だけを読み込む。
+- ハッシュタグの条件は、レビューを結合して distinct で重複を除く代わりに、EXISTS のサブクエリで絞り込む。
+- 評価の条件は、いずれかのレビューの評価ではなく、映画の平均評価（小数第1位に丸めたもの）に対して判定する。
+- 平均評価は、映画に保存したレビュー数と評価の合計から SQL の ROUND で求める。
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Exists, F, FloatField, OuterRef
+from django.db.models.functions import Cast, NullIf, Round
+
+from .models import Movie, ReviewHashtag
+from .search_index import search_filter
+
+SEARCH_RESULTS_FIELDS = ('title', 'director', 'cast')  # 映画の検索で対象にするフィールド
+
+
+def with_average_rating(movies):
+    # 平均評価を小数第1位に丸めて average_rating に付ける（レビューがない場合は None）
+    return movies.annotate(average_rating=Round(
+        Cast('rating_sum', FloatField()) / NullIf(F('review_count'), 0),
+        precision=1,
+    ))
+
+
+def hashtag_filter(category, labels):
+    # いずれかのレビューに、指定したカテゴリのハッシュタグ（labels のどれか）が付いている映画
+    return Exists(ReviewHashtag.objects.filter(
+        review__movie=OuterRef('pk'),
+        hashtag__category=category,
+        hashtag__label__in=labels,
+    ))
+
+
+def parse_rating(value):
+    # 評価の条件の入力値を Decimal にする。空や数値でない場合は None（条件にしない）
+    try:
+        return Decimal(value) if value else None
+    except InvalidOperation:
+        return None
+
+
+def search_movies(query=None, genres=(), situations=(), rating_from=None, ordering=('-bayesian_rating', '-id')):
+    """
+    条件に一致する映画のクエリセットを返す。データベースへのクエリは、評価またはスライスしたときに1回だけ行われる。
+    """
+    movies = with_average_rating(Movie.objects.all())
+    # 全角と半角、ひらがなとカタカナの違いを区別せずに n-gram の索引で検索する（空白だけの検索語は条件にしない）
+    condition = search_filter(Movie, query or '', SEARCH_RESULTS_FIELDS)
+    if condition is not None:
+        movies = movies.filter(condition)
+    if genres:
+        movies = movies.filter(hashtag_filter('genre', genres))
+    if situations:
+        movies = movies.filter(hashtag_filter('situation', situations))
+    rating_from = parse_rating(rating_from)
+    if rating_from is not None:
+        movies = movies.filter(average_rating__gte=rating_from)
+    return movies.order_by(*ordering)
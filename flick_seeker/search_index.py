@@ -0,0 +1,147 @@
+"""
+映画とレビューの n-gram 転置索引の作成と検索。
+
+索引は SearchDocument（フィールドごとの正規化した文字列）と SearchTerm（文書に含まれる語）の2つのテーブルからなる。
+検索語も同じ正規化と分割を行い、すべての語を含む文書を索引から絞り込んだうえで、
+3文字以上の検索語は正規化した文字列に実際に含まれるかを確認する（bigram の並びが離れている場合を除くため）。
+"""
+from itertools import islice
+
+from django.db.models import Q
+
+from .text import ngrams, normalize_text, query_terms
+
+# 種類ごとの索引を作るフィールド
+INDEXED_FIELDS = {
+    'movie': ('title', 'director', 'cast', 'plot'),
+    'review': ('title', 'comment'),
+}
+
+# 1回の bulk_create / DELETE で扱う件数（SQLite のパラメータ数の上限に収まるようにする）
+BATCH_SIZE = 500
+
+
+def kind_of(model):
+    # モデルから索引の種類を返す（Movie -> 'movie'）
+    return model._meta.model_name
+
+
+def index_objects(kind, objects):
+    """
+    objects の索引を作り直す。
+    """
+    from .models import SearchDocument, SearchTerm
+
+    objects = iter(objects)
+    while True:
+        # 大量の行でもメモリに載せきらないよう、少しずつ取り出して処理する
+        batch = list(islice(objects, BATCH_SIZE))
+        if not batch:
+            break
+        ids = [obj.pk for obj in batch]
+        # 先に語を削除しておくと、文書の削除時に関連する語を読み込まずに済む
+        SearchTerm.objects.filter(document__kind=kind, document__object_id__in=ids).delete()
+        SearchDocument.objects.filter(kind=kind, object_id__in=ids).delete()
+
+        documents = SearchDocument.objects.bulk_create([
+            SearchDocument(kind=kind, object_id=obj.pk, field=field, text=normalize_text(getattr(obj, field)))
+            for obj in batch
+            for field in INDEXED_FIELDS[kind]
+        ])
+        SearchTerm.objects.bulk_create(
+            [SearchTerm(document=document, term=term) for document in documents for term in set(ngrams(document.text))],
+            batch_size=BATCH_SIZE,
+        )
+
+
+def analyze_tables(connection):
+    """
+    索引の統計情報を更新する。統計がないと SQLite は語の索引よりも文書の種類の索引を優先してしまうため、
+    まとめて索引を作ったあとに実行する。
+    """
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            for table in ('flick_seeker_searchdocument', 'flick_seeker_searchterm'):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(table)}')
+
+
+def index_object(obj):
+    """
+    保存された1件の索引を更新する。索引するフィールドの内容が変わっていない場合
+    （評価やネタバレの有無だけを編集した場合など）は語を作り直さない。
+    """
+    from .models import SearchDocument
+
+    kind = kind_of(type(obj))
+    indexed = dict(SearchDocument.objects.filter(kind=kind, object_id=obj.pk).values_list('field', 'text'))
+    if indexed and all(indexed.get(field) == normalize_text(getattr(obj, field)) for field in INDEXED_FIELDS[kind]):
+        return
+    index_objects(kind, [obj])
+
+
+def remove_object(model, object_id):
+    remove_objects(model, [object_id])
+
+
+def remove_objects(model, object_ids):
+    from .models import SearchDocument, SearchTerm
+
+    kind = kind_of(model)
+    SearchTerm.objects.filter(document__kind=kind, document__object_id__in=object_ids).delete()
+    SearchDocument.objects.filter(kind=kind, object_id__in=object_ids).delete()
+
+
+def matching_object_ids(kind, word, fields):
+    """
+    正規化済みの検索語 word を fields のいずれかに含む映画またはレビューのIDを返すクエリセット（サブクエリ用）。
+    1つ目の語の索引から文書を引き、残りの語を含むかを順に確認する。
+    """
+    from .models import SearchDocument, SearchTerm
+
+    bigrams, singles = query_terms(word)
+    lookups = [Q(term=term) for term in dict.fromkeys(bigrams)]
+    # 1文字の語はその文字で始まる語を範囲で探す（LIKE と違い索引を使える）
+    lookups += [Q(term__gte=char, term__lt=chr(ord(char) + 1)) for char in dict.fromkeys(singles)]
+    needs_text_check = len(word) > 2 or ''.join(bigrams + singles) != word
+    if not lookups:
+        # 記号だけの検索語は索引を使えないため、正規化した文字列から探す
+        return SearchDocument.objects.filter(kind=kind, field__in=fields, text__contains=word).values('object_id')
+
+    first, *rest = lookups
+    terms = SearchTerm.objects.filter(first, document__kind=kind, document__field__in=fields)
+    for lookup in rest:
+        terms = terms.filter(document_id__in=SearchTerm.objects.filter(lookup).values('document_id'))
+    if needs_text_check:
+        # 語がすべて含まれていても離れた位置にある場合や、記号を含む場合があるため、文字列として含むかを確認する
+        terms = terms.filter(document__text__contains=word)
+    return terms.values('document__object_id')
+
+
+def search_filter(model, query, fields=None):
+    """
+    model のクエリセットを query で絞り込むための Q オブジェクトを返す。
+    空白で区切った語をすべて含む（語ごとに fields のいずれかに含む）ものに一致する。検索語が空の場合は None を返す。
+    """
+    kind = kind_of(model)
+    fields = fields or INDEXED_FIELDS[kind]
+    words = normalize_text(query).split()
+    if not words:
+        return None
+    condition = Q()
+    for word in words:
+        condition &= Q(pk__in=matching_object_ids(kind, word, fields))
+    return condition
+
+
+def review_search_filter(query, include_spoilers=False):
+    """
+    レビューを query で絞り込むための Q オブジェクトを返す。検索語が空の場合は None を返す。
+    include_spoilers が False の場合、ネタバレありのレビューは本文を検索せずタイトルだけで探す
+    （検索結果からネタバレの内容が推測できないようにする）。
+    """
+    from .models import Review
+
+    condition = search_filter(Review, query)
+    if condition is None or include_spoilers:
+        return condition
+    return (Q(spoiler=False) & condition) | (Q(spoiler=True) & search_filter(Review, query, ('title',)))
@@ -0,0 +1,208 @@
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .autocomplete import autocomplete_index
+from .backends import user_cache_key
+from .favorites import forget_favorites
+from .images import forget_image_info, refresh_image_metadata
+from .search_index import INDEXED_FIELDS, index_object, kind_of, remove_object
+from .models import FavoriteMovie, Movie, Review, User
+from .ratings import refresh_movie_ratings
+from .stats import add_favorite, add_review, change_review, reconcile_users, refresh_top_hashtags
+
+_bulk_changes = threading.local()
+
+
+@contextmanager
+def bulk_changes():
+    """
+    一括操作の間、レビューとお気に入りの1件ごとの索引、人気度、ユーザーの統計、映画の評価の更新を止める。
+    呼び出し側で、変更した分をまとめて反映する。
+    """
+    _bulk_changes.active = True
+    try:
+        yield
+    finally:
+        _bulk_changes.active = False
+
+
+def in_bulk_changes():
+    return getattr(_bulk_changes, 'active', False)
+
+
+def _cascaded_review_users():
+    # 映画やユーザーの削除に伴って削除されたレビューの投稿者（削除が終わったあとにまとめて統計を数え直す）
+    if not hasattr(_bulk_changes, 'cascaded_review_users'):
+        _bulk_changes.cascaded_review_users = set()
+    return _bulk_changes.cascaded_review_users
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    # プロフィール編集、パスワード変更、退会などでユーザーが変わったらキャッシュを削除する
+    cache.delete(user_cache_key(instance.pk))
+    forget_image_info(instance.profile_image.name)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+def invalidate_movie_image_info(sender, instance, **kwargs):
+    # サムネイルが同じファイル名で差し替えられた場合に古い寸法を使わないよう、保存のたびに削除する
+    forget_image_info(instance.thumbnail.name)
+
+
+def _refresh_image_metadata(instance, field_name, update_fields):
+    # update_fields で画像以外のフィールドだけを保存する場合（ログイン日時の更新など）は読み込まない
+    if update_fields is not None and field_name not in update_fields:
+        return
+    refresh_image_metadata(instance, field_name)
+
+
+@receiver(pre_save, sender=Movie)
+def update_movie_image_metadata(sender, instance, update_fields=None, **kwargs):
+    # サムネイルの寸法、サイズ、ハッシュ、代表色を記録する
+    _refresh_image_metadata(instance, 'thumbnail', update_fields)
+
+
+@receiver(pre_save, sender=User)
+def update_user_image_metadata(sender, instance, update_fields=None, **kwargs):
+    # プロフィール画像の寸法、サイズ、ハッシュ、代表色を記録する
+    _refresh_image_metadata(instance, 'profile_image', update_fields)
+
+
+@receiver(post_save, sender=Movie)
+def update_autocomplete_movie(sender, instance, **kwargs):
+    # 入力補完の索引にタイトル、監督、出演者の変更を反映する
+    autocomplete_index.update_movie(instance)
+
+
+@receiver(post_delete, sender=Movie)
+def remove_autocomplete_movie(sender, instance, **kwargs):
+    autocomplete_index.remove_movie(instance.pk)
+
+
+@receiver(post_save, sender=FavoriteMovie)
+@receiver(post_save, sender=Review)
+def increase_autocomplete_popularity(sender, instance, created, **kwargs):
+    # お気に入りとレビューの数を入力補完の人気度に反映する
+    if created:
+        autocomplete_index.add_popularity(instance.movie_id, 1)
+
+
+@receiver(post_delete, sender=FavoriteMovie)
+@receiver(post_delete, sender=Review)
+def decrease_autocomplete_popularity(sender, instance, **kwargs):
+    if in_bulk_changes():
+        return
+    autocomplete_index.add_popularity(instance.movie_id, -1)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=Review)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    # Good/Bad 数の更新など、検索対象のフィールドを含まない保存では索引を作り直さない
+    if update_fields is not None and not set(update_fields) & set(INDEXED_FIELDS[kind_of(sender)]):
+        return
+    index_object(instance)
+
+
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=Review)
+def remove_search_index(sender, instance, **kwargs):
+    if in_bulk_changes():
+        return
+    remove_object(sender, instance.pk)
+
+
+@receiver(post_save, sender=FavoriteMovie)
+@receiver(post_delete, sender=FavoriteMovie)
+def invalidate_favorites(sender, instance, **kwargs):
+    # 一覧ページのお気に入りの状態に使う、ユーザーごとの映画IDの集合を削除する
+    forget_favorites([instance.user_id])
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_for_stats(sender, instance, update_fields=None, **kwargs):
+    # 統計に変更した分だけを反映するため、保存前の投稿者、評価、Good/Bad 数を読み込んでおく
+    # （Good/Bad 数だけの更新は review_vote で反映するため読み込まない）
+    if instance._state.adding or (update_fields is not None and 'rating' not in update_fields):
+        return
+    instance._stats_previous = (
+        Review.objects.filter(pk=instance.pk).values_list('user_id', 'rating', 'good_count', 'bad_count').first()
+    )
+
+
+@receiver(post_save, sender=Review)
+def update_review_stats(sender, instance, created, **kwargs):
+    # 投稿したユーザーの統計に反映する
+    if created:
+        add_review(instance)
+        return
+    previous = instance.__dict__.pop('_stats_previous', None)
+    if previous is None:
+        return
+    user_id, rating, good_count, bad_count = previous
+    if user_id != instance.user_id:
+        # 投稿者が変わった場合は、両方のユーザーの分を数え直す
+        reconcile_users([user_id, instance.user_id])
+        return
+    # Good/Bad 数が F 式の場合（review_vote）は、review_vote で反映済み
+    good_delta = instance.good_count - good_count if isinstance(instance.good_count, int) else 0
+    bad_delta = instance.bad_count - bad_count if isinstance(instance.bad_count, int) else 0
+    change_review(user_id, Decimal(str(instance.rating)) - rating, good_delta, bad_delta)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_stats(sender, instance, origin=None, **kwargs):
+    # 一括操作では、呼び出し側で対象のユーザーの統計を数え直す
+    if in_bulk_changes():
+        return
+    if not (isinstance(origin, Review) or getattr(origin, 'model', None) is Review):
+        # 映画やユーザーの削除に伴う削除は、レビューごとではなく削除が終わったあとに投稿者ごとに1回で数え直す
+        _cascaded_review_users().add(instance.user_id)
+        return
+    add_review(instance, -1)
+    refresh_top_hashtags(instance.user_id)
+
+
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=User)
+def reconcile_cascaded_review_stats(sender, instance, **kwargs):
+    # レビューは映画やユーザーより先に削除されるため、この時点で削除されたレビューの投稿者が揃っている
+    user_ids = _cascaded_review_users()
+    if user_ids:
+        reconcile_users(list(user_ids))
+        user_ids.clear()
+
+
+@receiver(post_save, sender=Review)
+def update_movie_ratings(sender, instance, created, update_fields=None, **kwargs):
+    # 映画のレビュー数、評価の合計、ベイズ平均を数え直す。Good/Bad 数だけの更新では変わらない
+    if created or update_fields is None or 'rating' in update_fields:
+        refresh_movie_ratings([instance.movie_id])
+
+
+@receiver(post_delete, sender=Review)
+def remove_movie_ratings(sender, instance, **kwargs):
+    if in_bulk_changes():
+        return
+    refresh_movie_ratings([instance.movie_id])
+
+
+@receiver(post_save, sender=FavoriteMovie)
+def increase_favorite_stats(sender, instance, created, **kwargs):
+    if created:
+        add_favorite(instance.user_id, 1)
+
+
+@receiver(post_delete, sender=FavoriteMovie)
+def decrease_favorite_stats(sender, instance, **kwargs):
+    if in_bulk_changes():
+        return
+    add_favorite(instance.user_id, -1)
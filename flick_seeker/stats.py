@@ -0,0 +1,117 @@
+"""
+ユーザーごとの統計（UserStats）。
+
+マイページで集計せずに1行の読み込みで表示できるよう、レビュー、お気に入り、投票の書き込み時に変わった分だけを F 式で加える。
+統計の行がまだないユーザーは、表示するときに get_user_stats が集計して作成する（行がない間は加算しない）。
+一括操作のように多くの行をまとめて変更した場合は、呼び出し側で reconcile_users を呼んで数え直す。
+集計がずれた場合は reconcile_user_stats コマンドで全員分を数え直せる。
+"""
+from collections import defaultdict
+
+from django.db.models import Count, F, Sum
+
+from .models import FavoriteMovie, Review, ReviewHashtag, User, UserStats
+
+# 統計に保持する、よく使うハッシュタグの数
+TOP_HASHTAGS = 5
+
+
+def _update(user_id, **deltas):
+    # 統計の行に deltas を加える。行がない場合は何もしない（表示するときに集計されるため）
+    UserStats.objects.filter(user_id=user_id).update(**{name: F(name) + delta for name, delta in deltas.items()})
+
+
+def add_review(review, sign=1):
+    # レビューの投稿（sign=1）と削除（sign=-1）を反映する
+    _update(
+        review.user_id,
+        review_count=sign,
+        rating_sum=sign * review.rating,
+        good_received=sign * review.good_count,
+        bad_received=sign * review.bad_count,
+    )
+
+
+def change_review(user_id, rating_delta, good_delta, bad_delta):
+    # 投稿済みのレビューの評価や Good/Bad 数を変更した分を反映する
+    if rating_delta or good_delta or bad_delta:
+        _update(user_id, rating_sum=rating_delta, good_received=good_delta, bad_received=bad_delta)
+
+
+def add_favorite(user_id, delta):
+    _update(user_id, favorite_count=delta)
+
+
+def add_votes_received(user_id, good_delta, bad_delta):
+    # レビューの投稿者が受け取った Good/Bad 数の増減を反映する
+    if good_delta or bad_delta:
+        _update(user_id, good_received=good_delta, bad_received=bad_delta)
+
+
+def _top_hashtags(user_ids):
+    # ユーザーごとの、よく使うハッシュタグ（[ラベル, 件数] のリスト）を1回のクエリで集計する
+    rows = (
+        ReviewHashtag.objects.filter(review__user_id__in=user_ids)
+        .values_list('review__user_id', 'hashtag__label')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    by_user = defaultdict(list)
+    for user_id, label, n in rows:
+        by_user[user_id].append([label, n])
+    return {
+        user_id: sorted(labels, key=lambda item: (-item[1], item[0]))[:TOP_HASHTAGS]
+        for user_id, labels in by_user.items()
+    }
+
+
+def refresh_top_hashtags(user_id):
+    # レビューのハッシュタグを付け替えたときに、よく使うハッシュタグを集計し直す
+    UserStats.objects.filter(user_id=user_id).update(top_hashtags=_top_hashtags([user_id]).get(user_id, []))
+
+
+def reconcile_users(user_ids):
+    """
+    user_ids のユーザーの統計を集計して作り直す（行がない場合は作成する）。
+    ユーザーごとではなく、レビュー、お気に入り、ハッシュタグをそれぞれ1回のクエリでまとめて集計する。
+    """
+    user_ids = list(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    if not user_ids:
+        return
+    reviews = {
+        row['user_id']: row
+        for row in Review.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+            n=Count('id'), rating=Sum('rating'), good=Sum('good_count'), bad=Sum('bad_count'),
+        ).order_by()
+    }
+    favorites = dict(
+        FavoriteMovie.objects.filter(user_id__in=user_ids).values_list('user_id').annotate(n=Count('id')).order_by()
+    )
+    hashtags = _top_hashtags(user_ids)
+    stats = []
+    for user_id in user_ids:
+        row = reviews.get(user_id, {})
+        stats.append(UserStats(
+            user_id=user_id,
+            review_count=row.get('n', 0),
+            rating_sum=row.get('rating') or 0,
+            favorite_count=favorites.get(user_id, 0),
+            good_received=row.get('good') or 0,
+            bad_received=row.get('bad') or 0,
+            top_hashtags=hashtags.get(user_id, []),
+        ))
+    UserStats.objects.bulk_create(
+        stats,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['review_count', 'rating_sum', 'favorite_count', 'good_received', 'bad_received', 'top_hashtags', 'updated_at'],
+    )
+
+
+def get_user_stats(user):
+    # マイページなどで表示する統計。行がない場合は集計して作成する
+    stats = UserStats.objects.filter(user=user).first()
+    if stats is None:
+        reconcile_users([user.pk])
+        stats = UserStats.objects.get(user=user)
+    return stats
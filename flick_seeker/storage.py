@@ -0,0 +1,77 @@
+"""
+collectstatic 用のストレージ。
+ManifestStaticFilesStorage でファイル名にハッシュを付けたうえで、CSS を圧縮し、gzip / brotli の圧縮版を書き出す。
+brotli は Brotli パッケージがインストールされている場合のみ作成する。
+"""
+import gzip
+import re
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 圧縮して配信する価値のあるテキスト系の拡張子
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.txt', '.html', '.json', '.xml')
+# 圧縮しても元のサイズの95%より小さくならない場合は圧縮版を作らない
+MIN_COMPRESSION_RATIO = 0.95
+
+_CSS_STRING_OR_COMMENT_RE = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*(?!!).*?\*/', re.S)
+_CSS_STRING_RE = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')')
+_CSS_SPACE_AROUND_RE = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(css):
+    """
+    コメントと不要な空白を取り除く。文字列の中身と /*! で始まるコメントはそのまま残す。
+    セレクタの意味が変わらないよう、":" の前の空白は残す。
+    """
+    css = _CSS_STRING_OR_COMMENT_RE.sub(lambda m: m.group(1) or '', css)
+    parts = _CSS_STRING_RE.split(css)
+    # split の結果は偶数番目が文字列の外、奇数番目が文字列
+    for i in range(0, len(parts), 2):
+        text = re.sub(r'\s+', ' ', parts[i])
+        text = _CSS_SPACE_AROUND_RE.sub(r'\1', text)
+        text = re.sub(r':\s+', ':', text)
+        parts[i] = text.replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in paths:
+            names = [name]
+            hashed_name = self.hashed_files.get(self.hash_key(self.clean_name(name)))
+            if hashed_name and hashed_name != name:
+                names.append(hashed_name)
+            for target in names:
+                self.optimize(target)
+
+    def optimize(self, name):
+        if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        with self.open(name) as f:
+            content = f.read()
+        if name.endswith('.css'):
+            content = minify_css(content.decode('utf-8')).encode('utf-8')
+            self._write(name, content)
+        self._write_compressed(name + '.gz', content, gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            self._write_compressed(name + '.br', content, brotli.compress(content))
+
+    def _write_compressed(self, name, original, compressed):
+        if len(compressed) < len(original) * MIN_COMPRESSION_RATIO:
+            self._write(name, compressed)
+        elif self.exists(name):
+            # 以前の collectstatic で作られた圧縮版が残っていれば削除する
+            self.delete(name)
+
+    def _write(self, name, content):
+        with open(self.path(name), 'wb') as f:
+            f.write(content)
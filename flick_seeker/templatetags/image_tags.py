@@ -0,0 +1,35 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from ..images import get_image_info, stored_image_metadata
+
+register = template.Library()
+
+
+@register.simple_tag
+def lazy_image(image, alt='', css_class='', loading='lazy'):
+    """
+    画像を遅延読み込みする <img> タグを出力する。
+    width / height を指定してレイアウトのずれを防ぎ、読み込みが終わるまでは低画質のプレースホルダーを背景に表示する。
+    例: {% lazy_image movie.thumbnail alt=movie.title css_class="thumbnail" %}
+    """
+    if not image:
+        return ''
+    metadata = stored_image_metadata(image)
+    info = get_image_info(image)
+    attrs = [('src', image.url), ('alt', alt), ('loading', loading), ('decoding', 'async')]
+    if css_class:
+        attrs.append(('class', css_class))
+    # 寸法はモデルに保存されていればそれを使い、なければキャッシュから取得する
+    size = metadata or info
+    if size:
+        attrs += [('width', size['width']), ('height', size['height'])]
+    style = []
+    if metadata.get('color'):
+        # プレースホルダーの画像が表示されるまでの間は代表色で塗る
+        style.append(f"background-color: {metadata['color']};")
+    if info:
+        style.append(f"background-image: url({info['placeholder']}); background-size: cover;")
+    if style:
+        attrs.append(('style', ' '.join(style)))
+    return format_html('<img {}>', format_html_join(' ', '{}="{}"', attrs))
@@ -1,3 +1,1078 @@
-from django.test import TestCase
+import asyncio
+import math
+import os
+import tempfile
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import product
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.http import Http404
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, include, path, reverse
+from django.utils import timezone
+
+from . import async_views, moderation, perf, urls
+from .archive import archive_reactions, archive_review, get_or_restore_reaction, restore_review
+from .async_views import RECEIVE_SCOPE_KEY, movie_events
+from .autocomplete import AutocompleteIndex
+from .backends import user_cache_key
+from .broker import count_broker
+from .favorites import favorites_cache_key
+from .jobs import start_job
+from .models import ArchivedReaction, ArchivedReview, FavoriteMovie, Hashtag, Movie, Review, ReviewHashtag, ReviewReaction, SlowQuery, User, UserStats
+from .moderation import recount_reactions
+from .paginators import EstimatedCountPaginator
+from .stats import get_user_stats, reconcile_users
+from .ratelimit import debouncer, limiter
+from .search import SEARCH_RESULTS_FIELDS, search_movies
+from .search_index import search_filter
+from .views import REVIEW_PREVIEW_LENGTH, serve_media, with_comment_previews
+
+
+def wilson_lower_bound(good, bad, z=1.96):
+    # 参考になった度の期待値（Good の割合の信頼区間の下限）を Python で計算する
+    n = good + bad
+    if n == 0:
+        return 0.0
+    p = good / n
+    return (p + z * z / (2 * n) - z * math.sqrt((p * (1 - p) + z * z / (4 * n)) / n)) / (1 + z * z / n)
+
+
+def legacy_search(query=None, genres=(), situations=()):
+    # 以前の search_results と同じく、レビューとハッシュタグを結合して distinct で重複を除く検索
+    movies = Movie.objects.all()
+    condition = search_filter(Movie, query or '', SEARCH_RESULTS_FIELDS)
+    if condition is not None:
+        movies = movies.filter(condition)
+    if genres:
+        movies = movies.filter(
+            review__reviewhashtag__hashtag__label__in=genres,
+            review__reviewhashtag__hashtag__category='genre'
+        ).distinct()
+    if situations:
+        movies = movies.filter(
+            review__reviewhashtag__hashtag__label__in=situations,
+            review__reviewhashtag__hashtag__category='situation'
+        ).distinct()
+    return movies
+
+
+class SearchMoviesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = [User.objects.create_user(email=f'user{i}@example.com', username=f'user{i}', password='pw') for i in range(3)]
+        cls.user = users[0]
+        action = Hashtag.objects.create(label='#アクション', category='genre')
+        sf = Hashtag.objects.create(label='#SF', category='genre')
+        night = Hashtag.objects.create(label='#夜に観たい映画', category='situation')
+
+        def movie(title, director, ratings_and_tags):
+            movie = Movie.objects.create(title=title, plot='あらすじ', director=director, cast='出演者', release_year=2000)
+            for user, (rating, tags) in zip(users, ratings_and_tags):
+                review = Review.objects.create(user=user, movie=movie, rating=Decimal(rating), title='タイトル', comment='本文')
+                ReviewHashtag.objects.bulk_create([ReviewHashtag(review=review, hashtag=tag) for tag in tags])
+            return movie
+
+        # 平均 4.5（2件）、5.0（1件）、1.5、3.75（丸めると 3.8）、3.0（5.0 のレビューを含む）、レビューなし
+        cls.many = movie('スター・ウォーズ', 'ルーカス', [('5.0', [sf, night]), ('4.0', [sf])])
+        cls.single = movie('星の旅', 'ルーカス', [('5.0', [sf])])
+        cls.low = movie('アクション大作', '監督A', [('1.0', [action]), ('2.0', [action, night])])
+        cls.rounded = movie('スターの夜', '監督B', [('3.5', [night]), ('4.0', [])])
+        cls.mixed = movie('賛否両論', '監督C', [('5.0', [action]), ('1.0', [action])])
+        cls.empty = movie('未評価の映画', '監督D', [])
+
+    def ids(self, queryset):
+        return set(queryset.values_list('pk', flat=True))
+
+    def test_filters_match_join_and_distinct(self):
+        # キーワードとハッシュタグの条件は、EXISTS に変えても以前と同じ映画が見つかる
+        queries = [None, 'スター', 'ルーカス', 'すたー']
+        genres = [(), ('#SF',), ('#アクション',), ('#SF', '#アクション')]
+        situations = [(), ('#夜に観たい映画',)]
+        for query, genre, situation in product(queries, genres, situations):
+            with self.subTest(query=query, genres=genre, situations=situation):
+                self.assertEqual(
+                    self.ids(search_movies(query, genre, situation)),
+                    self.ids(legacy_search(query, genre, situation)),
+                )
+
+    def test_exists_filter_returns_each_movie_once(self):
+        # 複数のレビューが条件に一致しても、映画は1件だけ返る
+        movies = list(search_movies(genres=['#SF', '#アクション']))
+        self.assertEqual(len(movies), len(set(movie.pk for movie in movies)))
+
+    def test_average_rating_is_rounded_in_sql(self):
+        for movie in search_movies():
+            reviews = list(Review.objects.filter(movie=movie).values_list('rating', flat=True))
+            if not reviews:
+                self.assertIsNone(movie.average_rating)
+                continue
+            expected = (sum(reviews) / len(reviews)).quantize(Decimal('0.1'), rounding=ROUND_HALF_UP)
+            self.assertEqual(Decimal(str(movie.average_rating)), expected, movie.title)
+
+    def test_rating_threshold_applies_to_average(self):
+        # いずれかのレビューではなく、平均評価（小数第1位に丸めたもの）が条件以上の映画を返す
+        self.assertEqual(self.ids(search_movies(rating_from='4.5')), {self.many.pk, self.single.pk})
+        self.assertEqual(self.ids(search_movies(rating_from='3.8')), {self.many.pk, self.single.pk, self.rounded.pk})
+        self.assertNotIn(self.mixed.pk, self.ids(search_movies(rating_from='4')))
+
+    def test_invalid_rating_threshold_is_ignored(self):
+        self.assertEqual(self.ids(search_movies(rating_from='abc')), self.ids(Movie.objects.all()))
+
+    def test_bayesian_ordering(self):
+        # レビューが1件の 5.0 より、2件で平均 4.5 の映画が上に来る。レビューのない映画は最後
+        movies = list(search_movies())
+        self.assertLess(movies.index(self.many), movies.index(self.single))
+        self.assertEqual(movies[-1], self.empty)
+
+    def test_queryset_is_lazy_and_sliced_in_sql(self):
+        with self.assertNumQueries(0):
+            movies = search_movies('スター', ['#SF'], rating_from='3')
+        page = movies[:1]
+        self.assertIn('LIMIT 1', str(page.query))
+        with self.assertNumQueries(1):
+            self.assertEqual([movie.pk for movie in page], [self.many.pk])
+
+    def test_blank_query_is_ignored(self):
+        # 空白（全角を含む）だけの検索語は、条件のない検索と同じ結果になる
+        for query in ['   ', '\u3000', ' \u3000 ']:
+            with self.subTest(query=query):
+                self.assertEqual(self.ids(search_movies(query)), self.ids(Movie.objects.all()))
+
+    def test_search_results_view_with_blank_query(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('flick_seeker:search_results'), {'query': '\u3000'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['movies'].paginator.count, Movie.objects.count())
+
+    def test_search_results_view(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('flick_seeker:search_results'), {'genre': '#SF', 'rating_from': '4', 'sort': 'reviews'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([movie.pk for movie in response.context['movies']], [self.many.pk, self.single.pk])
+        self.assertContains(response, '4.5')
+
+
+class ServeMediaTests(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        for directory, name in [('movie_thumbnails', 'poster.png'), ('private', 'secret.txt')]:
+            os.makedirs(os.path.join(media_root.name, directory))
+            with open(os.path.join(media_root.name, directory, name), 'wb') as f:
+                f.write(b'data')
+        settings_override = override_settings(MEDIA_ROOT=media_root.name, MEDIA_SENDFILE=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get(self, path):
+        return serve_media(RequestFactory().get('/media/' + path), path)
+
+    def test_serves_allowed_directory(self):
+        self.assertEqual(self.get('movie_thumbnails/poster.png').status_code, 200)
+
+    def test_rejects_paths_outside_allowed_directories(self):
+        # ".." で許可したディレクトリの外に出るパスも、正規化した後のパスで判定して拒否する
+        for path in ['private/secret.txt', 'movie_thumbnails/../private/secret.txt', 'movie_thumbnails/../../etc/passwd', 'movie_thumbnails/..']:
+            with self.subTest(path=path):
+                with self.assertRaises(Http404):
+                    self.get(path)
+
+
+@override_settings(LIVE_UPDATES=True, LIVE_UPDATE_KEEPALIVE_SECONDS=0.05)
+class MovieEventsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='viewer@example.com', username='viewer', password='pw')
+        cls.movie = Movie.objects.create(title='映画', plot='あらすじ', director='監督', cast='出演者', release_year=2000)
+
+    async def stream(self, receive=None):
+        request = AsyncRequestFactory().get(f'/movie/{self.movie.pk}/events/')
+        request.user = self.user
+        if receive:
+            request.scope[RECEIVE_SCOPE_KEY] = receive
+        response = await movie_events(request, movie_id=self.movie.pk)
+        # 配信が終わらない場合はテストを失敗させる
+        return await asyncio.wait_for(self.read_all(response), timeout=5)
+
+    async def read_all(self, response):
+        return [chunk async for chunk in response.streaming_content]
+
+    @override_settings(LIVE_UPDATES=False)
+    async def test_not_found_when_live_updates_are_disabled(self):
+        with self.assertRaises(Http404):
+            await self.stream()
+
+    @override_settings(LIVE_UPDATE_STREAM_SECONDS=60)
+    async def test_stream_ends_when_client_disconnects(self):
+        async def receive():
+            await asyncio.sleep(0.2)
+            return {'type': 'http.disconnect'}
+
+        chunks = await self.stream(receive)
+        self.assertIn(b': keepalive\n\n', chunks)
+        self.assertFalse(count_broker.has_subscribers(self.movie.pk))
+
+    @override_settings(LIVE_UPDATE_STREAM_SECONDS=0.2)
+    async def test_stream_ends_after_lifetime(self):
+        await self.stream()
+        self.assertFalse(count_broker.has_subscribers(self.movie.pk))
+
+
+class AutocompleteIndexTests(TestCase):
+    def setUp(self):
+        def movie(title, director, cast):
+            return Movie.objects.create(title=title, plot='あらすじ', director=director, cast=cast, release_year=2000)
+
+        self.movies = [
+            movie('スター・ウォーズ', 'ルーカス', 'ハミル、フォード'),
+            movie('スターの夜', 'ルーカス', 'フォード'),
+            movie('Top Gun', 'スコット', 'クルーズ'),
+        ]
+        self.index = AutocompleteIndex()
+        self.index.build()
+
+    def assertSameAsScan(self, query):
+        # 短い入力で保持している順位が、索引を走査して数えた順位と一致する
+        suggestions = self.index.suggest(query)
+        scanned = self.index._scan_prefix(query, 10)
+        self.assertEqual(
+            [(s['kind'], s['label'], s['movie_id'], s['score']) for s in suggestions],
+            [(kind, display, movie_id, score) for (kind, display, movie_id), score in scanned],
+        )
+        return suggestions
+
+    def test_short_prefix_matches_scan_after_updates(self):
+        star_wars, star_night, top_gun = self.movies
+        self.index.add_popularity(star_night.pk, 3)
+        self.index.add_popularity(star_wars.pk, 1)
+        suggestions = self.assertSameAsScan('す')
+        self.assertEqual(suggestions[0]['movie_id'], star_night.pk)
+        # 監督は映画をまたいで人気度を合計する
+        self.assertEqual(self.assertSameAsScan('る')[0], {'label': 'ルーカス', 'kind': 'director', 'movie_id': None, 'score': 4})
+
+        star_night.title = '夜空'
+        self.index.update_movie(star_night)
+        self.assertNotIn('スターの夜', [s['label'] for s in self.assertSameAsScan('す')])
+        self.index.remove_movie(star_wars.pk)
+        self.assertEqual(self.assertSameAsScan('る')[0]['score'], 3)
+        self.assertEqual(self.assertSameAsScan('g')[0]['label'], 'Top Gun')
+
+
+@override_settings(BACKGROUND_JOB_WORKERS=0)
+class DeleteAccountTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.leaving = [
+            User.objects.create_user(email=f'{name}@example.com', username=name, password='pw') for name in ('alice', 'bob', 'leaving')
+        ]
+        self.movie = Movie.objects.create(title='映画', plot='あらすじ', director='監督', cast='出演者', release_year=2000)
+        self.other_movie = Movie.objects.create(title='別の映画', plot='あらすじ', director='監督', cast='出演者', release_year=2001)
+
+        def review(user, movie, rating):
+            return Review.objects.create(user=user, movie=movie, rating=Decimal(rating), title='タイトル', comment='本文')
+
+        self.alice_review = review(self.alice, self.movie, '4.0')
+        self.bob_review = review(self.bob, self.movie, '2.0')
+        leaving_review = review(self.leaving, self.movie, '5.0')
+        review(self.leaving, self.other_movie, '3.0')
+
+        # 削除するユーザーのリアクションは、通常のもの（alice へ）とアーカイブしたもの（bob へ）の両方を残す
+        ReviewReaction.objects.create(user=self.leaving, review=self.alice_review, rating_type='good')
+        ArchivedReaction.objects.create(user=self.leaving, review=self.bob_review, is_good=False)
+        ReviewReaction.objects.create(user=self.bob, review=self.alice_review, rating_type='good')
+        ReviewReaction.objects.create(user=self.alice, review=self.bob_review, rating_type='bad')
+        ArchivedReaction.objects.create(user=self.alice, review=self.bob_review, is_good=True)
+        ReviewReaction.objects.create(user=self.alice, review=leaving_review, rating_type='good')
+        FavoriteMovie.objects.create(user=self.leaving, movie=self.movie)
+
+        recount_reactions(Review.objects.values_list('pk', flat=True))
+        reconcile_users([self.alice.pk, self.bob.pk, self.leaving.pk])
+
+    def delete_leaving_user(self):
+        self.client.force_login(self.leaving)
+        response = self.client.post(reverse('flick_seeker:delete_user'), {'password': 'pw'})
+        self.assertRedirects(response, reverse('flick_seeker:top'), fetch_redirect_response=False)
+
+    def test_counters_of_other_reviews_match_remaining_reactions(self):
+        self.delete_leaving_user()
+        for review in Review.objects.all():
+            with self.subTest(review=review.pk):
+                good = (
+                    ReviewReaction.objects.filter(review=review, rating_type='good').count()
+                    + ArchivedReaction.objects.filter(review=review, is_good=True).count()
+                )
+                bad = (
+                    ReviewReaction.objects.filter(review=review, rating_type='bad').count()
+                    + ArchivedReaction.objects.filter(review=review, is_good=False).count()
+                )
+                self.assertEqual((review.good_count, review.bad_count), (good, bad))
+        self.alice_review.refresh_from_db()
+        self.bob_review.refresh_from_db()
+        self.assertEqual((self.alice_review.good_count, self.alice_review.bad_count), (1, 0))
+        self.assertEqual((self.bob_review.good_count, self.bob_review.bad_count), (1, 1))
+        # 参考になった度も残った Good/Bad 数から計算し直される
+        self.assertGreater(self.alice_review.helpfulness, 0)
+        self.assertEqual(UserStats.objects.get(user=self.alice).good_received, 1)
+        self.assertEqual(UserStats.objects.get(user=self.bob).bad_received, 1)
+
+    def test_movie_ratings_are_updated(self):
+        self.delete_leaving_user()
+        self.movie.refresh_from_db()
+        self.other_movie.refresh_from_db()
+        self.assertEqual((self.movie.review_count, self.movie.rating_sum), (2, Decimal('6.0')))
+        self.assertEqual((self.other_movie.review_count, self.other_movie.rating_sum, self.other_movie.bayesian_rating), (0, 0, 0))
+
+    def test_user_and_stats_are_removed(self):
+        self.assertTrue(UserStats.objects.filter(user=self.leaving).exists())
+        self.delete_leaving_user()
+        self.assertFalse(User.objects.filter(pk=self.leaving.pk).exists())
+        self.assertFalse(UserStats.objects.filter(user_id=self.leaving.pk).exists())
+        self.assertFalse(FavoriteMovie.objects.filter(user_id=self.leaving.pk).exists())
+
+
+class MergeMoviesTests(TestCase):
+    def setUp(self):
+        self.author, self.voter = [
+            User.objects.create_user(email=f'{name}@example.com', username=name, password='pw') for name in ('author', 'voter')
+        ]
+        self.target = Movie.objects.create(title='映画', plot='あらすじ', director='監督', cast='出演者', release_year=2000)
+        self.duplicate = Movie.objects.create(title='映画（重複）', plot='あらすじ', director='監督', cast='出演者', release_year=2000)
+
+    def review(self, user, movie, rating='4.0'):
+        return Review.objects.create(user=user, movie=movie, rating=Decimal(rating), title='タイトル', comment='本文')
+
+    def merge(self):
+        start_job('映画の統合', moderation.merge_movies, self.target, [self.duplicate], background=False)
+
+    def test_archived_review_is_moved_and_can_be_restored(self):
+        review = self.review(self.author, self.duplicate)
+        review_id = review.pk
+        ReviewReaction.objects.create(user=self.voter, review=review, rating_type='good')
+        archive_review(review)
+
+        self.merge()
+        self.assertFalse(Movie.objects.filter(pk=self.duplicate.pk).exists())
+        archived = ArchivedReview.objects.get(review_id=review_id)
+        self.assertEqual(archived.movie_id, self.target.pk)
+
+        restored = restore_review(archived)
+        self.assertIsNotNone(restored)
+        restored.refresh_from_db()
+        self.assertEqual((restored.movie_id, restored.good_count), (self.target.pk, 1))
+        self.target.refresh_from_db()
+        self.assertEqual(self.target.review_count, 1)
+
+    def test_archived_review_conflicting_with_target_is_dropped(self):
+        # レビューと同じく、統合先にレビューがあるユーザーの分は統合先のものを残す
+        self.review(self.voter, self.target)
+        archive_review(self.review(self.voter, self.duplicate))
+        kept = self.review(self.author, self.duplicate)
+        kept_id = kept.pk
+        archive_review(kept)
+
+        self.merge()
+        self.assertEqual(list(ArchivedReview.objects.values_list('review_id', flat=True)), [kept_id])
+        self.assertEqual(Review.objects.filter(movie=self.target).count(), 1)
+
+
+class WriteThrottlingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(email='author@example.com', username='author', password='pw')
+        cls.voter = User.objects.create_user(email='voter@example.com', username='voter', password='pw')
+        cls.movie = Movie.objects.create(title='映画', plot='あらすじ', director='監督', cast='出演者', release_year=2000)
+        cls.review = Review.objects.create(user=cls.author, movie=cls.movie, rating=Decimal('4.0'), title='タイトル', comment='本文')
+
+    def setUp(self):
+        # 制限の状態はプロセスごとのメモリにあるため、テストごとに空にする
+        for state in (limiter._buckets, debouncer._last):
+            state.clear()
+            self.addCleanup(state.clear)
+        self.client.force_login(self.voter)
+
+    def vote(self, vote_type):
+        return self.client.post(reverse('flick_seeker:review_vote', args=[self.review.pk, vote_type]))
+
+    def favorite(self, wanted):
+        return self.client.post(
+            reverse('flick_seeker:toggle_favorite', args=[self.movie.pk]),
+            {'movie_id': self.movie.pk, 'favorite': wanted}, content_type='application/json',
+        )
+
+    @override_settings(RATE_LIMITS={'review_vote': {'user': (0.5, 2)}}, TOGGLE_DEBOUNCE_SECONDS=0)
+    def test_rate_limit_returns_429_with_retry_after(self):
+        self.assertEqual(self.vote('good').status_code, 200)
+        self.assertEqual(self.vote('good').status_code, 200)
+        response = self.vote('good')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['status'], 'rate_limited')
+        self.assertEqual(response['Retry-After'], '2')
+
+    @override_settings(RATE_LIMITS={}, TOGGLE_DEBOUNCE_SECONDS=60)
+    def test_repeated_vote_is_debounced_but_changed_vote_is_not(self):
+        self.assertEqual(self.vote('good').json()['status'], 'created')
+        # 連打で同じ投票が続けて送られた場合は、取り消さずに現在のカウントを返す
+        response = self.vote('good').json()
+        self.assertEqual((response['status'], response['good_count']), ('debounced', 1))
+        # Good から Bad への付け替えは抑制しない
+        response = self.vote('bad').json()
+        self.assertEqual((response['status'], response['good_count'], response['bad_count']), ('updated', 0, 1))
+
+    @override_settings(RATE_LIMITS={}, TOGGLE_DEBOUNCE_SECONDS=60)
+    def test_failed_vote_does_not_block_retry(self):
+        self.client.raise_request_exception = False
+        with mock.patch('flick_seeker.views.get_or_restore_reaction', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('django.request', 'ERROR'):
+            self.assertEqual(self.vote('good').status_code, 500)
+        self.assertEqual(self.vote('good').json()['status'], 'created')
+
+    @override_settings(RATE_LIMITS={}, TOGGLE_DEBOUNCE_SECONDS=60)
+    def test_repeated_favorite_is_debounced_but_undo_is_not(self):
+        self.assertEqual(self.favorite(True).json(), {'status': 'success', 'is_favorite': True})
+        self.assertEqual(self.favorite(True).json(), {'status': 'debounced', 'is_favorite': True})
+        self.assertEqual(FavoriteMovie.objects.filter(user=self.voter).count(), 1)
+        self.assertEqual(self.favorite(False).json(), {'status': 'success', 'is_favorite': False})
+        self.assertFalse(FavoriteMovie.objects.filter(user=self.voter).exists())
+
+
+class ServerTimingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', username='user', password='pw')
+        cls.staff = User.objects.create_user(email='staff@example.com', username='staff', password='pw', is_staff=True)
+
+    def get(self, user=None):
+        if user:
+            self.client.force_login(user)
+        return self.client.get(reverse('flick_seeker:top'))
+
+    @override_settings(PERF_SERVER_TIMING=True)
+    def test_header_for_everyone_when_enabled(self):
+        self.assertIn('sql;dur=', self.get()['Server-Timing'])
+
+    @override_settings(PERF_SERVER_TIMING=False)
+    def test_no_header_for_anonymous_user_when_disabled(self):
+        self.assertNotIn('Server-Timing', self.get())
+
+    @override_settings(PERF_SERVER_TIMING=False)
+    def test_no_header_for_regular_user_when_disabled(self):
+        self.assertNotIn('Server-Timing', self.get(self.user))
+
+    @override_settings(PERF_SERVER_TIMING=False)
+    def test_header_for_staff_when_disabled(self):
+        self.assertIn('Server-Timing', self.get(self.staff))
+
+    @override_settings(PERF_SERVER_TIMING=False)
+    async def test_header_on_asgi(self):
+        # ASGI では request.user をスレッドで読み込んで判定する
+        response = await self.async_client.get(reverse('flick_seeker:top'))
+        self.assertNotIn('Server-Timing', response)
+        await sync_to_async(self.async_client.force_login)(self.staff)
+        response = await self.async_client.get(reverse('flick_seeker:top'))
+        self.assertIn('Server-Timing', response)
+
+
+@override_settings(PERF_SLOW_QUERY_MS=0, PERF_SLOW_QUERY_SAMPLE_RATE=0)
+class SlowQueryTests(TestCase):
+    def setUp(self):
+        perf.install_query_timer()
+        self.movie = Movie.objects.create(title='映画', plot='あらすじ', director='監督', cast='出演者', release_year=2000)
+
+    def run_queries(self):
+        # しきい値を 0 にして、すべてのクエリをスロークエリとして記録する
+        metrics, token = perf.start_request()
+        try:
+            for _ in range(3):
+                list(Movie.objects.filter(pk=self.movie.pk))
+            Movie.objects.filter(pk=self.movie.pk).update(title='映画')
+        finally:
+            perf.finish_request(token)
+        return metrics
+
+    def test_explain_runs_when_saving_once_per_fingerprint(self):
+        with mock.patch('flick_seeker.perf.explain_query', wraps=perf.explain_query) as explain:
+            metrics = self.run_queries()
+            # クエリの実行中には EXPLAIN しない
+            explain.assert_not_called()
+            self.assertEqual(len(metrics.slow_queries), 4)
+            perf.save_slow_queries(metrics, 'test')
+        self.assertEqual(explain.call_count, 2)
+
+        rows = list(SlowQuery.objects.order_by('id'))
+        self.assertEqual(len(rows), 4)
+        select_plans = {row.explain for row in rows if row.sql.startswith('SELECT')}
+        self.assertEqual(len(select_plans), 1)
+        self.assertIn(self.movie._meta.db_table, select_plans.pop())
+        # UPDATE の実行計画は取得しない
+        self.assertEqual([row.explain for row in rows if row.sql.startswith('UPDATE')], [''])
+
+    def test_saved_plan_is_reused(self):
+        perf.save_slow_queries(self.run_queries(), 'test')
+        with mock.patch('flick_seeker.perf.explain_query', wraps=perf.explain_query) as explain:
+            perf.save_slow_queries(self.run_queries(), 'test')
+        # 実行計画が保存されていない UPDATE だけ、もう一度 EXPLAIN を試みる
+        self.assertEqual(explain.call_count, 1)
+        self.assertEqual(SlowQuery.objects.exclude(explain='').count(), 6)
+
+
+class AsyncUrlconf:
+    # ASYNC_READ_VIEWS が True の場合と同じく、読み取りが中心のビューを非同期版にした URL 設定
+    urlpatterns = [path('screen_speak/', include((
+        [
+            URLPattern(pattern.pattern, getattr(async_views, pattern.name, pattern.callback), name=pattern.name)
+            if pattern.name in ('dashboard', 'search_results', 'movie_detail', 'all_movie_reviews') else pattern
+            for pattern in urls.urlpatterns
+        ],
+        'flick_seeker',
+    )))]
+
+
+class AsyncViewParityTests(TestCase):
+    """
+    非同期版のビューが、同期版と同じコンテキストで描画する。
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='viewer@example.com', username='viewer', password='pw')
+        sf = Hashtag.objects.create(label='#SF', category='genre')
+        cls.movies = []
+        for i in range(3):
+            movie = Movie.objects.create(title=f'スター{i}', plot='あらすじ', director='監督', cast='出演者', release_year=2000)
+            for j in range(i + 1):
+                author = User.objects.create_user(email=f'author{i}{j}@example.com', username=f'author{i}{j}', password='pw')
+                review = Review.objects.create(
+                    user=author, movie=movie, rating=Decimal('3.5') + j, title='タイトル', comment='本文' * 150, spoiler=j == 1,
+                )
+                ReviewHashtag.objects.create(review=review, hashtag=sf)
+            cls.movies.append(movie)
+        FavoriteMovie.objects.create(user=cls.user, movie=cls.movies[1])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    async def fetch(self, url, params):
+        sync_response = await sync_to_async(self.client.get)(url, params)
+        await sync_to_async(self.async_client.force_login)(self.user)
+        with override_settings(ROOT_URLCONF=AsyncUrlconf):
+            async_response = await self.async_client.get(url, params)
+            # resolver_match は参照したときに URL 設定から解決される
+            self.assertTrue(asyncio.iscoroutinefunction(async_response.resolver_match.func))
+        self.assertEqual(sync_response.status_code, 200)
+        self.assertEqual(async_response.status_code, 200)
+        return sync_response.context, async_response.context
+
+    def reviews(self, reviews):
+        return [(r.pk, r.comment_preview, r.comment_truncated, [h.hashtag.label for h in r.hashtags]) for r in reviews]
+
+    async def test_movie_detail(self):
+        movie = self.movies[1]
+        sync_context, async_context = await self.fetch(reverse('flick_seeker:movie_detail', args=[movie.pk]), {})
+        for key in ('movie', 'average_rating', 'all_reviews_count', 'is_favorited', 'favorites_count', 'live_updates'):
+            with self.subTest(key=key):
+                self.assertEqual(sync_context[key], async_context[key])
+        self.assertEqual(self.reviews(sync_context['reviews']), self.reviews(async_context['reviews']))
+
+    async def test_search_results(self):
+        params = {'query': 'スター', 'genre': '#SF', 'rating_from': '3', 'sort': 'reviews'}
+        sync_context, async_context = await self.fetch(reverse('flick_seeker:search_results'), params)
+        self.assertEqual(
+            [(m.pk, m.average_rating) for m in sync_context['movies']],
+            [(m.pk, m.average_rating) for m in async_context['movies']],
+        )
+        for key in ('query', 'selected_genres', 'rating_from', 'querystring', 'sort', 'sort_options'):
+            with self.subTest(key=key):
+                self.assertEqual(sync_context[key], async_context[key])
+
+    async def test_dashboard(self):
+        sync_context, async_context = await self.fetch(reverse('flick_seeker:dashboard'), {})
+        for key in ('movies', 'top_rated_movies', 'genres', 'situations'):
+            with self.subTest(key=key):
+                self.assertEqual(list(sync_context[key]), list(async_context[key]))
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.author, self.alice, self.bob = [
+            User.objects.create_user(email=f'{name}@example.com', username=name, password='pw') for name in ('author', 'alice', 'bob')
+        ]
+        self.movie = Movie.objects.create(title='映画', plot='あらすじ', director='監督', cast='出演者', release_year=2000)
+        self.review = Review.objects.create(user=self.author, movie=self.movie, rating=Decimal('4.0'), title='タイトル', comment='本文')
+        for state in (limiter._buckets, debouncer._last):
+            state.clear()
+            self.addCleanup(state.clear)
+
+    def counts(self):
+        self.review.refresh_from_db()
+        return self.review.good_count, self.review.bad_count
+
+    def vote(self, user, vote_type):
+        self.client.force_login(user)
+        with override_settings(RATE_LIMITS={}, TOGGLE_DEBOUNCE_SECONDS=0):
+            return self.client.post(reverse('flick_seeker:review_vote', args=[self.review.pk, vote_type])).json()
+
+    def test_archive_reactions_moves_old_reactions_in_batches(self):
+        ReviewReaction.objects.create(user=self.alice, review=self.review, rating_type='bad')
+        ReviewReaction.objects.create(user=self.bob, review=self.review, rating_type='good')
+        # 同じユーザーのアーカイブ済みのリアクションは、新しく移したもので上書きする
+        ArchivedReaction.objects.create(user=self.alice, review=self.review, is_good=True)
+        cutoff = timezone.now() + timedelta(seconds=1)
+        recent = ReviewReaction.objects.create(user=self.author, review=self.review, rating_type='good')
+        ReviewReaction.objects.filter(pk=recent.pk).update(created_at=cutoff + timedelta(days=1))
+
+        self.assertEqual(list(archive_reactions(cutoff, batch_size=1)), [1, 1])
+        self.assertEqual(list(ReviewReaction.objects.values_list('user_id', flat=True)), [self.author.pk])
+        self.assertEqual(
+            dict(ArchivedReaction.objects.values_list('user_id', 'is_good')), {self.alice.pk: False, self.bob.pk: True},
+        )
+
+    def test_get_or_restore_reaction(self):
+        ArchivedReaction.objects.create(user=self.alice, review=self.review, is_good=False)
+        reaction, created = get_or_restore_reaction(self.review, self.alice, 'good')
+        self.assertFalse(created)
+        self.assertEqual(reaction.rating_type, 'bad')
+        self.assertFalse(ArchivedReaction.objects.exists())
+        # 戻したあとは通常のリアクションとして見つかる
+        self.assertEqual(get_or_restore_reaction(self.review, self.alice, 'good'), (reaction, False))
+        reaction, created = get_or_restore_reaction(self.review, self.bob, 'good')
+        self.assertTrue(created)
+        self.assertEqual(reaction.rating_type, 'good')
+
+    def test_vote_on_archived_reaction_restores_then_toggles(self):
+        ArchivedReaction.objects.create(user=self.alice, review=self.review, is_good=True)
+        ArchivedReaction.objects.create(user=self.bob, review=self.review, is_good=True)
+        recount_reactions([self.review.pk])
+        self.assertEqual(self.counts(), (2, 0))
+
+        # 同じ投票は取り消し、異なる投票は付け替えになる
+        self.assertEqual(self.vote(self.alice, 'good')['good_count'], 1)
+        self.assertFalse(ReviewReaction.objects.filter(user=self.alice).exists())
+        self.assertEqual(self.vote(self.bob, 'bad')['bad_count'], 1)
+        self.assertEqual(ReviewReaction.objects.get(user=self.bob).rating_type, 'bad')
+        self.assertEqual(self.counts(), (0, 1))
+        self.assertFalse(ArchivedReaction.objects.exists())
+        recount_reactions([self.review.pk])
+        self.assertEqual(self.counts(), (0, 1))
+
+    def test_recount_reactions_counts_hot_and_archived(self):
+        ReviewReaction.objects.create(user=self.alice, review=self.review, rating_type='good')
+        ArchivedReaction.objects.create(user=self.bob, review=self.review, is_good=True)
+        ArchivedReaction.objects.create(user=self.author, review=self.review, is_good=False)
+        recount_reactions([self.review.pk])
+        self.assertEqual(self.counts(), (2, 1))
+        self.assertAlmostEqual(self.review.helpfulness, wilson_lower_bound(2, 1))
+
+    def test_archive_and_restore_review(self):
+        sf = Hashtag.objects.create(label='#SF', category='genre')
+        ReviewHashtag.objects.create(review=self.review, hashtag=sf)
+        ReviewReaction.objects.create(user=self.alice, review=self.review, rating_type='good')
+        ArchivedReaction.objects.create(user=self.bob, review=self.review, is_good=False)
+        recount_reactions([self.review.pk])
+        review_id, created_at = self.review.pk, self.review.created_at
+
+        archive_review(self.review)
+        self.assertFalse(Review.objects.filter(pk=review_id).exists())
+        self.assertFalse(ReviewReaction.objects.exists() or ArchivedReaction.objects.exists())
+        archived = ArchivedReview.objects.get(review_id=review_id)
+        self.assertEqual(archived.hashtag_ids, [sf.pk])
+        self.assertEqual(sorted(archived.reactions), sorted([[self.alice.pk, True], [self.bob.pk, False]]))
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.review_count, 0)
+
+        # 退会したユーザーのリアクションは戻さない
+        self.bob.delete()
+        restored = restore_review(archived)
+        restored.refresh_from_db()
+        self.assertEqual((restored.pk, restored.created_at, restored.rating), (review_id, created_at, Decimal('4.0')))
+        self.assertEqual(list(restored.reviewhashtag_set.values_list('hashtag_id', flat=True)), [sf.pk])
+        self.assertEqual((restored.good_count, restored.bad_count), (1, 0))
+        self.assertEqual(list(ArchivedReaction.objects.values_list('user_id', 'is_good')), [(self.alice.pk, True)])
+        self.assertFalse(ArchivedReview.objects.exists())
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.review_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.author).good_received, 1)
+
+    def test_restore_conflicting_with_new_review_is_refused(self):
+        archive_review(self.review)
+        archived = ArchivedReview.objects.get()
+        Review.objects.create(user=self.author, movie=self.movie, rating=Decimal('2.0'), title='書き直し', comment='本文')
+        self.assertIsNone(restore_review(archived))
+        self.assertTrue(ArchivedReview.objects.filter(pk=archived.pk).exists())
+        self.assertEqual(Review.objects.get(user=self.author, movie=self.movie).title, '書き直し')
+
+
+@override_settings(AUTHENTICATION_BACKENDS=['flick_seeker.backends.CachedModelBackend'])
+class CachedModelBackendTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='member@example.com', username='member', password='pw')
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client.force_login(self.user)
+
+    def mypage(self):
+        return self.client.get(reverse('flick_seeker:mypage'))
+
+    def test_user_is_cached_between_requests(self):
+        self.assertEqual(self.mypage().context['user'], self.user)
+        self.assertEqual(cache.get(user_cache_key(self.user.pk)), self.user)
+
+    def test_deactivated_user_is_anonymous_on_next_request(self):
+        self.assertEqual(self.mypage().status_code, 200)
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        response = self.mypage()
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+    def test_changed_user_is_reloaded_on_next_request(self):
+        self.assertEqual(self.mypage().context['user'].username, 'member')
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(self.mypage().context['user'].username, 'renamed')
+
+    def test_deleted_user_is_anonymous_on_next_request(self):
+        self.assertEqual(self.mypage().status_code, 200)
+        self.user.delete()
+        response = self.mypage()
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    class Paginator(EstimatedCountPaginator):
+        # テストでは少ない行数でも概算を使う
+        exact_count_limit = 0
+
+    def setUp(self):
+        movies = [
+            Movie.objects.create(title=f'映画{i}', plot='あらすじ', director='監督', cast='出演者', release_year=2000) for i in range(30)
+        ]
+        self.pks = [movie.pk for movie in movies]
+
+    def paginator(self):
+        return self.Paginator(Movie.objects.order_by('pk'), 10)
+
+    def test_partial_page_sets_exact_count_without_counting(self):
+        # 主キーの最大値は 30 のまま、行数は 25 にする
+        Movie.objects.filter(pk__in=self.pks[10:15]).delete()
+        paginator = self.paginator()
+        self.assertEqual((paginator.count, paginator.num_pages), (30, 3))
+        with CaptureQueriesContext(connection) as queries:
+            page = paginator.page(3)
+            self.assertEqual(len(page), 5)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+        self.assertEqual((paginator.count, paginator.num_pages, page.end_index()), (25, 3, 25))
+        self.assertFalse(page.has_next())
+
+    def test_empty_page_is_clamped_to_last_page(self):
+        Movie.objects.filter(pk__in=self.pks[10:20]).delete()
+        paginator = self.paginator()
+        self.assertEqual(paginator.num_pages, 3)
+        page = paginator.page(3)
+        self.assertEqual((paginator.count, paginator.num_pages, page.number), (20, 2, 2))
+        self.assertEqual([movie.pk for movie in page], self.pks[20:])
+        self.assertFalse(page.has_next())
+
+    def test_full_pages_keep_estimate(self):
+        paginator = self.paginator()
+        self.assertEqual(len(paginator.page(1)), 10)
+        self.assertTrue(paginator.count_is_estimate)
+        self.assertEqual(len(paginator.page(3)), 10)
+
+    def test_exact_count_below_limit(self):
+        Movie.objects.filter(pk__in=self.pks[10:15]).delete()
+        paginator = EstimatedCountPaginator(Movie.objects.order_by('pk'), 10)
+        self.assertEqual((paginator.count, paginator.count_is_estimate), (25, False))
+
+
+class FavoritesCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='fan@example.com', username='fan', password='pw')
+        self.movie, self.duplicate = [
+            Movie.objects.create(title=title, plot='あらすじ', director='監督', cast='出演者', release_year=2000) for title in ('映画', '映画（重複）')
+        ]
+        cache.clear()
+        self.addCleanup(cache.clear)
+        for state in (limiter._buckets, debouncer._last):
+            state.clear()
+            self.addCleanup(state.clear)
+        self.client.force_login(self.user)
+
+    def listed_favorites(self):
+        # 一覧ページの ♥ の表示に使う、コンテキストプロセッサーのお気に入りの映画IDの集合
+        response = self.client.get(reverse('flick_seeker:movie_list'))
+        return set(response.context['favorite_movie_ids'])
+
+    def is_favorited(self, movie):
+        return self.client.get(reverse('flick_seeker:movie_detail', args=[movie.pk])).context['is_favorited']
+
+    @override_settings(RATE_LIMITS={}, TOGGLE_DEBOUNCE_SECONDS=0)
+    def test_toggle_invalidates_cached_ids(self):
+        self.assertEqual(self.listed_favorites(), set())
+        self.assertIsNotNone(cache.get(favorites_cache_key(self.user.pk)))
+
+        for wanted, expected in ((True, {self.movie.pk}), (False, set())):
+            with self.subTest(favorite=wanted):
+                response = self.client.post(
+                    reverse('flick_seeker:toggle_favorite', args=[self.movie.pk]),
+                    {'movie_id': self.movie.pk, 'favorite': wanted}, content_type='application/json',
+                )
+                self.assertEqual(response.json()['is_favorite'], wanted)
+                self.assertEqual(self.listed_favorites(), expected)
+                self.assertEqual(self.is_favorited(self.movie), wanted)
+
+    def test_merge_movies_invalidates_cached_ids(self):
+        FavoriteMovie.objects.create(user=self.user, movie=self.duplicate)
+        self.assertEqual(self.listed_favorites(), {self.duplicate.pk})
+
+        start_job('映画の統合', moderation.merge_movies, self.movie, [self.duplicate], background=False)
+        self.assertEqual(self.listed_favorites(), {self.movie.pk})
+        self.assertTrue(self.is_favorited(self.movie))
+
+    @override_settings(BACKGROUND_JOB_WORKERS=0)
+    def test_account_deletion_invalidates_cached_ids(self):
+        FavoriteMovie.objects.create(user=self.user, movie=self.movie)
+        self.assertEqual(self.listed_favorites(), {self.movie.pk})
+        response = self.client.post(reverse('flick_seeker:delete_user'), {'password': 'pw'})
+        self.assertRedirects(response, reverse('flick_seeker:top'), fetch_redirect_response=False)
+        self.assertIsNone(cache.get(favorites_cache_key(self.user.pk)))
+
+
+class RatingsTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(email=f'user{i}@example.com', username=f'user{i}', password='pw') for i in range(3)
+        ]
+        self.movie = Movie.objects.create(title='映画', plot='あらすじ', director='監督', cast='出演者', release_year=2000)
+        for state in (limiter._buckets, debouncer._last):
+            state.clear()
+            self.addCleanup(state.clear)
+
+    def review(self, user, rating, movie=None):
+        return Review.objects.create(user=user, movie=movie or self.movie, rating=Decimal(rating), title='タイトル', comment='本文')
+
+    def totals(self, movie=None):
+        movie = movie or self.movie
+        movie.refresh_from_db()
+        return movie.review_count, movie.rating_sum, movie.bayesian_rating
+
+    def expected_bayesian(self, ratings):
+        # 事前分布のレビューが RATING_PRIOR_WEIGHT 件あるとみなした平均
+        weight, mean = settings.RATING_PRIOR_WEIGHT, settings.RATING_PRIOR_MEAN
+        return (weight * mean + sum(ratings)) / (weight + len(ratings))
+
+    def test_movie_totals_on_create_edit_and_delete(self):
+        self.assertEqual(self.totals(), (0, 0, 0.0))
+
+        first = self.review(self.users[0], '5.0')
+        count, total, bayesian = self.totals()
+        self.assertEqual((count, total), (1, Decimal('5.0')))
+        self.assertAlmostEqual(bayesian, self.expected_bayesian([5.0]))
+
+        first.rating = Decimal('1.0')
+        first.save()
+        count, total, bayesian = self.totals()
+        self.assertEqual((count, total), (1, Decimal('1.0')))
+        self.assertAlmostEqual(bayesian, self.expected_bayesian([1.0]))
+
+        second = self.review(self.users[1], '4.5')
+        count, total, bayesian = self.totals()
+        self.assertEqual((count, total), (2, Decimal('5.5')))
+        self.assertAlmostEqual(bayesian, self.expected_bayesian([1.0, 4.5]))
+
+        first.delete()
+        count, total, bayesian = self.totals()
+        self.assertEqual((count, total), (1, Decimal('4.5')))
+        self.assertAlmostEqual(bayesian, self.expected_bayesian([4.5]))
+
+        # レビューがなくなった映画は、事前分布の平均ではなく 0 になり、並べ替えで最後になる
+        second.delete()
+        self.assertEqual(self.totals(), (0, 0, 0.0))
+
+    @override_settings(RATING_PRIOR_MEAN=3.0, RATING_PRIOR_WEIGHT=10)
+    def test_few_reviews_are_pulled_toward_prior_mean(self):
+        popular = Movie.objects.create(title='人気の映画', plot='あらすじ', director='監督', cast='出演者', release_year=2001)
+        self.review(self.users[0], '5.0')
+        for user in self.users:
+            self.review(user, '4.5', movie=popular)
+        single = self.totals()[2]
+        self.assertGreater(single, 3.0)
+        self.assertLess(single, 5.0)
+        # 1件の 5.0 より、複数の 4.5 のほうが高く評価される
+        self.assertGreater(self.totals(popular)[2], single)
+
+    @override_settings(RATE_LIMITS={}, TOGGLE_DEBOUNCE_SECONDS=0)
+    def test_helpfulness_follows_votes(self):
+        review = self.review(self.users[0], '4.0')
+        review.refresh_from_db()
+        self.assertEqual(review.helpfulness, 0.0)
+
+        for voter, vote_type, counts in (
+            (self.users[1], 'good', (1, 0)),
+            (self.users[2], 'bad', (1, 1)),
+            (self.users[1], 'good', (0, 1)),  # 同じ投票で取り消す
+        ):
+            with self.subTest(voter=voter.username, vote_type=vote_type):
+                self.client.force_login(voter)
+                self.client.post(reverse('flick_seeker:review_vote', args=[review.pk, vote_type]))
+                review.refresh_from_db()
+                self.assertEqual((review.good_count, review.bad_count), counts)
+                self.assertAlmostEqual(review.helpfulness, wilson_lower_bound(*counts))
+
+
+class ReviewPreviewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='reader@example.com', username='reader', password='pw')
+        self.movie = Movie.objects.create(title='映画', plot='あらすじ', director='監督', cast='出演者', release_year=2000)
+        # 映画詳細ページには新しい3件だけが表示されるため、ちょうどの長さのものを最初に作る
+        self.exact, self.short, self.long, self.spoiler = [
+            Review.objects.create(
+                user=User.objects.create_user(email=f'{name}@example.com', username=name, password='pw'),
+                movie=self.movie, rating=Decimal('4.0'), title='タイトル', comment=comment, spoiler=name == 'spoiler',
+            )
+            for name, comment in (
+                ('exact', 'え' * REVIEW_PREVIEW_LENGTH),
+                ('short', '短い本文'),
+                ('long', 'あ' * REVIEW_PREVIEW_LENGTH + 'いいい'),
+                ('spoiler', '犯人は執事'),
+            )
+        ]
+        self.client.force_login(self.user)
+
+    def test_previews_are_truncated_without_loading_comment(self):
+        reviews = {review.pk: review for review in with_comment_previews(Review.objects.order_by('pk'))}
+        expected = {
+            self.short.pk: ('短い本文', False),
+            self.exact.pk: ('え' * REVIEW_PREVIEW_LENGTH, False),
+            self.long.pk: ('あ' * REVIEW_PREVIEW_LENGTH, True),
+            self.spoiler.pk: ('', False),  # ネタバレありのレビューは本文を含めない
+        }
+        self.assertEqual({pk: (review.comment_preview, review.comment_truncated) for pk, review in reviews.items()}, expected)
+        for review in reviews.values():
+            self.assertIn('comment', review.get_deferred_fields())
+
+    def test_pages_render_previews(self):
+        for name in ('movie_detail', 'all_movie_reviews'):
+            response = self.client.get(reverse(f'flick_seeker:{name}', args=[self.movie.pk]))
+            content = response.content.decode()
+            self.assertIn('あ' * REVIEW_PREVIEW_LENGTH + '…', content)
+            self.assertNotIn('いいい', content)
+            self.assertNotIn('犯人は執事', content)
+            self.assertIn('短い本文', content)
+            # 省略したレビューとネタバレありのレビューだけ、本文を取得するリンクを出す
+            for review, linked in ((self.exact, False), (self.short, False), (self.long, True), (self.spoiler, True)):
+                with self.subTest(page=name, review=review.comment[:4]):
+                    url = reverse('flick_seeker:review_body', args=[review.pk])
+                    self.assertEqual(f'data-url="{url}"' in content, linked)
+        self.assertIn('え' * REVIEW_PREVIEW_LENGTH + '</p>', content)
+
+    def test_review_body_returns_full_comment(self):
+        for review in (self.long, self.spoiler):
+            with self.subTest(review=review.comment[:4]):
+                response = self.client.get(reverse('flick_seeker:review_body', args=[review.pk]))
+                self.assertEqual(response.json(), {'comment': review.comment})
+
+    def test_review_body_errors(self):
+        self.assertEqual(self.client.get(reverse('flick_seeker:review_body', args=[0])).status_code, 404)
+        self.assertEqual(self.client.post(reverse('flick_seeker:review_body', args=[self.long.pk])).status_code, 405)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('flick_seeker:review_body', args=[self.long.pk])).status_code, 302)
+
+
+class UserStatsTests(TestCase):
+    STAT_FIELDS = ('review_count', 'rating_sum', 'favorite_count', 'good_received', 'bad_received', 'top_hashtags')
+
+    def setUp(self):
+        self.author, self.other = [
+            User.objects.create_user(email=f'{name}@example.com', username=name, password='pw') for name in ('author', 'other')
+        ]
+        self.movies = [
+            Movie.objects.create(title=f'映画{i}', plot='あらすじ', director='監督', cast='出演者', release_year=2000) for i in range(3)
+        ]
+        self.sf = Hashtag.objects.create(label='#SF', category='genre')
+        # 統計の行があるユーザーにだけ差分を加えるため、先に作っておく
+        for user in (self.author, self.other):
+            get_user_stats(user)
+
+    def review(self, user, movie, rating):
+        return Review.objects.create(user=user, movie=movie, rating=Decimal(rating), title='タイトル', comment='本文')
+
+    def stats(self, user):
+        return UserStats.objects.filter(user=user).values(*self.STAT_FIELDS).first()
+
+    def assertStatsMatchRecount(self, *users):
+        # 差分で更新した統計が、集計し直した結果と一致する
+        for user in users:
+            incremental = self.stats(user)
+            reconcile_users([user.pk])
+            self.assertEqual(incremental, self.stats(user))
+
+    def test_review_create_edit_and_delete(self):
+        review = self.review(self.author, self.movies[0], '3.0')
+        self.review(self.author, self.movies[1], '4.5')
+        self.assertEqual(self.stats(self.author)['rating_sum'], Decimal('7.5'))
+
+        # 評価の変更は、集計し直さずに差分だけを1回の UPDATE で加える
+        review.rating = Decimal('5.0')
+        with CaptureQueriesContext(connection) as queries:
+            review.save(update_fields=['rating'])
+        stats_queries = [q['sql'].split()[0] for q in queries if 'flick_seeker_userstats' in q['sql']]
+        self.assertEqual(stats_queries, ['UPDATE'])
+        self.assertEqual(self.stats(self.author)['rating_sum'], Decimal('9.5'))
+        review.title = '新しいタイトル'
+        review.save()
+        self.assertStatsMatchRecount(self.author)
+
+        review.delete()
+        self.assertEqual(self.stats(self.author)['review_count'], 1)
+        self.assertStatsMatchRecount(self.author)
+
+    def test_votes_and_favorites(self):
+        review = self.review(self.author, self.movies[0], '3.0')
+        self.client.force_login(self.other)
+        with override_settings(RATE_LIMITS={}, TOGGLE_DEBOUNCE_SECONDS=0):
+            self.client.post(reverse('flick_seeker:review_vote', args=[review.pk, 'good']))
+            self.client.post(reverse('flick_seeker:review_vote', args=[review.pk, 'bad']))
+        favorite = FavoriteMovie.objects.create(user=self.author, movie=self.movies[1])
+        self.assertEqual(
+            {key: self.stats(self.author)[key] for key in ('good_received', 'bad_received', 'favorite_count')},
+            {'good_received': 0, 'bad_received': 1, 'favorite_count': 1},
+        )
+        self.assertStatsMatchRecount(self.author, self.other)
+        favorite.delete()
+        self.assertEqual(self.stats(self.author)['favorite_count'], 0)
+
+    def test_hashtags(self):
+        for movie in self.movies[:2]:
+            review = self.review(self.author, movie, '4.0')
+            ReviewHashtag.objects.create(review=review, hashtag=self.sf)
+        reconcile_users([self.author.pk])
+        self.assertEqual(self.stats(self.author)['top_hashtags'], [['#SF', 2]])
+        Review.objects.get(user=self.author, movie=self.movies[0]).delete()
+        self.assertEqual(self.stats(self.author)['top_hashtags'], [['#SF', 1]])
+
+    def test_cascade_delete_reconciles_once_per_user(self):
+        movie = self.movies[0]
+        users = [User.objects.create_user(email=f'u{i}@example.com', username=f'u{i}', password='pw') for i in range(5)]
+        for user in users:
+            get_user_stats(user)
+            self.review(user, movie, '4.0')
+            self.review(user, self.movies[1], '2.0')
+
+        # 映画の削除に伴うレビューの削除では、レビューごとに統計を更新しない
+        with CaptureQueriesContext(connection) as queries:
+            movie.delete()
+        stats_updates = [q for q in queries if 'flick_seeker_userstats' in q['sql'] and q['sql'].startswith('UPDATE')]
+        self.assertEqual(stats_updates, [])
+        for user in users:
+            self.assertEqual(
+                (self.stats(user)['review_count'], self.stats(user)['rating_sum']), (1, Decimal('2.0')),
+            )
+        self.assertStatsMatchRecount(*users)
@@ -0,0 +1,53 @@
+"""
+検索用の日本語テキストの正規化と n-gram への分割。
+
+索引を作るときと検索するときの両方で同じ処理を通すことで、
+全角と半角、大文字と小文字、ひらがなとカタカナの違いを区別せずに検索できるようにする。
+漢字とかなの表記ゆれ（「戸締まり」と「戸締り」など）は辞書が必要になるため扱わない。
+"""
+import re
+import unicodedata
+
+# 記号や空白で区切られた文字の並び（漢字、かな、英数字）
+_RUN_RE = re.compile(r'\w+')
+
+# カタカナ（ァ〜ヶ）をひらがなに変換する表
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+
+
+def normalize_text(value):
+    """
+    NFKC で全角英数字と半角カタカナを揃え、大文字と小文字、カタカナとひらがなの違いをなくす。
+    連続する空白は1つにまとめる。
+    """
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKC', value).casefold().translate(_KATAKANA_TO_HIRAGANA)
+    return ' '.join(value.split())
+
+
+def ngrams(text):
+    """
+    正規化済みの文字列を、索引に登録する2文字ずつの語（bigram）に分割する。
+    1文字だけの検索語でも見つけられるよう、文字の並びの最後の1文字も登録する。
+    """
+    terms = []
+    for run in _RUN_RE.findall(text):
+        terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        terms.append(run[-1])
+    return terms
+
+
+def query_terms(word):
+    """
+    正規化済みの検索語を、索引を引くための語に分割する。
+    (bigram のリスト, 1文字だけの文字の並びのリスト) を返す。1文字のものはその文字で始まる語を探す。
+    """
+    bigrams = []
+    singles = []
+    for run in _RUN_RE.findall(word):
+        if len(run) == 1:
+            singles.append(run)
+        else:
+            bigrams.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return bigrams, singles
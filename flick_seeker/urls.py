@@ -1,8 +1,14 @@
 from django.urls import path  # DjangoのURLパターンを定義するためのモジュールから、path関数をインポート
 from django.contrib.auth import views as auth_views  # Djangoの認証システム関連のビューをインポート
 from django.urls import path, include  # URLパス関連の機能をインポート
-from .views import top, signup, login_view,  signup_complete, dashboard, movie_list, mypage, my_reviews, my_favorites,movie_register,movie_register_complete, movie_list, movie_detail, add_review, movie_detail_edit, review_vote, toggle_favorite, edit_review, all_movie_reviews, search_results, PasswordChangeView, PasswordChangeDoneView, delete_user, edit_profile, portfolio  # アプリケーションのビュー関数をインポート
+from .views import top, signup, login_view,  signup_complete, dashboard, movie_list, mypage, my_reviews, my_favorites,movie_register,movie_register_complete, movie_list, movie_detail, add_review, movie_detail_edit, review_vote, toggle_favorite, edit_review, all_movie_reviews, review_body, search_results, review_search, PasswordChangeView, PasswordChangeDoneView, delete_user, edit_profile, portfolio, perf_stats, autocomplete  # アプリケーションのビュー関数をインポート
 from . import views
+from .async_views import movie_events
+from django.conf import settings
+
+# ASGI で動かす場合は、読み取りが中心のビューを非同期版に切り替える
+if getattr(settings, 'ASYNC_READ_VIEWS', False):
+    from .async_views import dashboard, search_results, movie_detail, all_movie_reviews
 
 app_name = 'flick_seeker'  # アプリケーションの名前空間を設定
 
@@ -25,12 +31,17 @@ urlpatterns = [
     path('movie_detail_edit/<int:movie_id>/', movie_detail_edit, name='movie_detail_edit'), 
     path('review/<int:review_id>/vote/<str:vote_type>/', review_vote, name='review_vote'),
     path('movie/<int:movie_id>/toggle_favorite/', toggle_favorite, name='toggle_favorite'),
+    path('movie/<int:movie_id>/events/', movie_events, name='movie_events'),  # Good/Bad数とお気に入り数の配信（ASGIのみ）
     path('edit_review/<int:review_id>/', edit_review, name='edit_review'),
+    path('review/<int:review_id>/body/', review_body, name='review_body'),  # 省略したレビュー本文の取得
     # path('movie_reviews/<int:movie_id>/', movie_reviews, name='movie_reviews'),
     path('all_movie_reviews/<int:movie_id>/', all_movie_reviews, name='all_movie_reviews'),
     path('search_results/', search_results, name='search_results'),
+    path('search/reviews/', review_search, name='review_search'),  # レビューのキーワード検索
+    path('search/autocomplete/', autocomplete, name='autocomplete'),  # 検索ボックスの入力補完
     path('password_change/', PasswordChangeView.as_view(), name='password_change'),
     path('password_change/done/', PasswordChangeDoneView.as_view(), name='password_change_done'),
     path('delete_user/', delete_user, name='delete_user'),
     path('edit_profile/', edit_profile, name='edit_profile'),
+    path('perf_stats/', perf_stats, name='perf_stats'),  # スタッフ専用のパフォーマンス計測結果ページ
 ]
\ No newline at end of file
@@ -1,4 +1,5 @@
 import uuid  # 一意のID生成のためのライブラリ
+import json
 from django.contrib.auth.models import User
 from django.contrib.auth.views import LoginView, PasswordChangeView as BasePasswordChangeView, PasswordChangeDoneView as BasePasswordChangeDoneView
 from django.shortcuts import render, redirect,get_object_or_404  # HTMLテンプレートをレンダリングとリダイレクトのための関数、オブジェクトを取得、なければ404エラーを返す
@@ -8,14 +9,49 @@ from .forms import CustomUserCreationForm, PasswordForm, MovieForm, ReviewForm,
 from django.urls import reverse_lazy, reverse  
 from django.contrib import messages  # メッセージフレームワーク
 from django.contrib.auth import get_user_model, logout  
-from django.db import IntegrityError  # データベース整合性エラー
+from django.db import IntegrityError, transaction  # データベース整合性エラー、トランザクション
 from django.http import HttpResponse, JsonResponse  # HTTPレスポンス、Jsonレスポンスを生成する関数
-from django.db.models import Avg, F, Count, Q, Prefetch  
+from django.db.models import F, Count, Q, Prefetch, Case, When, Value, TextField
+from django.db.models.functions import Substr
 import pdb
 import logging
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, require_safe
+from django.contrib.admin.views.decorators import staff_member_required  # スタッフ専用ページのためのデコレータ
+from .perf import metrics_store  # パフォーマンス計測の集計結果
+from .broker import count_broker  # Good/Bad数とお気に入り数の配信
+from django.conf import settings
+from .fileserving import ServedFile  # メディアファイルの配信
+from .autocomplete import autocomplete_index  # 検索ボックスの入力補完
+from .search_index import review_search_filter  # 日本語に対応した n-gram の索引による検索
+from .search import search_movies, with_average_rating  # 映画の検索のクエリの組み立て
+from django.core.paginator import Paginator
+from .jobs import start_job  # 時間のかかる処理をバックグラウンドで実行する
+from .moderation import delete_account
+from .favorites import favorite_movie_ids  # ユーザーごとのお気に入りの映画IDの集合
+from .archive import archive_review, get_or_restore_reaction  # 古いリアクションと削除したレビューのアーカイブ
+from .ratelimit import debouncer, rate_limit  # 書き込みを行うビューのリクエスト数の制限
+from .stats import add_votes_received, get_user_stats, refresh_top_hashtags  # ユーザーごとの統計
+from .ratings import helpfulness  # レビューの参考になった度
+from django.utils._os import safe_join
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404
+from urllib.parse import quote
+import os
 
 User = get_user_model()  # 現在アクティブなユーザーモデルを取得
+SEARCH_RESULTS_PER_PAGE = 20  # 映画の検索結果の1ページあたりの件数
+REVIEW_SEARCH_PER_PAGE = 20  # レビュー検索の1ページあたりの件数
+REVIEW_PREVIEW_LENGTH = 200  # 映画詳細ページとレビュー一覧で最初に表示するレビュー本文の文字数
+# 並べ替えの選択肢（sort パラメータの値: (表示名, 並べ替えに使うフィールド)）。最初のものが既定になる
+MOVIE_SORT_ORDERS = {
+    'rating': ('評価の高い順', ('-bayesian_rating', '-id')),
+    'reviews': ('レビューの多い順', ('-review_count', '-id')),
+    'newest': ('新しく登録された順', ('-id',)),
+}
+REVIEW_SORT_ORDERS = {
+    'newest': ('新しい順', ('-created_at',)),
+    'helpful': ('参考になった順', ('-helpfulness', '-created_at')),
+}
 logger = logging.getLogger(__name__)
 
 def portfolio(request):
@@ -63,7 +99,31 @@ class CustomLoginView(LoginView):
 
 login_view = CustomLoginView.as_view()
     
-@login_required(login_url='screen_speak:login')
+def page_querystring(request):
+    # ページ移動のリンクに、ページ以外の条件を引き継ぐ
+    params = request.GET.copy()
+    params.pop('page', None)
+    return params.urlencode()
+
+def sort_options(request, orders):
+    """
+    sort パラメータで選ばれた並べ替えのフィールドと、並べ替えのリンクを表示するためのコンテキストを返す。
+    指定がない場合や、選択肢にない値の場合は最初の並べ替えを使う。
+    """
+    sort = request.GET.get('sort')
+    if sort not in orders:
+        sort = next(iter(orders))
+    # 並べ替えのリンクに、並べ替えとページ以外の条件を引き継ぐ
+    params = request.GET.copy()
+    params.pop('sort', None)
+    params.pop('page', None)
+    return orders[sort][1], {
+        'sort': sort,
+        'sort_options': [(key, label) for key, (label, _) in orders.items()],
+        'sort_querystring': params.urlencode(),
+    }
+
+@login_required(login_url='flick_seeker:login')
 def dashboard(request):
     # ダッシュボードビューが呼び出されたらメッセージをクリア
     # これにより、前のリクエストから残っているメッセージは表示されない
@@ -78,16 +138,20 @@ def dashboard(request):
     
     # お気に入り数で注釈した映画リストから、最大3件のみを取得します。
     movies = Movie.objects.annotate(favorites_count=Count('favoritemovie')).order_by('-favorites_count')[:3]
+    # ベイズ平均の評価が高い映画（索引の順に3件だけ読む）
+    top_rated_movies = with_average_rating(Movie.objects.order_by('-bayesian_rating'))[:3]
 
     # コンテキストにジャンルとシチュエーションを追加
     context = {
         'movies': movies,
+        'top_rated_movies': top_rated_movies,
+        'movie_sort_options': [(key, label) for key, (label, _) in MOVIE_SORT_ORDERS.items()],
         'genres': genres,
         'situations': situations,
     }
     return render(request, 'dashboard.html', context)
 
-@login_required(login_url='screen_speak:login')
+@login_required(login_url='flick_seeker:login')
 def search_results(request):
     # 検索条件を取得
     query = request.GET.get('query')
@@ -95,53 +159,67 @@ def search_results(request):
     selected_situations = request.GET.getlist('situation')
     rating_from = request.GET.get('rating_from')
 
-    # 基本の映画クエリセット
-    movies_qs = Movie.objects.all()
-
-    # キーワードによる検索
-    if query:
-        movies_qs = movies_qs.filter(
-            Q(title__icontains=query) |
-            Q(director__icontains=query) |
-            Q(cast__icontains=query)
-        )
-
-    # ジャンルによるフィルタリング
-    if selected_genres:
-        movies_qs = movies_qs.filter(
-            review__reviewhashtag__hashtag__label__in=selected_genres,
-            review__reviewhashtag__hashtag__category='genre'
-        ).distinct()
-
-    # シチュエーションによるフィルタリング
-    if selected_situations:
-        movies_qs = movies_qs.filter(
-            review__reviewhashtag__hashtag__label__in=selected_situations,
-            review__reviewhashtag__hashtag__category='situation'
-        ).distinct()
-
-    # 評価によるフィルタリング
-    if rating_from:
-        movies_qs = movies_qs.filter(review__rating__gte=rating_from).distinct()
-
-    # 映画の平均レーティングで注釈
-    movies_qs = movies_qs.annotate(average_rating=Avg('review__rating'))
-    
-    # 平均評価を小数点第一位まで四捨五入
-    for movie in movies_qs:
-        movie.average_rating = round(movie.average_rating, 1) if movie.average_rating else 0
+    # 条件、平均評価の丸め、並べ替えを SQL で行うクエリセットを組み立て、表示するページの分だけを読み込む
+    ordering, sort_context = sort_options(request, MOVIE_SORT_ORDERS)
+    movies_qs = search_movies(query, selected_genres, selected_situations, rating_from, ordering)
+    movies = Paginator(movies_qs, SEARCH_RESULTS_PER_PAGE).get_page(request.GET.get('page'))
     
     # 検索結果をコンテキストに追加
     context = {
-        'movies': movies_qs,
+        'movies': movies,
         'query': query,
         'selected_genres': selected_genres,
         'selected_situations': selected_situations,
         'rating_from': rating_from,
+        'querystring': page_querystring(request),
+        **sort_context,
     }
 
     return render(request, 'search_results.html', context)
 
+@login_required
+@require_safe
+def review_search(request):
+    """
+    レビューのタイトルと本文をキーワードで検索するビュー。ハッシュタグ（すべてを含むもの）で絞り込める。
+    ネタバレありのレビューは、spoiler=include のときだけ本文も検索し、spoiler=exclude のときは結果から除く。
+    """
+    query = request.GET.get('query', '').strip()
+    spoiler = request.GET.get('spoiler', '')
+    selected_hashtags = [int(value) for value in request.GET.getlist('hashtag') if value.isdigit()]
+
+    reviews = None
+    if query or selected_hashtags:
+        reviews_qs = Review.objects.all()
+        condition = review_search_filter(query, include_spoilers=spoiler == 'include')
+        if condition is not None:
+            reviews_qs = reviews_qs.filter(condition)
+        if spoiler == 'exclude':
+            reviews_qs = reviews_qs.filter(spoiler=False)
+        # 結合すると同じレビューが重複するため、ハッシュタグごとにサブクエリで絞り込む
+        for hashtag_id in selected_hashtags:
+            reviews_qs = reviews_qs.filter(pk__in=ReviewHashtag.objects.filter(hashtag_id=hashtag_id).values('review_id'))
+        reviews_qs = reviews_qs.select_related('user', 'movie').prefetch_related(
+            Prefetch(
+                'reviewhashtag_set',
+                queryset=ReviewHashtag.objects.select_related('hashtag'),
+                to_attr='hashtags'
+            )
+        ).order_by('-created_at', '-id')
+        reviews = Paginator(reviews_qs, REVIEW_SEARCH_PER_PAGE).get_page(request.GET.get('page'))
+
+    context = {
+        'reviews': reviews,
+        'query': query,
+        'spoiler': spoiler,
+        'selected_hashtags': selected_hashtags,
+        'genre_hashtags': Hashtag.objects.filter(category='genre').order_by('label'),
+        'situation_hashtags': Hashtag.objects.filter(category='situation').order_by('label'),
+        # ページ移動のリンクに検索条件を引き継ぐ
+        'querystring': page_querystring(request),
+    }
+    return render(request, 'review_search.html', context)
+
 @login_required
 def movie_list(request):
     # 映画一覧ページのビュー。データベースから映画のリストを取得し表示
@@ -169,37 +247,60 @@ def movie_register(request):
 def movie_register_complete(request):
     return render(request, 'movie_register_complete.html')
 
+def with_comment_previews(reviews):
+    """
+    レビュー本文（comment）を読み込まずに、先頭の REVIEW_PREVIEW_LENGTH 文字だけを comment_preview に設定したリストを返す。
+    ネタバレありのレビューは本文を含めない。省略した本文は、表示するときに review_body から取得する。
+    """
+    # 1文字多く取得して、省略したかどうかを判定する
+    reviews = list(reviews.defer('comment').annotate(comment_head=Case(
+        When(spoiler=True, then=Value('')),
+        default=Substr('comment', 1, REVIEW_PREVIEW_LENGTH + 1),
+        output_field=TextField(),
+    )))
+    for review in reviews:
+        review.comment_preview = review.comment_head[:REVIEW_PREVIEW_LENGTH]
+        review.comment_truncated = len(review.comment_head) > REVIEW_PREVIEW_LENGTH
+    return reviews
+
+@login_required
+@require_safe
+def review_body(request, review_id):
+    # 映画詳細ページなどで省略したレビュー本文（ネタバレを含む）を返す
+    review = get_object_or_404(Review.objects.only('comment'), pk=review_id)
+    return JsonResponse({'comment': review.comment})
+
 @login_required
 def movie_detail(request, movie_id):
     # 映画詳細ページのビュー。指定されたIDの映画の詳細情報を表示
-    movie = get_object_or_404(Movie, pk=movie_id)
-    reviews = Review.objects.filter(movie=movie).prefetch_related(
+    movie = get_object_or_404(with_average_rating(Movie.objects.all()), pk=movie_id)
+    reviews = Review.objects.filter(movie=movie).select_related('user').prefetch_related(
         Prefetch(
             'reviewhashtag_set',
             queryset=ReviewHashtag.objects.select_related('hashtag'),
             to_attr='hashtags'
         )
     ).order_by('-created_at')
-    all_reviews_count = Review.objects.filter(movie=movie).count()  # 全てのレビュー数をカウント
-    average_rating = reviews.aggregate(Avg('rating'))['rating__avg'] 
+    # レビュー数と平均評価は、レビューの書き込み時に映画に保存した集計を使う（平均評価は SQL で丸めたもの）
+    all_reviews_count = movie.review_count
+    average_rating = movie.average_rating
     
-    # Noneでなければ、小数点第一位まで四捨五入します。
-    if average_rating is not None:
-        average_rating = round(average_rating, 1)   # 平均評価がある場合に丸める
-        
-    else:
+    if average_rating is None:
         # レビューがない場合は "評価なし" を表示するため、テンプレートに渡す前に適切な値に設定します。
         average_rating = "評価なし"
         
-    # お気に入り状態を確認
-    is_favorited = FavoriteMovie.objects.filter(user=request.user, movie=movie).exists()
+    # お気に入り状態を確認（キャッシュしたお気に入りの映画IDの集合から判定する）
+    is_favorited = movie.id in favorite_movie_ids(request.user)
+    favorites_count = FavoriteMovie.objects.filter(movie=movie).count()  # お気に入り数
 
     context = {
         'movie': movie,
-        'reviews': reviews,
+        'reviews': with_comment_previews(reviews[:3]),  # 最初の3件のレビュー（本文は先頭だけ）
         'average_rating': average_rating,
         'all_reviews_count': all_reviews_count,
         'is_favorited': is_favorited,  # お気に入り状態をコンテキストに追加
+        'favorites_count': favorites_count,
+        'live_updates': settings.LIVE_UPDATES,  # Good/Bad数などをリアルタイムに更新するか
     }
 
     return render(request, 'movie_detail.html', context)
@@ -224,10 +325,10 @@ def mypage(request):
     # マイページのビュー。ログインユーザーの情報を表示
     user = request.user
 
-    # マイページに必要なデータを辞書に格納
+    # マイページに必要なデータを辞書に格納（統計は書き込み時に集計済みの1行を読み込む）
     context = {
         'user': user,
-        # 他の必要なデータを追加
+        'stats': get_user_stats(user),
     }
 
     return render(request, 'mypage.html', context)
@@ -245,6 +346,11 @@ def my_favorites(request):
     favorites = FavoriteMovie.objects.filter(user=request.user)
     return render(request, 'my_favorites.html', {'favorites': favorites})
 
+def save_review_hashtags(review, hashtags):
+    # フォームで検証済みのハッシュタグを1回のクエリで関連付ける
+    ReviewHashtag.objects.bulk_create([ReviewHashtag(review=review, hashtag=hashtag) for hashtag in hashtags])
+    refresh_top_hashtags(review.user_id)
+
 @login_required
 def add_review(request, movie_id):
     movie = get_object_or_404(Movie, pk=movie_id)
@@ -266,13 +372,11 @@ def add_review(request, movie_id):
             review = form.save(commit=False)
             review.movie = movie
             review.user = request.user
-            review.save()
-            
-            # ハッシュタグのIDリストを取得し、ReviewHashtagオブジェクトを作成
-            selected_hashtags_ids = request.POST.getlist('hashtags')
-            for hashtag_id in selected_hashtags_ids:
-                hashtag = Hashtag.objects.get(id=hashtag_id)
-                ReviewHashtag.objects.create(review=review, hashtag=hashtag)
+            # レビューと検索の索引（保存時のシグナルで更新）、ハッシュタグをまとめて保存する
+            with transaction.atomic():
+                review.save()
+                # 選択されたハッシュタグのReviewHashtagオブジェクトを作成
+                save_review_hashtags(review, form.cleaned_data['hashtags'])
                 
             messages.success(request, 'レビューが正常に投稿されました。')
             return redirect('flick_seeker:movie_detail', movie_id=movie.id)
@@ -309,25 +413,23 @@ def edit_review(request, review_id):
         
         if 'save' in request.POST:
             if form.is_valid():
-                # まず、既存の関連するハッシュタグをすべて削除します。
-                ReviewHashtag.objects.filter(review=review).delete()
-                
-                # フォームを保存
-                updated_review = form.save()
-            
-                # 新しいハッシュタグの関連付けを作成します。
-                selected_hashtags_ids = request.POST.getlist('hashtags')
-                for hashtag_id in selected_hashtags_ids:
-                    hashtag = Hashtag.objects.get(id=hashtag_id)
-                    ReviewHashtag.objects.create(review=updated_review, hashtag=hashtag)
+                with transaction.atomic():
+                    # まず、既存の関連するハッシュタグをすべて削除します。
+                    ReviewHashtag.objects.filter(review=review).delete()
+
+                    # フォームを保存（タイトルと本文が変わった場合だけ検索の索引が作り直される）
+                    updated_review = form.save()
+
+                    # 新しいハッシュタグの関連付けを作成します。
+                    save_review_hashtags(updated_review, form.cleaned_data['hashtags'])
                 
             # ユーザーに成功メッセージを表示します。
             messages.success(request, 'レビューが更新されました。')
             return redirect('flick_seeker:my_reviews')
                 
         elif 'delete' in request.POST:
-            # レビューの削除
-            review.delete()
+            # レビューの削除（管理画面から元に戻せるようアーカイブに移す）
+            archive_review(review)
             messages.success(request, 'レビューを削除しました。')
             return redirect('flick_seeker:my_reviews')
 
@@ -348,34 +450,53 @@ def edit_review(request, review_id):
     }
     return render(request, 'edit_review.html', context)
 
+@login_required
 @require_POST
+@rate_limit('review_vote')
 def review_vote(request, review_id, vote_type):
      # ログ出力
     print(f"Vote view called with review_id: {review_id}, vote_type: {vote_type}")
     
     review = get_object_or_404(Review, pk=review_id)
-    reaction, created = ReviewReaction.objects.get_or_create(
-        review=review,
-        user=request.user,
-        defaults={'rating_type': vote_type}
-    )
+
+    # 同じレビューへの同じ投票が続けて送られた場合（連打など）は、書き込まずに現在のカウントを返す
+    # （Good から Bad への付け替えは、続けて送られても抑制しない）
+    debounce_key = f'review_vote:{request.user.pk}:{review.pk}:{vote_type}'
+    if debouncer.is_bouncing(debounce_key, settings.TOGGLE_DEBOUNCE_SECONDS):
+        return JsonResponse({
+            'status': 'debounced',
+            'good_count': review.good_count,
+            'bad_count': review.bad_count
+        })
+
+    # 古い投票はアーカイブに移されているため、見つかった場合はアーカイブから戻して既存の投票として扱う
+    reaction, created = get_or_restore_reaction(review, request.user, vote_type)
 
     # 投票が既に存在していた場合
     if not created:
         if reaction.rating_type == vote_type:
             # 同じ投票をしていた場合、その投票を取り消す
             reaction.delete()
-            review.good_count = F('good_count') - 1 if vote_type == 'good' else F('good_count')
-            review.bad_count = F('bad_count') - 1 if vote_type == 'bad' else F('bad_count')
+            good_delta = -1 if vote_type == 'good' else 0
+            bad_delta = -1 if vote_type == 'bad' else 0
         else:
             # 異なる投票をしていた場合、投票を変更する
             reaction.rating_type = vote_type
             reaction.save()
-            review.good_count = F('good_count') + 1 if vote_type == 'good' else F('good_count') - 1
-            review.bad_count = F('bad_count') + 1 if vote_type == 'bad' else F('bad_count') - 1
-        review.save(update_fields=['good_count', 'bad_count'])
+            good_delta = 1 if vote_type == 'good' else -1
+            bad_delta = -good_delta
+        review.good_count = F('good_count') + good_delta
+        review.bad_count = F('bad_count') + bad_delta
+        # 参考になった度も同じ UPDATE で更新する（右辺の F は更新前の値を参照するため、増減を加えた値から計算する）
+        review.helpfulness = helpfulness(review.good_count, review.bad_count)
+        review.save(update_fields=['good_count', 'bad_count', 'helpfulness'])
         # 更新されたカウントを取得するためにリフレッシュ
         review.refresh_from_db()
+        # レビューの投稿者が受け取った Good/Bad 数に反映する
+        add_votes_received(review.user_id, good_delta, bad_delta)
+        debouncer.record(debounce_key)
+        # 同じ映画のページを見ている他のユーザーにカウントを配信
+        count_broker.publish_review_counts(review.movie_id, review.id, review.good_count, review.bad_count)
         return JsonResponse({
             'status': 'updated',
             'good_count': review.good_count,
@@ -384,11 +505,20 @@ def review_vote(request, review_id, vote_type):
 
     # 新しい投票を作成した場合
     else:
-        review.good_count = F('good_count') + 1 if vote_type == 'good' else F('good_count')
-        review.bad_count = F('bad_count') + 1 if vote_type == 'bad' else F('bad_count')
-        review.save(update_fields=['good_count', 'bad_count'])
+        good_delta = 1 if vote_type == 'good' else 0
+        bad_delta = 1 if vote_type == 'bad' else 0
+        review.good_count = F('good_count') + good_delta
+        review.bad_count = F('bad_count') + bad_delta
+        # 参考になった度も同じ UPDATE で更新する（右辺の F は更新前の値を参照するため、増減を加えた値から計算する）
+        review.helpfulness = helpfulness(review.good_count, review.bad_count)
+        review.save(update_fields=['good_count', 'bad_count', 'helpfulness'])
         # 更新されたカウントを取得するためにリフレッシュ
         review.refresh_from_db()
+        # レビューの投稿者が受け取った Good/Bad 数に反映する
+        add_votes_received(review.user_id, good_delta, bad_delta)
+        debouncer.record(debounce_key)
+        # 同じ映画のページを見ている他のユーザーにカウントを配信
+        count_broker.publish_review_counts(review.movie_id, review.id, review.good_count, review.bad_count)
         return JsonResponse({
             'status': 'created',
             'good_count': review.good_count,
@@ -412,32 +542,56 @@ def movie_reviews(request, movie_id):
 @login_required       
 def all_movie_reviews(request, movie_id):
     movie = get_object_or_404(Movie, pk=movie_id)
-    reviews = Review.objects.filter(movie=movie).prefetch_related(
+    # 新しい順、または参考になった順（映画と参考になった度の索引を使う）に並べる
+    ordering, sort_context = sort_options(request, REVIEW_SORT_ORDERS)
+    reviews = Review.objects.filter(movie=movie).select_related('user').prefetch_related(
         Prefetch(
             'reviewhashtag_set', 
             queryset=ReviewHashtag.objects.select_related('hashtag'),
             to_attr='hashtags'
         )
-    ).order_by('-created_at')
-    return render(request, 'all_movie_reviews.html', {'movie': movie, 'reviews': reviews})       
+    ).order_by(*ordering)
+    return render(request, 'all_movie_reviews.html', {'movie': movie, 'reviews': with_comment_previews(reviews), 'live_updates': settings.LIVE_UPDATES, **sort_context})       
         
 @login_required
 @require_POST
+@rate_limit('toggle_favorite')
 def toggle_favorite(request, movie_id):
     """
     ユーザーが映画をお気に入りに追加または削除するビュー。
     存在しない映画IDに対しては404を返す。
     """
     movie = get_object_or_404(Movie, pk=movie_id)
-    favorite, created = FavoriteMovie.objects.get_or_create(user=request.user, movie=movie)
+    is_favorite = movie.id in favorite_movie_ids(request.user)
+
+    # 操作後の状態（ボタンが送る favorite、送られない場合は現在の状態の反対）
+    try:
+        wanted = json.loads(request.body or b'{}').get('favorite')
+    except (ValueError, AttributeError):
+        wanted = None
+    if not isinstance(wanted, bool):
+        wanted = not is_favorite
+
+    # 同じ状態への操作が続けて送られた場合（連打など）は、書き込まずに現在の状態を返す
+    debounce_key = f'toggle_favorite:{request.user.pk}:{movie.pk}:{wanted}'
+    if debouncer.is_bouncing(debounce_key, settings.TOGGLE_DEBOUNCE_SECONDS):
+        return JsonResponse({
+            'status': 'debounced',
+            'is_favorite': is_favorite
+        })
 
-    if not created:
-        # 既にお気に入りが存在する場合、お気に入りから削除
-        favorite.delete()
-        is_favorite = False
+    if wanted:
+        # お気に入りに追加（既に追加されている場合はそのまま）
+        FavoriteMovie.objects.get_or_create(user=request.user, movie=movie)
     else:
-        # 新規にお気に入りに追加された場合は、そのまま
-        is_favorite = True
+        # お気に入りから削除（削除されていた場合はそのまま）
+        FavoriteMovie.objects.filter(user=request.user, movie=movie).delete()
+    is_favorite = wanted
+    debouncer.record(debounce_key)
+
+    # このページを見ているユーザーがいる場合のみ、お気に入り数を数えて配信
+    if count_broker.has_subscribers(movie.id):
+        count_broker.publish_favorites_count(movie.id, FavoriteMovie.objects.filter(movie=movie).count())
 
     return JsonResponse({
         'status': 'success',
@@ -457,7 +611,12 @@ def delete_user(request):
     if request.method == 'POST':
         form = UserDeleteConfirmForm(request.user, request.POST)
         if form.is_valid():
-            request.user.delete()
+            user = request.user
+            # 削除が終わるまでの間にログインできないよう、先に無効にする
+            user.is_active = False
+            user.save(update_fields=['is_active'])
+            # レビューやリアクションが多いと時間がかかるため、バックグラウンドでバッチごとに削除する
+            start_job(f'アカウントの削除（ユーザーID {user.pk}）', delete_account, user.pk)
             messages.success(request, 'アカウントが正常に削除されました。')
             logout(request)
             return redirect('flick_seeker:top')  
@@ -476,4 +635,57 @@ def edit_profile(request):
     else:
         form = CustomUserChangeForm(instance=request.user)
 
-    return render(request, 'edit_profile.html', {'form': form})
\ No newline at end of file
+    return render(request, 'edit_profile.html', {'form': form})
+
+@staff_member_required
+def perf_stats(request):
+    # URL名ごとのパフォーマンス計測結果を表示するスタッフ専用ページ
+    if request.method == 'POST' and 'reset' in request.POST:
+        metrics_store.reset()
+        messages.success(request, '計測結果をリセットしました。')
+        return redirect('flick_seeker:perf_stats')
+
+    return render(request, 'perf_stats.html', {'rows': metrics_store.summary()})
+
+@require_safe
+def serve_media(request, path):
+    """
+    本番環境でアップロードされた映画のサムネイルとプロフィール画像を配信するビュー。
+    MEDIA_SENDFILE を設定した場合は、X-Sendfile / X-Accel-Redirect でプロキシにファイルの送信を任せる。
+    """
+    # 配信を許可したディレクトリ以外のファイルと、MEDIA_ROOT の外を指すパスは返さない
+    # （".." で許可したディレクトリの外に出るパスも拒否するため、正規化した後のパスで判定する）
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not any(full_path.startswith(safe_join(settings.MEDIA_ROOT, directory) + os.sep) for directory in settings.MEDIA_SERVE_DIRS):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    served_file = ServedFile(full_path, f'public, max-age={settings.MEDIA_MAX_AGE}', precompressed=False)
+    offload = None
+    if settings.MEDIA_SENDFILE == 'x-sendfile' and full_path.isascii():
+        # X-Sendfile はファイルシステムのパスをそのまま渡すため、ヘッダーに書けない日本語のファイル名は自分で返す
+        offload = ('X-Sendfile', full_path)
+    elif settings.MEDIA_SENDFILE == 'x-accel-redirect':
+        relative_path = os.path.relpath(full_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        offload = ('X-Accel-Redirect', settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(relative_path))
+    return served_file.response(request, offload)
+
+@login_required
+@require_safe
+def autocomplete(request):
+    # 検索ボックスの入力補完。映画のタイトル、監督、出演者の候補を人気順にJSONで返す
+    query = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), settings.AUTOCOMPLETE_MAX_LIMIT)
+    except ValueError:
+        limit = 10
+    autocomplete_index.ensure_fresh()
+    suggestions = autocomplete_index.suggest(query, limit)
+    for suggestion in suggestions:
+        if suggestion['movie_id']:
+            suggestion['url'] = reverse('flick_seeker:movie_detail', args=[suggestion['movie_id']])
+    return JsonResponse({'query': query, 'suggestions': suggestions})
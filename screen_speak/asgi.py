@@ -2,6 +2,11 @@
 ASGI config for screen_speak project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+It loads ``screen_speak.settings`` unless DJANGO_SETTINGS_MODULE is set. To
+deploy with the async read views and live updates, set
+DJANGO_SETTINGS_MODULE=screen_speak.settings_asgi in the deployment config.
+The application is wrapped so that the Server-Sent Events view can notice
+client disconnects.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -13,4 +18,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'screen_speak.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from flick_seeker.async_views import expose_receive  # noqa: E402 (must be imported after the app registry is ready)
+
+application = expose_receive(django_application)
@@ -0,0 +1,15 @@
+"""
+ASGI (uvicorn / daphne など) で screen_speak を動かすための設定。
+
+本番環境の設定を読み込み、読み取りが中心のビューを非同期版に切り替える。
+screen_speak/asgi.py の既定は開発用の設定のため、デプロイの設定で環境変数を指定して使う。
+例: DJANGO_SETTINGS_MODULE=screen_speak.settings_asgi uvicorn screen_speak.asgi:application --workers 4
+"""
+
+from .settings_production import *  # noqa: F401,F403
+
+# dashboard, search_results, movie_detail, all_movie_reviews を非同期版にする
+ASYNC_READ_VIEWS = True
+
+# 映画ページの Good/Bad 数とお気に入り数をリアルタイムに更新する
+LIVE_UPDATES = True
@@ -0,0 +1,58 @@
+"""
+CI とベンチマークのための、起動とテストが速い設定。
+
+開発用の設定を読み込み、次の点を変更する。
+- データベースは共有キャッシュのインメモリ SQLite（ディスクに書き込まない）。テストのデータベースはマイグレーションを実行せずに作る
+- パスワードのハッシュは MD5（テストでユーザーを作るたびに PBKDF2 を計算しない）
+- デバッグ用のログ（SQL の出力を含む）を止め、警告以上だけを出力する
+- 開発用の django_extensions を読み込まない（起動時に pygments を読み込むため）
+- テストは screen_speak.test_runner.FastTestRunner で、CPU の数だけ並列に実行する
+例: python manage.py test --settings=screen_speak.settings_fast
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app != 'django_extensions']  # noqa: F405
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        # 同じプロセスの接続（バックグラウンドジョブのスレッドを含む）で1つのデータベースを共有する
+        'NAME': 'file:screen_speak?mode=memory&cache=shared',
+        'TEST': {
+            # マイグレーションのデータの移行は既存の行のためのものなので、テストではモデルから直接テーブルを作る
+            'MIGRATE': False,
+        },
+    }
+}
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+# settings.py の logging.basicConfig で付けたルートロガーの DEBUG 出力も、ここで置き換える
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'level': 'WARNING',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        # 404 や 429 などのレスポンスの警告は、テストで意図して発生させるため出力しない
+        'django.request': {
+            'level': 'ERROR',
+        },
+    },
+}
+
+# 一括操作とアカウントの削除はリクエストの中で実行する（テストの終了時にスレッドが残らないようにする）
+BACKGROUND_JOB_WORKERS = 0
+
+TEST_RUNNER = 'screen_speak.test_runner.FastTestRunner'
@@ -15,7 +15,7 @@ from pathlib import Path
 
 import logging
 # ロギングの設定
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -47,7 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'flick_seeker.middleware.PerformanceMiddleware',  # 全体の処理時間を計測するため先頭に配置
     'django.middleware.security.SecurityMiddleware',
+    'flick_seeker.middleware.StaticFilesMiddleware',  # collectstatic したファイルを配信する
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -69,6 +71,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'flick_seeker.context_processors.favorites',  # 表示中の映画のお気に入りの状態
             ],
         },
     },
@@ -133,12 +136,46 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'flick_seeker/static'),
 ]
 
+# collectstatic でファイルを集める場所
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# ファイル名にハッシュを付け、CSS の圧縮と gzip / brotli の圧縮版の作成を行う
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'flick_seeker.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# StaticFilesMiddleware が返す Cache-Control の max-age（秒）
+STATIC_MAX_AGE_HASHED = 60 * 60 * 24 * 365  # ハッシュ付きのファイル名
+STATIC_MAX_AGE = 60  # ハッシュなしのファイル名
+
 # ログイン後のリダイレクト先を設定
 LOGIN_REDIRECT_URL = 'flick_seeker:dashboard'
 
 # カスタムユーザーモデルを指定
 AUTH_USER_MODEL = 'flick_seeker.User'
 
+# 本番環境では複数のワーカープロセスでキャッシュを共有するため、ファイルに保存する
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    },
+}
+
+# セッションはキャッシュから読み込み、キャッシュにない場合のみデータベースを参照する
+# 期限切れのセッションは cleanup_sessions コマンドで削除する
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# ログイン中のユーザーもキャッシュから読み込む
+AUTHENTICATION_BACKENDS = ['flick_seeker.backends.CachedModelBackend']
+USER_CACHE_TIMEOUT = 300  # ユーザーをキャッシュする秒数
+FAVORITES_CACHE_TIMEOUT = 60 * 60 * 24  # お気に入りの映画IDの集合をキャッシュする秒数（追加、削除時にも削除する）
+
 LOGGING = {
     'disable_existing_loggers': False,
     'version': 1,
@@ -146,23 +183,27 @@ LOGGING = {
         'console': {
             # logging handler that outputs log messages to terminal
             'class': 'logging.StreamHandler',
-            'level': 'DEBUG', # message level to be written to console
+            'level': 'INFO', # message level to be written to console
         },
     },
     'loggers': {
         '': {
-            # this sets root level logger to log debug and higher level
-            # logs to console. All other loggers inherit settings from
-            # root level logger.
+            # 本番環境ではINFO以上のみ出力する
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': 'INFO',
             'propagate': False, # this tells logger to send logging message
                                 # to its parent (will send if set to True)
         },
         'django.db': {
-            # django also has database level logging
+            # 全SQLのDEBUG出力は処理が重くなるため、警告以上のみ出力する
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        'flick_seeker.slow_query': {
+            # しきい値を超えたクエリをサンプリングして出力する
+            'handlers': ['console'],
+            'level': 'WARNING',
             'propagate': False,
         },
     },
@@ -171,4 +212,52 @@ LOGGING = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# DEBUG が False のときに serve_media で配信するメディアのディレクトリ
+MEDIA_SERVE_DIRS = ['movie_thumbnails', 'profile_images']
+MEDIA_MAX_AGE = 60 * 60 * 24 * 30  # メディアの Cache-Control の max-age（秒）
+# プロキシにファイルの送信を任せる方法（None / 'x-sendfile' / 'x-accel-redirect'）
+MEDIA_SENDFILE = None
+# 'x-accel-redirect' の場合に、nginx の internal な location に対応させるパスの接頭辞
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
 LOGIN_URL = '/screen_speak/login/'
+
+# パフォーマンス計測の設定
+PERF_SLOW_QUERY_MS = 100  # このミリ秒以上かかったクエリをスロークエリとして扱う
+PERF_SLOW_QUERY_SAMPLE_RATE = 0.1  # スロークエリをログに出力する割合（0.0〜1.0）
+PERF_MAX_SAMPLES = 1000  # URL名ごとに保持する直近のサンプル数
+PERF_SLOW_QUERY_KEEP = 500  # SlowQuery テーブルに保持する最大件数
+PERF_SERVER_TIMING = False  # True の場合はすべてのレスポンスに Server-Timing ヘッダーを付ける（False でもスタッフには付ける）
+
+# True の場合、読み取りが中心のビューに非同期版を使う（ASGI で動かす場合のみ有効にする）
+ASYNC_READ_VIEWS = False
+
+# True の場合、映画ページで Good/Bad 数とお気に入り数を Server-Sent Events で受け取る（ASGI で動かす場合のみ有効にする）
+LIVE_UPDATES = False
+LIVE_UPDATE_BATCH_SECONDS = 0.5  # この秒数の間の更新を1件のメッセージにまとめる
+LIVE_UPDATE_KEEPALIVE_SECONDS = 15  # 更新がない場合に接続維持のメッセージを送る間隔
+LIVE_UPDATE_STREAM_SECONDS = 300  # 1つの接続で配信を続ける最長の秒数（切断はブラウザの EventSource が再接続する）
+
+# 検索ボックスの入力補完
+AUTOCOMPLETE_REBUILD_SECONDS = 300  # 他のプロセスでの変更を反映するため、索引を作り直す間隔（秒）
+AUTOCOMPLETE_MAX_LIMIT = 20  # 1回に返す候補の最大数
+AUTOCOMPLETE_SHORT_PREFIX_LENGTH = 2  # この文字数以下の入力は、候補の人気度の合計を入力ごとに保持しておく
+
+# 管理画面の一括操作などのバックグラウンドジョブ
+BACKGROUND_JOB_WORKERS = 2  # ジョブを実行するスレッド数（0 の場合はリクエストの中で実行する）
+BULK_ACTION_SYNC_LIMIT = 1000  # この件数以下の一括操作はリクエストの中で実行する
+BULK_ACTION_BATCH_SIZE = 500  # 一括操作で1回のクエリで扱う件数
+
+# この日数より前のリアクションを archive_reactions コマンドでアーカイブに移す
+REACTION_ARCHIVE_DAYS = 90
+
+# 映画のベイズ平均の評価で使う事前分布（レビューが RATING_PRIOR_WEIGHT 件あるとみなし、その平均を RATING_PRIOR_MEAN とする）
+RATING_PRIOR_MEAN = 3.0
+RATING_PRIOR_WEIGHT = 10
+
+# 書き込みを行うビューのリクエスト数の制限（(1秒あたりに補充する回数, 連続で許可する回数) をユーザーごと、IPアドレスごとに指定する）
+RATE_LIMITS = {
+    'review_vote': {'user': (1, 10), 'ip': (5, 50)},
+    'toggle_favorite': {'user': (1, 10), 'ip': (5, 50)},
+}
+TOGGLE_DEBOUNCE_SECONDS = 1.0  # 同じ対象への同じ操作（Good/Bad、お気に入りの追加や削除）が続けて送られた場合、この秒数の間は1回にまとめる
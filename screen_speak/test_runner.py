@@ -0,0 +1,22 @@
+"""
+settings_fast で使うテストランナー。
+"""
+import time
+
+from django.test.runner import DiscoverRunner, get_max_test_processes
+
+
+class FastTestRunner(DiscoverRunner):
+    """
+    --parallel を指定しない場合も CPU の数だけ並列に実行し、最後に全体の実行時間を表示する。
+    """
+
+    def __init__(self, parallel=0, **kwargs):
+        super().__init__(parallel=parallel or get_max_test_processes(), **kwargs)
+
+    def run_tests(self, test_labels, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().run_tests(test_labels, **kwargs)
+        finally:
+            self.log(f'テスト全体の実行時間: {time.perf_counter() - started:.2f}秒')
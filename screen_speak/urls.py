@@ -1,8 +1,9 @@
 from django.contrib import admin  # Djangoの管理サイト機能をインポート
-from django.urls import path, include  # URLパターン定義のための関数をインポート
+from django.urls import path, re_path, include  # URLパターン定義のための関数をインポート
 from django.conf import settings
 from django.conf.urls.static import static
-from flick_seeker.views import portfolio
+from flick_seeker.views import portfolio, serve_media
+import re
 
 
 urlpatterns = [
@@ -13,4 +14,9 @@ urlpatterns = [
 ]
 
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+else:
+    # 本番環境ではアップロードされた画像をキャッシュヘッダー付きで配信する
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_media, name='media'),
+    ]